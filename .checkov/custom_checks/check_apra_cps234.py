@@ -6,45 +6,12 @@
 
 from __future__ import annotations
 
-import ast
-import re
-
 from checkov.common.models.enums import CheckCategories, CheckResult
 from checkov.terraform.checks.resource.base_resource_check import BaseResourceCheck
 
-VALID_DATA_CLASSIFICATIONS = {"public", "internal", "confidential", "restricted"}
-
-
-def _resolve_tags(conf: dict) -> dict:
-    """Extract a tags dict from a resource conf, handling merge() expressions.
+from tag_resolver import known_tag, resolve_tags
 
-    Checkov resolves variable references and locals but cannot evaluate Terraform
-    built-in functions such as merge(). When a resource uses:
-        tags = merge(local._effective_default_tags, lookup(each.value, "tags", {}))
-    checkov stores a string like:
-        "${merge(${merge({'key': 'val', ...}, {})}, lookup(...))}"
-    This helper extracts all non-nested dict literals from that string and merges
-    them so the check can validate tags guaranteed by local._effective_default_tags.
-    """
-    tags = conf.get("tags", [{}])
-    if isinstance(tags, list):
-        tags = tags[0] if tags else {}
-
-    if isinstance(tags, dict):
-        return tags
-
-    # tags is a string expression — extract all non-nested dict literals
-    tags_str = str(tags)
-    merged: dict = {}
-    for match in re.findall(r"\{[^{}]*\}", tags_str):
-        try:
-            candidate = ast.literal_eval(match)
-            if isinstance(candidate, dict):
-                merged.update(candidate)
-        except (ValueError, SyntaxError):
-            pass
-
-    return merged
+VALID_DATA_CLASSIFICATIONS = {"public", "internal", "confidential", "restricted"}
 
 
 class APRADataClassificationCheck(BaseResourceCheck):
@@ -58,11 +25,9 @@ class APRADataClassificationCheck(BaseResourceCheck):
         super().__init__(name=name, id=id, categories=categories, supported_resources=supported_resources)
 
     def scan_resource_conf(self, conf: dict) -> CheckResult:
-        tags = _resolve_tags(conf)
+        tags = resolve_tags(conf)
 
-        classification = tags.get("DataClassification", [None])
-        if isinstance(classification, list):
-            classification = classification[0] if classification else None
+        classification = known_tag(tags, "DataClassification")
 
         if classification and str(classification).lower() in VALID_DATA_CLASSIFICATIONS:
             return CheckResult.PASSED
@@ -0,0 +1,266 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0.
+# Shared tag resolver for the custom checks in this directory.
+# Evaluates the Terraform expressions Checkov leaves unrendered in tags, memoized per expression.
+
+from __future__ import annotations
+
+import ast
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Mapping
+
+# Distinct tag expressions kept resolved. A repository usually has a handful of
+# default-tag expressions shared by thousands of resources.
+CACHE_SIZE = 4096
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<string>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+    | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    | (?P<interpolation>\$\{)
+    | (?P<name>[A-Za-z_][\w-]*(?:\.(?:[A-Za-z_][\w-]*|\d+))*)
+    | (?P<punctuation>[(){}\[\],:=])
+    | (?P<other>\S)
+    """,
+    re.VERBOSE,
+)
+
+KEYWORDS = {"true": True, "True": True, "false": False, "False": False, "null": None, "None": None}
+
+
+class Reference(str):
+    """A value Checkov could not render, such as var.owner or each.value["tags"], kept as its source text."""
+
+
+class ExpressionError(ValueError):
+    """The expression uses syntax the resolver does not evaluate."""
+
+
+def tokenize(expression: str) -> list[tuple[str, Any]]:
+    """Split a rendered expression into (kind, value) tokens, ending with ("end", None)."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(expression):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "space":
+            continue
+        if kind == "string":
+            if "\\" not in text:
+                tokens.append(("string", text[1:-1]))
+                continue
+            # Checkov renders Python reprs and HCL keeps double quotes, both decode as Python literals
+            try:
+                tokens.append(("string", ast.literal_eval(text)))
+            except (ValueError, SyntaxError):
+                tokens.append(("string", text[1:-1]))
+        elif kind == "number":
+            tokens.append(("number", ast.literal_eval(text)))
+        elif kind == "name" and text in KEYWORDS:
+            tokens.append(("literal", KEYWORDS[text]))
+        else:
+            tokens.append((kind, text))
+    tokens.append(("end", None))
+    return tokens
+
+
+class Parser:
+    """Recursive descent evaluator over the tokens of one expression.
+
+    Literals, objects, tuples and the merge(), lookup(), tomap(), try() and
+    coalesce() functions are evaluated. Anything else becomes a Reference,
+    so an unknown value never hides the keys around it.
+    """
+
+    def __init__(self, tokens: list[tuple[str, Any]], position: int = 0) -> None:
+        self.tokens = tokens
+        self.position = position
+
+    def peek(self) -> tuple[str, Any]:
+        return self.tokens[self.position]
+
+    def take(self, expected: str | None = None) -> tuple[str, Any]:
+        token = self.tokens[self.position]
+        if expected is not None and token[1] != expected:
+            raise ExpressionError(f"expected {expected!r}, found {token[1]!r}")
+        self.position += 1
+        return token
+
+    def source(self, start: int) -> str:
+        return "".join(str(value) for kind, value in self.tokens[start:self.position] if kind != "end")
+
+    def expression(self) -> Any:
+        start = self.position
+        value = self.primary()
+        # Index access on the result, e.g. each.value["tags"]
+        while self.peek()[1] == "[":
+            self.take("[")
+            key = self.expression()
+            self.take("]")
+            if isinstance(value, (dict, list)) and not isinstance(key, Reference):
+                try:
+                    value = value[key]
+                    continue
+                except (KeyError, IndexError, TypeError):
+                    pass
+            value = Reference(self.source(start))
+        return value
+
+    def primary(self) -> Any:
+        kind, value = self.peek()
+        if kind in ("string", "number", "literal"):
+            self.take()
+            return value
+        if kind == "interpolation":
+            self.take()
+            inner = self.expression()
+            self.take("}")
+            return inner
+        if value == "{":
+            return self.object()
+        if value == "[":
+            return self.tuple()
+        if value == "(":
+            self.take("(")
+            inner = self.expression()
+            self.take(")")
+            return inner
+        if kind == "name":
+            start = self.position
+            self.take()
+            if self.peek()[1] != "(":
+                return Reference(value)
+            arguments = self.arguments()
+            return self.call(value, arguments, start)
+        raise ExpressionError(f"unexpected {value!r}")
+
+    def object(self) -> dict:
+        self.take("{")
+        result: dict = {}
+        while self.peek()[1] != "}":
+            kind, key = self.take()
+            if kind not in ("string", "number", "name"):
+                raise ExpressionError(f"unexpected object key {key!r}")
+            if self.peek()[1] not in (":", "="):
+                raise ExpressionError(f"expected ':' or '=' after {key!r}")
+            self.take()
+            result[key] = self.expression()
+            # HCL separates attributes with newlines, Python reprs with commas
+            if self.peek()[1] == ",":
+                self.take(",")
+        self.take("}")
+        return result
+
+    def tuple(self) -> list:
+        self.take("[")
+        result = []
+        while self.peek()[1] != "]":
+            result.append(self.expression())
+            if self.peek()[1] != ",":
+                break
+            self.take(",")
+        self.take("]")
+        return result
+
+    def arguments(self) -> list:
+        self.take("(")
+        arguments = []
+        while self.peek()[1] != ")":
+            arguments.append(self.expression())
+            if self.peek()[1] != ",":
+                break
+            self.take(",")
+        self.take(")")
+        return arguments
+
+    def call(self, function: str, arguments: list, start: int) -> Any:
+        if function == "merge":
+            # Unrendered arguments may add keys but cannot remove the known ones
+            merged: dict = {}
+            for argument in arguments:
+                if isinstance(argument, dict):
+                    merged.update(argument)
+            return merged
+        if function == "lookup" and len(arguments) in (2, 3):
+            mapping, key = arguments[0], arguments[1]
+            if isinstance(mapping, dict) and not isinstance(key, Reference):
+                if key in mapping:
+                    return mapping[key]
+                if len(arguments) == 3:
+                    return arguments[2]
+        if function == "tomap" and len(arguments) == 1:
+            return arguments[0]
+        if function in ("try", "coalesce"):
+            for argument in arguments:
+                if isinstance(argument, Reference):
+                    break
+                if argument is not None and argument != "":
+                    return argument
+        return Reference(self.source(start))
+
+
+def literal_objects(tokens: list[tuple[str, Any]]) -> dict:
+    """Merge every outermost object literal that evaluates, for expressions the parser rejects."""
+    merged: dict = {}
+    position = 0
+    while position < len(tokens):
+        if tokens[position][1] == "{":
+            parser = Parser(tokens, position)
+            try:
+                merged.update(parser.object())
+                position = parser.position
+                continue
+            except ExpressionError:
+                pass
+        position += 1
+    return merged
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def resolve_expression(expression: str) -> Mapping[str, Any]:
+    """Resolve a tags expression string to a read-only mapping, once per distinct string."""
+    tokens = tokenize(expression)
+    parser = Parser(tokens)
+    try:
+        value = parser.expression()
+        if parser.peek()[0] != "end":
+            raise ExpressionError(f"unexpected {parser.peek()[1]!r}")
+    except (ExpressionError, IndexError):
+        value = literal_objects(tokens)
+    return MappingProxyType(value if isinstance(value, dict) else {})
+
+
+def resolve_tags(conf: dict) -> Mapping[str, Any]:
+    """Extract a tags mapping from a resource conf, evaluating merge() and lookup() expressions.
+
+    Checkov resolves variable references and locals but cannot evaluate Terraform
+    built-in functions such as merge(). When a resource uses:
+        tags = merge(local._effective_default_tags, lookup(each.value, "tags", {}))
+    checkov stores a string like:
+        "${merge(${merge({'key': 'val', ...}, {})}, lookup(...))}"
+    The string is evaluated as an expression, so nested maps stay nested and
+    keys whose value is an unrendered reference are still present, with a
+    Reference value. The result is cached per expression string and must not
+    be modified.
+    """
+    tags = conf.get("tags", [{}])
+    if isinstance(tags, list):
+        tags = tags[0] if tags else {}
+
+    if isinstance(tags, dict):
+        return tags
+
+    return resolve_expression(str(tags))
+
+
+def known_tag(tags: Mapping[str, Any], key: str) -> Any:
+    """The value of a tag, or None when it is absent or an unrendered Reference.
+
+    A Reference only says which expression would set the tag, not its value,
+    so checks treat it like a missing tag rather than passing on its source text.
+    """
+    value = tags.get(key)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return None if isinstance(value, Reference) else value
@@ -0,0 +1,96 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0.
+# Tests for the shared tag resolver of the custom checks.
+# Kept outside custom_checks, Checkov imports every module in that directory as a check.
+
+from __future__ import annotations
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_checks"))
+
+from tag_resolver import ExpressionError, Parser, Reference, known_tag, literal_objects, resolve_expression, resolve_tags, tokenize  # noqa: E402
+
+
+def evaluate(expression: str):
+    return Parser(tokenize(expression)).expression()
+
+
+def test_tokenize_decodes_strings_numbers_and_keywords() -> None:
+    assert tokenize("{'a': \"b\\\"c\", n: -1.5e2, t = true, x = null}") == [
+        ("punctuation", "{"), ("string", "a"), ("punctuation", ":"), ("string", 'b"c'), ("punctuation", ","),
+        ("name", "n"), ("punctuation", ":"), ("number", -150.0), ("punctuation", ","),
+        ("name", "t"), ("punctuation", "="), ("literal", True), ("punctuation", ","),
+        ("name", "x"), ("punctuation", "="), ("literal", None), ("punctuation", "}"),
+        ("end", None),
+    ]
+
+
+def test_merge_of_rendered_defaults_and_unrendered_lookup() -> None:
+    expression = (
+        "${merge(${merge({'CostCenter': 'cc-1', 'Project': 'p'}, {})}, "
+        "lookup(each.value, \"tags\", {}))}"
+    )
+
+    assert evaluate(expression) == {"CostCenter": "cc-1", "Project": "p"}
+
+
+def test_functions_and_index_access() -> None:
+    assert evaluate("lookup({'a': 1}, 'b', 2)") == 2
+    assert evaluate("lookup({'a': 1}, 'a')") == 1
+    assert evaluate("tomap({Owner = 'ops'})") == {"Owner": "ops"}
+    assert evaluate("coalesce('', null, 'x')") == "x"
+    assert evaluate("{'tags': {'a': 'b'}}['tags']") == {"a": "b"}
+    assert evaluate("[1, 2][1]") == 2
+
+
+def test_unrendered_values_become_references() -> None:
+    value = evaluate("{Owner = var.owner, Team = each.value[\"team\"], Tier = try(var.tier, 'gold')}")
+
+    assert value["Owner"] == "var.owner"
+    assert value["Team"].startswith("each.value[")
+    assert value["Tier"].startswith("try(var.tier")
+    assert all(isinstance(reference, Reference) for reference in value.values())
+
+
+def test_unsupported_syntax_raises() -> None:
+    with pytest.raises(ExpressionError):
+        evaluate("{'a' 'b'}")
+
+
+def test_fallback_keeps_object_literals_of_rejected_expressions() -> None:
+    # A conditional is not evaluated, the literal maps on both sides still are
+    expression = "var.prod ? {'Environment': 'prod'} : {'Environment': 'dev', 'Project': 'p'}"
+
+    assert literal_objects(tokenize(expression)) == {"Environment": "dev", "Project": "p"}
+    assert dict(resolve_expression(expression)) == {"Environment": "dev", "Project": "p"}
+    assert dict(resolve_expression("var.tags")) == {}
+
+
+def test_resolved_expressions_are_cached_and_read_only() -> None:
+    expression = "{'Project': 'cached'}"
+    first = resolve_expression(expression)
+
+    assert resolve_expression(expression) is first
+    with pytest.raises(TypeError):
+        first["Project"] = "changed"  # type: ignore[index]
+
+
+def test_resolve_tags_accepts_rendered_and_expression_confs() -> None:
+    assert resolve_tags({"tags": [{"Project": "p"}]}) == {"Project": "p"}
+    assert resolve_tags({"tags": []}) == {}
+    assert resolve_tags({}) == {}
+    assert dict(resolve_tags({"tags": ["merge({'Project': 'p'}, var.extra)"]})) == {"Project": "p"}
+
+
+def test_unresolved_tags_are_not_known() -> None:
+    # Checks must fail on var.owner as they did when such tags were dropped, not pass on its source text
+    tags = resolve_tags({"tags": ["{'Project': 'p', 'Owner': var.owner, 'Tier': ['gold']}"]})
+
+    assert known_tag(tags, "Project") == "p"
+    assert known_tag(tags, "Tier") == "gold"
+    assert known_tag(tags, "Owner") is None
+    assert known_tag(tags, "CostCenter") is None
+    assert known_tag({"Tier": []}, "Tier") is None
@@ -0,0 +1,91 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Shared fixtures for the SFTP Lambda handler tests.
+
+Handlers import sftp_runtime from lambda/, as they do from their deployment
+packages. The examples share module names (index, event_listener), so
+load_module imports each file under a name of its own, after the
+environment it reads at import is in place.
+"""
+
+import importlib.util
+import os
+import sys
+import uuid
+
+import pytest
+
+SFTP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SFTP_DIR, 'lambda'))
+
+class LambdaContext:
+    """Lambda context with a fixed remaining time"""
+
+    def __init__(self, remaining_ms=60000):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+class FakeTransferClient:
+    """Transfer Family connector API stand-in, moto does not implement SFTP connectors.
+
+    Started transfers are recorded, and list_file_transfer_results returns
+    the file results set in results for a transfer ID.
+    """
+
+    def __init__(self):
+        self.transfers = []
+        self.results = {}
+        self.listing_id = str(uuid.uuid4())
+
+    def start_directory_listing(self, **kwargs):
+        return {'ListingId': self.listing_id}
+
+    def start_file_transfer(self, **kwargs):
+        transfer_id = f"t-{len(self.transfers):04d}"
+        self.transfers.append(dict(kwargs, TransferId=transfer_id))
+        return {'TransferId': transfer_id}
+
+    def list_file_transfer_results(self, ConnectorId, TransferId, NextToken=None):
+        return {'FileTransferResults': self.results.get(TransferId, [])}
+
+@pytest.fixture
+def aws(monkeypatch):
+    """moto for every AWS API the handlers call, with an empty client pool"""
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('METRICS_ENABLED', 'false')
+    monkeypatch.delenv('AWS_ENDPOINT_URL', raising=False)
+
+    import sftp_runtime
+    with moto.mock_aws():
+        sftp_runtime._clients.clear()
+        yield sftp_runtime
+        sftp_runtime._clients.clear()
+
+@pytest.fixture
+def transfer(aws):
+    """FakeTransferClient installed in the shared client pool"""
+    client = FakeTransferClient()
+    aws._clients[('client', 'transfer')] = client
+    return client
+
+@pytest.fixture
+def load_module(monkeypatch):
+    """Import a handler file, relative to modules/sftp, with the given environment variables"""
+    def load(relative_path, **env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        path = os.path.join(SFTP_DIR, relative_path)
+        module_name = f"{os.path.splitext(os.path.basename(path))[0]}_{uuid.uuid4().hex}"
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+@pytest.fixture
+def lambda_context():
+    return LambdaContext()
@@ -1,20 +1,164 @@
 import json
-import boto3
 import os
 import logging
-from datetime import datetime
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from sftp_runtime import Metrics, RemoteFileManifest, duration_ms, get_client, get_resource, query_pages, tracking_expiry, utc_timestamp
+
+PENDING_STATUSES = ('TRANSFER_STARTED', 'DISCOVERY_COMPLETED')
+IN_PROGRESS_RESULT_CODES = ('QUEUED', 'IN_PROGRESS')
+
+# Most actions a single TransactWriteItems request accepts
+TRANSACT_MAX_ITEMS = 100
+
+metrics = Metrics('sftp-event-listener')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+def forget_failed_files(failed_paths):
+    """Drop failed files from the retrieval manifest so the next discovery run retrieves them again"""
+    manifest_key = os.environ.get('MANIFEST_KEY')
+    if not manifest_key or not failed_paths:
+        return
+
+    manifest = RemoteFileManifest(get_client('s3', metrics), os.environ['MANIFEST_BUCKET'], manifest_key)
+    manifest.update(lambda files: [files.pop(path, None) for path in failed_paths])
+    logger.info(f"Removed {len(failed_paths)} failed files from the retrieval manifest")
+
+def list_transfer_results(transfer_client, connector_id, transfer_id):
+    """Return every file result of a transfer, following NextToken"""
+    params = {'ConnectorId': connector_id, 'TransferId': transfer_id}
+    file_results = []
+    while True:
+        response = transfer_client.list_file_transfer_results(**params)
+        file_results.extend(response.get('FileTransferResults', []))
+        if not response.get('NextToken'):
+            return file_results
+        params['NextToken'] = response['NextToken']
+
+def check_transfer(transfer_client, transfer):
+    """Work out the outcome of a finished transfer.
+
+    Returns the attributes to set on its tracking record and the paths of the
+    files that failed, or None while any file is still queued or in progress.
+    """
+    transfer_id = transfer['transfer_id']
+
+    with metrics.stage('TransferResults'):
+        file_results = list_transfer_results(transfer_client, transfer['connector_id'], transfer_id)
+
+    # Analyze results
+    total_files = len(file_results)
+    successful_files = [f for f in file_results if f.get('StatusCode') == 'COMPLETED']
+    failed_files = [f for f in file_results if f.get('StatusCode') == 'FAILED']
+    in_progress_files = [f for f in file_results if f.get('StatusCode') in IN_PROGRESS_RESULT_CODES]
+
+    logger.info(f"Transfer {transfer_id}: {len(successful_files)} successful, {len(failed_files)} failed out of {total_files} total")
+
+    # Still in progress until every file the transfer was started with has a final result
+    if in_progress_files or total_files == 0 or total_files < int(transfer.get('files_count', 0)):
+        return None
+
+    new_status = 'COMPLETED' if not failed_files else 'PARTIALLY_FAILED' if successful_files else 'FAILED'
+
+    # Bytes come from the sizes in the directory listing the transfer was started from
+    file_sizes = dict(zip(transfer.get('file_paths', []), transfer.get('file_sizes', [])))
+    bytes_transferred = sum(int(file_sizes.get(f.get('FilePath'), 0)) for f in successful_files)
+    completed_at = utc_timestamp()
+
+    update_data = {
+        'status': new_status,
+        'updated_at': completed_at,
+        'completed_at': completed_at,
+        'files_successful': len(successful_files),
+        'files_failed': len(failed_files),
+        'files_total': total_files,
+        'bytes_transferred': bytes_transferred
+    }
+
+    # Completion is seen when the transfer is polled, so the duration is an upper bound within one check interval
+    if transfer.get('started_at'):
+        update_data['duration_ms'] = duration_ms(transfer['started_at'], completed_at)
+
+    # Finished records expire from the table and are archived to S3 from the stream
+    if tracking_expiry():
+        update_data['expires_at'] = tracking_expiry()
+
+    # Add error details if any failures
+    if failed_files:
+        update_data['error_messages'] = [f.get('Failure', {}).get('Message', 'Unknown error') for f in failed_files]
+
+    return update_data, [f['FilePath'] for f in failed_files if f.get('FilePath')]
+
+def transfer_update(table_name, transfer, update_data):
+    """TransactWriteItems Update closing a transfer record that is still pending"""
+    update_expression = 'SET ' + ', '.join([f'#{k} = :{k}' if k == 'status' else f'{k} = :{k}' for k in update_data.keys()])
+    update_expression += ' REMOVE pending_status'
+    return {
+        'TableName': table_name,
+        'Key': {'batch_id': transfer['batch_id'], 'record_id': transfer['record_id']},
+        'UpdateExpression': update_expression,
+        'ConditionExpression': 'attribute_exists(pending_status)',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {f':{k}': v for k, v in update_data.items()}
+    }
+
+def close_transfers(table, finished, max_attempts=5):
+    """Write the outcome of finished transfers with TransactWriteItems, up to TRANSACT_MAX_ITEMS per request.
+
+    finished holds (transfer, update_data, failed_paths) tuples. Records whose
+    condition failed were closed since they were read and are skipped, the
+    rest of the transaction is retried without them. Returns the entries of
+    finished that were written.
+    """
+    closed = []
+    for start in range(0, len(finished), TRANSACT_MAX_ITEMS):
+        chunk = finished[start:start + TRANSACT_MAX_ITEMS]
+        for attempt in range(max_attempts):
+            try:
+                with metrics.stage('DynamoDbTransact'):
+                    table.meta.client.transact_write_items(TransactItems=[
+                        {'Update': transfer_update(table.name, transfer, update_data)}
+                        for transfer, update_data, _ in chunk
+                    ])
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException' or attempt == max_attempts - 1:
+                    raise
+                reasons = e.response.get('CancellationReasons', [])
+                changed = {i for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed'}
+                metrics.add('ConditionalCheckFailures', len(changed))
+                chunk = [entry for i, entry in enumerate(chunk) if i not in changed]
+                if not chunk:
+                    break
+                if not changed:
+                    # Cancelled by a conflicting write rather than a condition, back off before retrying
+                    time.sleep(random.uniform(0, min(5, 0.1 * 2 ** attempt)))
+                continue
+
+            for transfer, update_data, _ in chunk:
+                metrics.add('FilesTransferred', update_data['files_successful'])
+                metrics.add('FilesFailed', update_data['files_failed'])
+                metrics.add('BytesTransferred', update_data['bytes_transferred'], 'Bytes')
+                logger.info(f"Updated batch {transfer['batch_id']} status to {update_data['status']}")
+            closed.extend(chunk)
+            break
+    return closed
+
 def lambda_handler(event, context):
     """
     Poll Transfer Family results and update DynamoDB status
-    This function is triggered by EventBridge Scheduler to check transfer status
+    This function is triggered by EventBridge Scheduler to check transfer status.
+    Transfers are checked in parallel until STATUS_CHECK_RESERVE_MS before the
+    invocation deadline, the rest stay pending for the next run. The outcomes
+    are then written together with TransactWriteItems.
     """
     try:
-        transfer_client = boto3.client('transfer')
-        dynamodb = boto3.resource('dynamodb')
+        transfer_client = get_client('transfer', metrics)
+        dynamodb = get_resource('dynamodb', metrics)
 
         table_name = os.environ.get('DYNAMODB_TABLE')
         if not table_name:
@@ -23,94 +167,93 @@ def lambda_handler(event, context):
 
         table = dynamodb.Table(table_name)
 
-        # Get all pending transfers from DynamoDB
-        response = table.scan(
-            FilterExpression='#status IN (:started, :discovery)',
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={
-                ':started': 'TRANSFER_STARTED',
-                ':discovery': 'DISCOVERY_COMPLETED'
-            }
-        )
-
-        pending_transfers = response.get('Items', [])
+        # Only pending records carry pending_status, so the sparse index holds just the in-flight transfers
+        index_name = os.environ.get('STATUS_INDEX', 'pending-status-index')
+        with metrics.stage('PendingQuery'):
+            pending_transfers = [
+                item
+                for status in PENDING_STATUSES
+                for item in query_pages(
+                    table,
+                    IndexName=index_name,
+                    KeyConditionExpression=Key('pending_status').eq(status)
+                )
+            ]
+
+        metrics.add('RecordsPerInvocation', len(pending_transfers))
         logger.info(f"Found {len(pending_transfers)} pending transfers to check")
 
-        for transfer in pending_transfers:
-            batch_id = transfer['batch_id']
-            transfer_id = transfer.get('transfer_id')
-            connector_id = transfer.get('connector_id')
+        max_concurrency = max(1, int(os.environ.get('STATUS_CHECK_MAX_CONCURRENCY', '8')))
+        reserve_ms = int(os.environ.get('STATUS_CHECK_RESERVE_MS', '10000'))
+        # Without a Lambda context (local runs) fall back to the function timeout
+        remaining_ms = context.get_remaining_time_in_millis() if context else 60000
+        deadline = time.monotonic() + (remaining_ms - reserve_ms) / 1000
 
-            if not transfer_id or not connector_id:
-                logger.warning(f"Missing transfer_id or connector_id for batch {batch_id}")
-                continue
+        totals = {'checked': 0, 'deferred': 0}
+        finished = []
 
-            try:
-                # Check transfer results
-                results_response = transfer_client.list_file_transfer_results(
-                    ConnectorId=connector_id,
-                    TransferId=transfer_id
-                )
+        def settle(done):
+            for future in done:
+                transfer = in_flight.pop(future)
+                totals['checked'] += 1
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    logger.error(f"Error checking transfer {transfer['transfer_id']}: {str(e)}")
+                    continue
+                if outcome is not None:
+                    finished.append((transfer, *outcome))
 
-                # Analyze results
-                file_results = results_response.get('FileTransferResults', [])
-                total_files = len(file_results)
-                successful_files = [f for f in file_results if f.get('StatusCode') == 'COMPLETED']
-                failed_files = [f for f in file_results if f.get('StatusCode') == 'FAILED']
-
-                logger.info(f"Transfer {transfer_id}: {len(successful_files)} successful, {len(failed_files)} failed out of {total_files} total")
-
-                # Determine overall status
-                if len(failed_files) == 0 and len(successful_files) > 0:
-                    new_status = 'COMPLETED'
-                elif len(failed_files) > 0:
-                    new_status = 'PARTIALLY_FAILED' if len(successful_files) > 0 else 'FAILED'
-                else:
-                    # Still in progress
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            for position, transfer in enumerate(pending_transfers):
+                if not transfer.get('transfer_id') or not transfer.get('connector_id'):
+                    logger.warning(f"Missing transfer_id or connector_id for batch {transfer['batch_id']}")
                     continue
+                if time.monotonic() >= deadline:
+                    totals['deferred'] = len(pending_transfers) - position
+                    break
+                if len(in_flight) >= max_concurrency:
+                    done, _ = wait(in_flight, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                    settle(done)
+                    if not done:
+                        totals['deferred'] = len(pending_transfers) - position
+                        break
+                in_flight[executor.submit(check_transfer, transfer_client, transfer)] = transfer
+            done, _ = wait(in_flight, timeout=max(0, deadline - time.monotonic()))
+            settle(done)
+        finally:
+            # Checks still running past the deadline are abandoned, their records stay pending
+            totals['deferred'] += len(in_flight)
+            executor.shutdown(wait=False, cancel_futures=True)
 
-                # Update DynamoDB
-                update_data = {
-                    'status': new_status,
-                    'updated_at': datetime.utcnow().isoformat(),
-                    'completed_at': datetime.utcnow().isoformat(),
-                    'files_successful': len(successful_files),
-                    'files_failed': len(failed_files),
-                    'files_total': total_files
-                }
-
-                # Add error details if any failures
-                if failed_files:
-                    error_messages = [f.get('Failure', {}).get('Message', 'Unknown error') for f in failed_files]
-                    update_data['error_messages'] = error_messages
-
-                # Update the batch record
-                update_expression = 'SET ' + ', '.join([f'#{k} = :{k}' if k == 'status' else f'{k} = :{k}' for k in update_data.keys()])
-                expression_values = {f':{k}': v for k, v in update_data.items()}
-                expression_names = {'#status': 'status'} if 'status' in update_data else {}
-
-                update_params = {
-                    'Key': {'batch_id': batch_id},
-                    'UpdateExpression': update_expression,
-                    'ExpressionAttributeValues': expression_values
-                }
-
-                if expression_names:
-                    update_params['ExpressionAttributeNames'] = expression_names
-
-                table.update_item(**update_params)
-
-                logger.info(f"Updated batch {batch_id} status to {new_status}")
-
-            except Exception as e:
-                logger.error(f"Error checking transfer {transfer_id}: {str(e)}")
-                continue
+        if totals['deferred']:
+            logger.warning(f"Time budget reached, leaving {totals['deferred']} transfers for the next run")
+
+        # One manifest write for the failed files of every finished transfer, then one write pass closing them.
+        # The manifest goes first: a closed record is never checked again, so its failed files must already be
+        # forgotten or they would never be retrieved.
+        failed_paths = [path for _, _, transfer_failed_paths in finished for path in transfer_failed_paths]
+        try:
+            forget_failed_files(failed_paths)
+        except Exception as e:
+            logger.error(f"Error removing failed files from the retrieval manifest: {str(e)}")
+            # Transfers with failed files stay pending, the next run retries the manifest write
+            held = [entry for entry in finished if entry[2]]
+            finished = [entry for entry in finished if not entry[2]]
+            totals['deferred'] += len(held)
+        closed = close_transfers(table, finished)
+
+        metrics.add('TransfersDeferred', totals['deferred'])
 
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Transfer status check completed',
-                'transfers_checked': len(pending_transfers)
+                'transfers_checked': totals['checked'],
+                'transfers_completed': len(closed),
+                'transfers_deferred': totals['deferred']
             })
         }
 
@@ -120,3 +263,5 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+    finally:
+        metrics.flush()
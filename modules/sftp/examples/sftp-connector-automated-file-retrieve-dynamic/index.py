@@ -1,69 +1,64 @@
-import boto3
+import codecs
 import os
 import json
 import logging
+import random
+import time
+from botocore.exceptions import ClientError
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from sftp_runtime import DynamoBatchWriter, Metrics, RemoteFileManifest, get_client, get_rate_limiter, get_resource, is_throttling_error, tracking_expiry, utc_timestamp
+
+metrics = Metrics('sftp-file-discovery')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def list_directory_files(transfer_client, connector_id, directory_path, output_path):
-    """List all files in the remote directory using Transfer Family API"""
+LISTING_COMPLETED_EVENT = 'SFTP Connector Directory Listing Completed'
+NOT_FOUND_ERROR_CODES = ('404', 'NoSuchKey', 'NotFound')
+# StartFileTransfer accepts at most 10 RetrieveFilePaths per request
+RETRIEVE_FILE_PATHS_MAX = 10
+# Tracking items share the batch_id partition, sorted by record_id
+HEADER_RECORD_ID = 'HEADER'
+CHUNK_RECORD_PREFIX = 'CHUNK#'
+NUMBER_DELIMITERS = (',', ']', '}', ' ', '\t', '\r', '\n')
+
+def listing_exists(s3_client, bucket_name, listing_key):
+    """Check whether the directory listing file has been written"""
     try:
-        response = transfer_client.start_directory_listing(
-            ConnectorId=connector_id,
-            RemoteDirectoryPath=directory_path,
-            OutputDirectoryPath=output_path
-        )
-
-        listing_id = response['ListingId']
-        logger.info(f"Directory listing started: {listing_id}")
-
-        # Poll for completion
-        import time
-        max_attempts = 30
-        attempt = 0
-
-        while attempt < max_attempts:
-            describe_response = transfer_client.describe_execution(
-                ExecutionId=listing_id
-            )
-
-            status = describe_response['Execution']['Status']
-            logger.info(f"Listing status: {status}")
-
-            if status == 'COMPLETED':
-                # Get the listing results
-                outputs = describe_response['Execution'].get('Results', {})
-                files = []
-
-                if 'Steps' in outputs:
-                    for step in outputs['Steps']:
-                        if step.get('StepType') == 'LIST' and 'Outputs' in step:
-                            step_outputs = json.loads(step['Outputs'])
-                            if 'FilePaths' in step_outputs:
-                                files.extend(step_outputs['FilePaths'])
-
-                logger.info(f"Found {len(files)} files: {files}")
-                return files
-
-            elif status in ['FAILED', 'EXCEPTION']:
-                error_msg = describe_response['Execution'].get('Error', {}).get('Message', 'Unknown error')
-                logger.error(f"Directory listing failed: {error_msg}")
-                return []
-
-            time.sleep(2)
-            attempt += 1
-
-        logger.warning("Directory listing timed out")
-        return []
-
-    except Exception as e:
-        logger.error(f"Error listing directory: {str(e)}")
-        return []
+        s3_client.head_object(Bucket=bucket_name, Key=listing_key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] not in NOT_FOUND_ERROR_CODES:
+            raise
+        return False
+
+def wait_for_listing(s3_client, bucket_name, listing_key, context):
+    """Poll for the listing file with exponential backoff until the invocation deadline.
+
+    Stops early enough to leave LISTING_DEADLINE_RESERVE_MS for starting the
+    transfer. Returns False when the listing did not complete in time.
+    """
+    reserve_ms = int(os.environ.get('LISTING_DEADLINE_RESERVE_MS', '30000'))
+    delay = float(os.environ.get('LISTING_POLL_INITIAL_SECONDS', '0.25'))
+    max_delay = float(os.environ.get('LISTING_POLL_MAX_SECONDS', '5'))
+    # Without a Lambda context (local runs) fall back to the function timeout
+    remaining_ms = context.get_remaining_time_in_millis() if context else 300000
+    deadline = time.monotonic() + (remaining_ms - reserve_ms) / 1000
+
+    while not listing_exists(s3_client, bucket_name, listing_key):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+    return True
 
 def lambda_handler(event, context):
     try:
-        transfer_client = boto3.client('transfer')
+        transfer_client = get_client('transfer', metrics)
+        s3_client = get_client('s3', metrics)
 
         connector_id = os.environ['CONNECTOR_ID']
         bucket_name = os.environ['S3_BUCKET']
@@ -72,106 +67,409 @@ def lambda_handler(event, context):
 
         s3_destination = f'/{bucket_name}/{s3_prefix}'
 
+        if event.get('detail-type') == LISTING_COMPLETED_EVENT:
+            # Resume a listing started by an earlier scheduled run
+            # Transfer Family event details use kebab-case field names
+            detail = event['detail']
+            listing_id = detail['listing-id']
+            listing_key = detail['output-file-location']['key']
+            logger.info(f"Directory listing completed: {listing_id}")
+
+            if not listing_exists(s3_client, bucket_name, listing_key):
+                logger.info(f"Directory listing file {listing_key} was already processed")
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({'message': 'Directory listing already processed'})
+                }
+
+            return retrieve_listed_files(transfer_client, s3_client, connector_id, bucket_name, listing_key, s3_destination, context)
+
         logger.info(f"Directory retrieval from: {source_directory}")
 
         # Start directory listing
-        response = transfer_client.start_directory_listing(
-            ConnectorId=connector_id,
-            RemoteDirectoryPath=source_directory,
-            OutputDirectoryPath=s3_destination
-        )
+        listing_params = {}
+        if os.environ.get('LISTING_MAX_ITEMS'):
+            listing_params['MaxItems'] = int(os.environ['LISTING_MAX_ITEMS'])
+
+        with metrics.stage('DirectoryListing'):
+            response = transfer_client.start_directory_listing(
+                ConnectorId=connector_id,
+                RemoteDirectoryPath=source_directory,
+                OutputDirectoryPath=s3_destination,
+                **listing_params
+            )
 
         listing_id = response['ListingId']
+        listing_key = f"{s3_prefix}/{connector_id}-{listing_id}.json"
         logger.info(f"Directory listing started: {listing_id}")
 
-        # Wait a moment for listing to complete
-        import time
-        time.sleep(5)
-
-        # Check if listing completed and get file paths from S3
-        s3_client = boto3.client('s3')
+        # In event mode the listing completed event invokes this function again
+        listing_ready = False
+        if os.environ.get('LISTING_COMPLETION_MODE', 'poll') == 'poll':
+            with metrics.stage('ListingWait'):
+                listing_ready = wait_for_listing(s3_client, bucket_name, listing_key, context)
+            if not listing_ready:
+                logger.warning(f"Directory listing {listing_id} did not complete before the invocation deadline")
 
-        # List objects in the destination to find the listing file
-        list_response = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            Prefix=f"{s3_prefix}/{connector_id}-{listing_id}.json"
-        )
-
-        if 'Contents' not in list_response:
-            logger.warning("Directory listing file not found yet")
+        if not listing_ready:
             return {
                 'statusCode': 200,
-                'body': json.dumps({'message': 'Directory listing in progress'})
+                'body': json.dumps({'message': 'Directory listing in progress', 'listingId': listing_id})
             }
 
-        # Get the listing file
-        listing_key = list_response['Contents'][0]['Key']
-        listing_obj = s3_client.get_object(Bucket=bucket_name, Key=listing_key)
-        listing_data = json.loads(listing_obj['Body'].read().decode('utf-8'))
-
-        # Extract file paths
-        file_paths = [file_info['filePath'] for file_info in listing_data.get('files', [])]
+        return retrieve_listed_files(transfer_client, s3_client, connector_id, bucket_name, listing_key, s3_destination, context)
 
-        if not file_paths:
-            logger.info("No files found in directory listing")
-            return {
-                'statusCode': 200,
-                'body': json.dumps({'message': 'No files found', 'files_found': 0})
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        raise e
+    finally:
+        metrics.flush()
+
+class DirectoryListingReader:
+    """Incremental parser for the directory listing JSON written by StartDirectoryListing.
+
+    files() yields the entries of the "files" array one at a time while the
+    S3 body is read in chunks, so memory stays flat however many files the
+    listing holds. truncated is set once the listing has been read.
+    """
+
+    def __init__(self, body, chunk_size=64 * 1024):
+        self.chunks = body.iter_chunks(chunk_size)
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.truncated = False
+
+    def files(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if self.peek() == '[':
+                # Arrays are streamed element by element, only "files" entries are kept
+                for item in self.array():
+                    if key == 'files':
+                        yield item
+            else:
+                value = self.value()
+                if key == 'truncated':
+                    self.truncated = bool(value)
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+    def value(self):
+        """Decode the next complete JSON value, reading more of the stream as needed"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number is only complete once a delimiter follows it, it may continue in the next chunk
+            if isinstance(value, (int, float)) and self.buffer[end:end + 1] not in NUMBER_DELIMITERS and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of directory listing')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of directory listing")
+        self.pos += 1
+
+    def fill(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        self.buffer = self.buffer[self.pos:] + self.text.decode(chunk)
+        self.pos = 0
+        return True
+
+def retrieve_listed_files(transfer_client, s3_client, connector_id, bucket_name, listing_key, s3_destination, context=None):
+    """Start the transfer of every new or changed file in a completed directory listing.
+
+    The listing is streamed into the chunked transfer submission, so file
+    paths are never held in memory all at once. Submission stops
+    SUBMIT_DEADLINE_RESERVE_MS before the invocation deadline and the rest of
+    the listing is left to the next run. The manifest and the tracking header
+    are checkpointed every MANIFEST_CHECKPOINT_TRANSFERS started transfers,
+    so a run that ends early never leaves started files out of the manifest.
+    """
+    reserve_ms = int(os.environ.get('SUBMIT_DEADLINE_RESERVE_MS', '15000'))
+    # Without a Lambda context (local runs) fall back to the function timeout
+    remaining_ms = context.get_remaining_time_in_millis() if context else 300000
+    deadline = time.monotonic() + (remaining_ms - reserve_ms) / 1000
+    checkpoint_transfers = max(1, int(os.environ.get('MANIFEST_CHECKPOINT_TRANSFERS', '50')))
+
+    listing_obj = s3_client.get_object(Bucket=bucket_name, Key=listing_key)
+    listing = DirectoryListingReader(listing_obj['Body'])
+
+    # Only retrieve files that are new or changed since they were last retrieved
+    manifest, retrieved_files = None, {}
+    if os.environ.get('MANIFEST_KEY'):
+        manifest = RemoteFileManifest(s3_client, bucket_name, os.environ['MANIFEST_KEY'])
+        with metrics.stage('ManifestLoad'):
+            retrieved_files, _ = manifest.load()
+
+    counts = {'discovered': 0, 'skipped': 0, 'failed': 0, 'bytes_started': 0}
+    pending_versions = {}
+    # Sizes of the files waiting to be submitted, recorded on their transfer's tracking item
+    pending_sizes = {}
+
+    def candidate_paths():
+        for file_info in listing.files():
+            counts['discovered'] += 1
+            path = file_info['filePath']
+            version = [file_info.get('size'), file_info.get('modifiedTimestamp')]
+            if retrieved_files.get(path) == version:
+                counts['skipped'] += 1
+                continue
+            if manifest:
+                pending_versions[path] = version
+            if table_name:
+                pending_sizes[path] = file_info.get('size') or 0
+            yield path
+
+    # Track the run in DynamoDB if enabled, as a header item plus one item per transfer under the same batch_id
+    table_name = os.environ.get('DYNAMODB_TABLE')
+    tracking = nullcontext()
+    if table_name:
+        import uuid
+
+        batch_id = str(uuid.uuid4())
+        started_at = utc_timestamp()
+        tracking = DynamoBatchWriter(get_resource('dynamodb', metrics).meta.client, table_name)
+
+    started_versions = {}
+    submitted = {'transfers': 0, 'files': 0, 'checkpointed': 0}
+
+    # Start one transfer per chunk of new or changed files
+    with metrics.stage('TransferStart'), tracking as batch_writer:
+        def write_header(final):
+            header = {
+                'batch_id': batch_id,
+                'record_id': HEADER_RECORD_ID,
+                'connector_id': connector_id,
+                'status': 'TRANSFERS_SUBMITTED' if final else 'TRANSFERS_SUBMITTING',
+                'transfers_count': submitted['transfers'],
+                'files_count': submitted['files'],
+                'files_failed_to_start': counts['failed'],
+                'bytes_expected': counts['bytes_started'],
+                'started_at': started_at,
+                'updated_at': utc_timestamp()
             }
-
-        logger.info(f"Found {len(file_paths)} files: {file_paths}")
-
-        # Start file transfer for discovered files
-        transfer_response = transfer_client.start_file_transfer(
-            ConnectorId=connector_id,
-            RetrieveFilePaths=file_paths,
-            LocalDirectoryPath=s3_destination
+            # The header is final once written, so it expires with the retention period like finished transfers
+            if final and tracking_expiry():
+                header['expires_at'] = tracking_expiry()
+            batch_writer.put_item(Item=header)
+            # Flushed on its own, a BatchWriteItem request cannot hold two writes of the same key
+            batch_writer.flush()
+
+        def checkpoint(final=False):
+            """Record the transfers started so far in the manifest and the tracking header"""
+            if manifest and started_versions:
+                with metrics.stage('ManifestUpdate'):
+                    manifest.update(lambda files: files.update(started_versions))
+                started_versions.clear()
+            if batch_writer and submitted['transfers']:
+                write_header(final)
+            submitted['checkpointed'] = submitted['transfers']
+
+        def on_started(chunk_index, transfer_id, chunk):
+            submitted['transfers'] += 1
+            submitted['files'] += len(chunk)
+            if manifest:
+                started_versions.update((path, pending_versions.pop(path)) for path in chunk)
+            if batch_writer:
+                file_sizes = [pending_sizes.pop(path, 0) for path in chunk]
+                transfer_started_at = utc_timestamp()
+                counts['bytes_started'] += sum(file_sizes)
+                batch_writer.put_item(
+                    Item={
+                        'batch_id': batch_id,
+                        'record_id': f"{CHUNK_RECORD_PREFIX}{chunk_index:06d}",
+                        'transfer_id': transfer_id,
+                        'connector_id': connector_id,
+                        'status': 'TRANSFER_STARTED',
+                        'pending_status': 'TRANSFER_STARTED',
+                        'file_paths': chunk,
+                        'file_sizes': file_sizes,
+                        'files_count': len(chunk),
+                        'bytes_expected': sum(file_sizes),
+                        'started_at': transfer_started_at,
+                        'updated_at': transfer_started_at
+                    }
+                )
+            if submitted['transfers'] - submitted['checkpointed'] >= checkpoint_transfers:
+                checkpoint()
+
+        def on_failed(chunk):
+            counts['failed'] += len(chunk)
+            for path in chunk:
+                pending_versions.pop(path, None)
+                pending_sizes.pop(path, None)
+
+        transfers_started, files_started, files_failed, deferred = submit_transfers(
+            transfer_client, connector_id, candidate_paths(), s3_destination, on_started, on_failed, deadline
         )
-
-        transfer_id = transfer_response['TransferId']
-        logger.info(f"File transfer started: {transfer_id}")
-
-        # Log batch job in DynamoDB if enabled
-        table_name = os.environ.get('DYNAMODB_TABLE')
-        if table_name:
-            import uuid
-            from datetime import datetime
-
-            dynamodb = boto3.resource('dynamodb')
-            table = dynamodb.Table(table_name)
-
-            batch_id = str(uuid.uuid4())
-            table.put_item(
-                Item={
-                    'batch_id': batch_id,
-                    'transfer_id': transfer_id,
-                    'connector_id': connector_id,
-                    'status': 'TRANSFER_STARTED',
-                    'file_paths': file_paths,
-                    'files_count': len(file_paths),
-                    'started_at': datetime.utcnow().isoformat(),
-                    'updated_at': datetime.utcnow().isoformat()
-                }
-            )
-            logger.info(f"Logged batch job: {batch_id}")
-
-        # Clean up the directory listing JSON file
-        try:
-            s3_client.delete_object(Bucket=bucket_name, Key=listing_key)
-            logger.info(f"Cleaned up metadata file: {listing_key}")
-        except Exception as e:
-            logger.warning(f"Failed to delete metadata file: {str(e)}")
-
+        checkpoint(final=True)
+
+    if table_name and tracking.unprocessed:
+        logger.error(f"Failed to record {tracking.unprocessed} tracking items for batch {batch_id}")
+        metrics.add('TrackingWriteFailures', tracking.unprocessed)
+
+    metrics.add('FilesDiscovered', counts['discovered'])
+    metrics.add('FilesSkipped', counts['skipped'])
+    logger.info(f"Listed {counts['discovered']} files, {counts['skipped']} unchanged since the last retrieval")
+    if deferred:
+        # Files not yet submitted are missing from the manifest, so the next run lists and starts them
+        logger.warning(f"Invocation deadline reached after {counts['discovered']} listed files, the rest are left to the next run")
+        metrics.add('SubmissionDeferred', 1)
+    elif listing.truncated:
+        # The listing stopped at MaxItems, files beyond it are not retrieved by this run
+        logger.warning(f"Directory listing {listing_key} was truncated after {counts['discovered']} files, increase LISTING_MAX_ITEMS")
+        metrics.add('ListingTruncated', 1)
+
+    if files_failed and not transfers_started:
+        raise RuntimeError(f"Failed to start any file transfer for {files_failed} files")
+
+    delete_listing(s3_client, bucket_name, listing_key)
+
+    if not transfers_started and not deferred:
+        logger.info("No new or changed files found in directory listing")
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Dynamic file retrieval started',
-                'transferId': transfer_id,
-                'files_found': len(file_paths),
-                'file_paths': file_paths
-            })
+            'body': json.dumps({'message': 'No files found', 'files_found': 0})
         }
 
+    logger.info(f"Started {transfers_started} file transfers for {files_started} files, {files_failed} files failed")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Dynamic file retrieval started',
+            'transfers_started': transfers_started,
+            'files_found': files_started + files_failed,
+            'files_failed': files_failed,
+            'truncated': listing.truncated,
+            'deferred': deferred
+        })
+    }
+
+def delete_listing(s3_client, bucket_name, listing_key):
+    """Clean up the directory listing JSON file"""
+    try:
+        s3_client.delete_object(Bucket=bucket_name, Key=listing_key)
+        logger.info(f"Cleaned up metadata file: {listing_key}")
     except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        raise e
+        logger.warning(f"Failed to delete metadata file: {str(e)}")
+
+def submit_transfers(transfer_client, connector_id, file_paths, s3_destination, on_started, on_failed, deadline=None):
+    """Start transfers for API-sized chunks of an iterable of file paths in parallel.
+
+    Requests are paced by a token bucket shared by every invocation in the
+    container for the connector, which slows down and retries with jittered
+    backoff when Transfer Family throttles. Only a bounded number of chunks
+    is in flight, and on_started/on_failed are called from this thread as
+    they finish. No chunk is submitted or retried after deadline (a
+    time.monotonic() value). Returns the number of transfers started, files
+    started and files failed, and whether paths were left unsubmitted.
+    """
+    chunk_size = max(1, min(int(os.environ.get('TRANSFER_CHUNK_SIZE', str(RETRIEVE_FILE_PATHS_MAX))), RETRIEVE_FILE_PATHS_MAX))
+    max_concurrency = int(os.environ.get('TRANSFER_MAX_CONCURRENCY', '4'))
+    max_attempts = int(os.environ.get('TRANSFER_MAX_ATTEMPTS', '5'))
+    limiter = get_rate_limiter(connector_id, float(os.environ.get('TRANSFER_RATE_PER_SECOND', '5')))
+
+    def past_deadline():
+        return deadline is not None and time.monotonic() >= deadline
+
+    def submit(chunk):
+        for attempt in range(max_attempts):
+            limiter.acquire()
+            try:
+                response = transfer_client.start_file_transfer(
+                    ConnectorId=connector_id,
+                    RetrieveFilePaths=chunk,
+                    LocalDirectoryPath=s3_destination
+                )
+            except ClientError as e:
+                if not is_throttling_error(e) or attempt == max_attempts - 1 or past_deadline():
+                    raise
+                limiter.throttled()
+                time.sleep(random.uniform(0, min(20, 0.5 * 2 ** attempt)))
+                continue
+
+            limiter.succeeded()
+            return response['TransferId']
+
+    totals = {'transfers': 0, 'started': 0, 'failed': 0, 'deferred': False}
+
+    def settle(done):
+        for future in done:
+            chunk_index, chunk = in_flight.pop(future)
+            try:
+                transfer_id = future.result()
+                logger.debug(f"File transfer started: {transfer_id} ({len(chunk)} files)")
+                totals['transfers'] += 1
+                totals['started'] += len(chunk)
+                on_started(chunk_index, transfer_id, chunk)
+            except Exception as e:
+                logger.error(f"Failed to start file transfer for {len(chunk)} files starting with {chunk[0]}: {str(e)}")
+                totals['failed'] += len(chunk)
+                on_failed(chunk)
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        for chunk_index, chunk in enumerate(chunked(file_paths, chunk_size)):
+            if past_deadline():
+                totals['deferred'] = True
+                break
+            # Keep a couple of chunks queued per worker without reading ahead further
+            if len(in_flight) >= 2 * max_concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                settle(done)
+            in_flight[executor.submit(submit, chunk)] = (chunk_index, chunk)
+        settle(list(in_flight))
+
+    metrics.add('TransfersStarted', totals['transfers'])
+    metrics.add('FilesFailed', totals['failed'])
+    return totals['transfers'], totals['started'], totals['failed'], totals['deferred']
+
+def chunked(items, size):
+    """Group an iterable into lists of at most size items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
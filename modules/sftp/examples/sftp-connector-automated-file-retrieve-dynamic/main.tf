@@ -31,6 +31,13 @@ locals {
   connector_name = "retrieve-${random_pet.name.id}"
   create_secret  = var.existing_secret_arn == null
   kms_key_arn    = local.create_secret ? aws_kms_key.transfer_family_key[0].arn : data.aws_kms_key.existing[0].arn
+  status_index   = "pending-status-index"
+
+  # TTL-expired tracking items are archived here, partitioned by day
+  tracking_archive_prefix = "tracking-archive"
+
+  # Remote files already retrieved are recorded outside the retrieval prefix
+  manifest_key = var.enable_incremental_retrieval ? "manifests/${module.sftp_connector.connector_id}.json.gz" : ""
 }
 
 # Get KMS key from existing secret if provided
@@ -248,12 +255,42 @@ resource "aws_dynamodb_table" "file_transfer_tracking" {
   name         = "${random_pet.name.id}-file-transfers"
   billing_mode = "PAY_PER_REQUEST"
   hash_key     = "batch_id"
+  range_key    = "record_id"
 
   attribute {
     name = "batch_id"
     type = "S"
   }
 
+  # HEADER for the discovery run, CHUNK#<n> for each transfer it started
+  attribute {
+    name = "record_id"
+    type = "S"
+  }
+
+  # Set only while a transfer is in flight, so the index stays as small as the pending work
+  attribute {
+    name = "pending_status"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name               = local.status_index
+    hash_key           = "pending_status"
+    range_key          = "batch_id"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["transfer_id", "connector_id", "files_count", "file_paths", "file_sizes", "started_at"]
+  }
+
+  # Finished items get expires_at, and the stream hands them to the archiver when TTL removes them
+  stream_enabled   = true
+  stream_view_type = "OLD_IMAGE"
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
   server_side_encryption {
     enabled     = true
     kms_key_arn = local.kms_key_arn
@@ -338,11 +375,18 @@ resource "aws_lambda_function" "file_discovery" {
 
   environment {
     variables = {
-      CONNECTOR_ID     = module.sftp_connector.connector_id
-      S3_BUCKET        = module.retrieve_s3_bucket.s3_bucket_id
-      S3_PREFIX        = var.s3_prefix
-      SOURCE_DIRECTORY = var.source_directory
-      DYNAMODB_TABLE   = var.enable_dynamodb_tracking ? aws_dynamodb_table.file_transfer_tracking[0].name : ""
+      CONNECTOR_ID             = module.sftp_connector.connector_id
+      S3_BUCKET                = module.retrieve_s3_bucket.s3_bucket_id
+      S3_PREFIX                = var.s3_prefix
+      SOURCE_DIRECTORY         = var.source_directory
+      DYNAMODB_TABLE           = var.enable_dynamodb_tracking ? aws_dynamodb_table.file_transfer_tracking[0].name : ""
+      METRICS_ENABLED          = tostring(var.enable_metrics)
+      LISTING_COMPLETION_MODE  = var.listing_completion_mode
+      TRANSFER_RATE_PER_SECOND = tostring(var.transfer_submit_rate_per_second)
+      TRANSFER_MAX_CONCURRENCY = tostring(var.transfer_submit_max_concurrency)
+      MANIFEST_KEY             = local.manifest_key
+      TRACKING_RETENTION_DAYS  = tostring(var.tracking_retention_days)
+      LISTING_MAX_ITEMS        = var.listing_max_items == null ? "" : tostring(var.listing_max_items)
     }
   }
 
@@ -356,8 +400,18 @@ resource "aws_lambda_function" "file_discovery" {
 # Create Lambda deployment package
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/index.py"
   output_path = "${path.module}/index.zip"
+
+  source {
+    content  = file("${path.module}/index.py")
+    filename = "index.py"
+  }
+
+  # Shared instrumentation used by all SFTP Lambda handlers
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
 }
 
 ###################################################################
@@ -440,6 +494,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Action = [
           "s3:ListBucket",
           "s3:GetObject",
+          "s3:PutObject",
           "s3:DeleteObject"
         ]
         Resource = [
@@ -460,6 +515,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Effect = "Allow"
         Action = [
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:GetItem",
           "dynamodb:UpdateItem",
           "dynamodb:Query"
@@ -516,6 +572,42 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   source_arn    = aws_scheduler_schedule.lambda_trigger.arn
 }
 
+###################################################################
+# EventBridge Rule for Directory Listing Completion
+###################################################################
+resource "aws_cloudwatch_event_rule" "listing_completed" {
+  count = var.listing_completion_mode == "event" ? 1 : 0
+
+  name        = "sftp-listing-completed-${random_pet.name.id}"
+  description = "Resume file discovery when a directory listing completes"
+
+  event_pattern = jsonencode({
+    source      = ["aws.transfer"]
+    detail-type = ["SFTP Connector Directory Listing Completed"]
+    detail = {
+      "connector-id" = [module.sftp_connector.connector_id]
+    }
+  })
+}
+
+resource "aws_cloudwatch_event_target" "listing_completed_target" {
+  count = var.listing_completion_mode == "event" ? 1 : 0
+
+  rule      = aws_cloudwatch_event_rule.listing_completed[0].name
+  target_id = "FileDiscoveryListingCompleted"
+  arn       = aws_lambda_function.file_discovery.arn
+}
+
+resource "aws_lambda_permission" "allow_listing_completed_event" {
+  count = var.listing_completion_mode == "event" ? 1 : 0
+
+  statement_id  = "AllowExecutionFromListingCompletedEvent"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.file_discovery.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.listing_completed[0].arn
+}
+
 ###################################################################
 # Status Checker Scheduler
 ###################################################################
@@ -599,8 +691,17 @@ data "archive_file" "event_listener_zip" {
   count = var.enable_dynamodb_tracking ? 1 : 0
 
   type        = "zip"
-  source_file = "event_listener.py"
-  output_path = "event_listener.zip"
+  output_path = "${path.module}/event_listener.zip"
+
+  source {
+    content  = file("${path.module}/event_listener.py")
+    filename = "event_listener.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
 }
 
 resource "aws_lambda_function" "event_listener" {
@@ -620,7 +721,13 @@ resource "aws_lambda_function" "event_listener" {
 
   environment {
     variables = {
-      DYNAMODB_TABLE = aws_dynamodb_table.file_transfer_tracking[0].name
+      DYNAMODB_TABLE               = aws_dynamodb_table.file_transfer_tracking[0].name
+      STATUS_INDEX                 = local.status_index
+      METRICS_ENABLED              = tostring(var.enable_metrics)
+      MANIFEST_BUCKET              = module.retrieve_s3_bucket.s3_bucket_id
+      MANIFEST_KEY                 = local.manifest_key
+      STATUS_CHECK_MAX_CONCURRENCY = tostring(var.status_check_max_concurrency)
+      TRACKING_RETENTION_DAYS      = tostring(var.tracking_retention_days)
     }
   }
 
@@ -650,7 +757,7 @@ resource "aws_cloudwatch_event_rule" "transfer_events" {
       "SFTP Connector Directory Listing Failed"
     ]
     detail = {
-      connectorId = [module.sftp_connector.connector_id]
+      "connector-id" = [module.sftp_connector.connector_id]
     }
   })
 
@@ -729,10 +836,203 @@ resource "aws_iam_role_policy" "event_listener_policy" {
       {
         Effect = "Allow"
         Action = [
-          "dynamodb:Scan",
+          "dynamodb:Query",
           "dynamodb:UpdateItem"
         ]
-        Resource = aws_dynamodb_table.file_transfer_tracking[0].arn
+        Resource = [
+          aws_dynamodb_table.file_transfer_tracking[0].arn,
+          "${aws_dynamodb_table.file_transfer_tracking[0].arn}/index/${local.status_index}"
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:ListBucket",
+          "s3:GetObject",
+          "s3:PutObject"
+        ]
+        Resource = [
+          module.retrieve_s3_bucket.s3_bucket_arn,
+          "${module.retrieve_s3_bucket.s3_bucket_arn}/manifests/*"
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "kms:Decrypt",
+          "kms:GenerateDataKey"
+        ]
+        Resource = local.kms_key_arn
+      }
+    ]
+  })
+}
+
+###################################################################
+# Tracking Archive - TTL-expired tracking items compacted to S3
+###################################################################
+data "archive_file" "tracking_archiver_zip" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  type        = "zip"
+  output_path = "${path.module}/tracking_archiver.zip"
+
+  source {
+    content  = file("${path.module}/../../lambda/tracking_archiver.py")
+    filename = "tracking_archiver.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
+}
+
+resource "aws_lambda_function" "tracking_archiver" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  #checkov:skip=CKV_AWS_272: "Lambda function does not require code signing for this use case"
+  #checkov:skip=CKV_AWS_116: "Lambda function does not require DLQ for this use case"
+  #checkov:skip=CKV_AWS_117: "Lambda function does not require VPC configuration for this use case"
+  filename                       = data.archive_file.tracking_archiver_zip[0].output_path
+  function_name                  = "sftp-tracking-archiver-${random_pet.name.id}"
+  role                           = aws_iam_role.tracking_archiver_role[0].arn
+  handler                        = "tracking_archiver.lambda_handler"
+  runtime                        = "python3.12"
+  timeout                        = 120
+  memory_size                    = 256
+  reserved_concurrent_executions = 10
+  kms_key_arn                    = local.kms_key_arn
+  source_code_hash               = data.archive_file.tracking_archiver_zip[0].output_base64sha256
+
+  environment {
+    variables = {
+      ARCHIVE_BUCKET  = module.retrieve_s3_bucket.s3_bucket_id
+      ARCHIVE_PREFIX  = local.tracking_archive_prefix
+      METRICS_ENABLED = tostring(var.enable_metrics)
+    }
+  }
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  tags = {
+    Environment = "Demo"
+    Project     = "SFTP Tracking Archive"
+  }
+}
+
+# Stream batches the archiver still fails on after its retries are recorded here. The message
+# holds the shard and sequence range, not the items, and the stream keeps them for 24 hours.
+resource "aws_sqs_queue" "tracking_archiver_failures" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name                              = "sftp-tracking-archiver-failures-${random_pet.name.id}"
+  kms_master_key_id                 = local.kms_key_arn
+  kms_data_key_reuse_period_seconds = 300
+  message_retention_seconds         = 1209600
+
+  tags = {
+    Environment = "Demo"
+    Project     = "SFTP Tracking Archive"
+  }
+}
+
+# Only items removed by TTL reach the archiver, deletes made by anything else are not archived
+resource "aws_lambda_event_source_mapping" "tracking_archiver" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  event_source_arn                   = aws_dynamodb_table.file_transfer_tracking[0].stream_arn
+  function_name                      = aws_lambda_function.tracking_archiver[0].arn
+  starting_position                  = "TRIM_HORIZON"
+  batch_size                         = 1000
+  maximum_batching_window_in_seconds = 300
+  maximum_retry_attempts             = 10
+  # Halve a failing batch so one bad record does not hold back the rest of the shard
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.tracking_archiver_failures[0].arn
+    }
+  }
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName = ["REMOVE"]
+        userIdentity = {
+          type        = ["Service"]
+          principalId = ["dynamodb.amazonaws.com"]
+        }
+      })
+    }
+  }
+}
+
+# IAM role for tracking archiver Lambda
+resource "aws_iam_role" "tracking_archiver_role" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name = "lambda-tracking-archiver-role-${random_pet.name.id}"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+# IAM policy for tracking archiver Lambda
+resource "aws_iam_role_policy" "tracking_archiver_policy" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name = "lambda-tracking-archiver-policy-${random_pet.name.id}"
+  role = aws_iam_role.tracking_archiver_role[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams"
+        ]
+        Resource = aws_dynamodb_table.file_transfer_tracking[0].stream_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage"
+        ]
+        Resource = aws_sqs_queue.tracking_archiver_failures[0].arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:PutObject"
+        ]
+        Resource = "${module.retrieve_s3_bucket.s3_bucket_arn}/${local.tracking_archive_prefix}/*"
       },
       {
         Effect = "Allow"
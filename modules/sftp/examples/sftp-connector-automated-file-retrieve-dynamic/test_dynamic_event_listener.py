@@ -0,0 +1,150 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the dynamic retrieve status checker (event_listener.py)"""
+
+import json
+import threading
+import time
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Key
+
+from conftest import LambdaContext
+
+HANDLER = 'examples/sftp-connector-automated-file-retrieve-dynamic/event_listener.py'
+BUCKET = 'retrieve-bucket'
+TABLE = 'retrieve-tracking'
+MANIFEST_KEY = 'manifests/c-0123456789abcdef0.json.gz'
+CONNECTOR_ID = 'c-0123456789abcdef0'
+
+@pytest.fixture
+def table(aws):
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    boto3.client('dynamodb').create_table(
+        TableName=TABLE,
+        KeySchema=[{'AttributeName': 'batch_id', 'KeyType': 'HASH'}, {'AttributeName': 'record_id', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'batch_id', 'AttributeType': 'S'},
+            {'AttributeName': 'record_id', 'AttributeType': 'S'},
+            {'AttributeName': 'pending_status', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'pending-status-index',
+            'KeySchema': [{'AttributeName': 'pending_status', 'KeyType': 'HASH'}, {'AttributeName': 'batch_id', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return boto3.resource('dynamodb').Table(TABLE)
+
+@pytest.fixture
+def listener(table, transfer, load_module):
+    return load_module(HANDLER, DYNAMODB_TABLE=TABLE, MANIFEST_BUCKET=BUCKET, MANIFEST_KEY=MANIFEST_KEY)
+
+def put_transfer(table, record_id, transfer_id, paths):
+    table.put_item(Item={
+        'batch_id': 'batch-1',
+        'record_id': record_id,
+        'transfer_id': transfer_id,
+        'connector_id': CONNECTOR_ID,
+        'status': 'TRANSFER_STARTED',
+        'pending_status': 'TRANSFER_STARTED',
+        'file_paths': paths,
+        'file_sizes': [10] * len(paths),
+        'files_count': len(paths),
+        'started_at': '2026-01-01T00:00:00.000Z',
+        'updated_at': '2026-01-01T00:00:00.000Z'
+    })
+
+def test_failed_files_are_removed_from_the_manifest(listener, table, transfer, aws, lambda_context):
+    manifest = aws.RemoteFileManifest(boto3.client('s3'), BUCKET, MANIFEST_KEY)
+    manifest.update(lambda files: files.update({'/uploads/ok.csv': [10, 't'], '/uploads/bad.csv': [10, 't']}))
+    put_transfer(table, 'CHUNK#000000', 't-1', ['/uploads/ok.csv', '/uploads/bad.csv'])
+    transfer.results['t-1'] = [
+        {'FilePath': '/uploads/ok.csv', 'StatusCode': 'COMPLETED'},
+        {'FilePath': '/uploads/bad.csv', 'StatusCode': 'FAILED', 'Failure': {'Message': 'Permission denied'}}
+    ]
+
+    response = listener.lambda_handler({}, lambda_context)
+
+    assert json.loads(response['body'])['transfers_completed'] == 1
+    files, _ = manifest.load()
+    assert files == {'/uploads/ok.csv': [10, 't']}
+    item = table.get_item(Key={'batch_id': 'batch-1', 'record_id': 'CHUNK#000000'})['Item']
+    assert item['status'] == 'PARTIALLY_FAILED'
+    assert 'pending_status' not in item
+
+def test_transfers_with_failed_files_stay_pending_when_the_manifest_write_fails(listener, table, transfer, monkeypatch, lambda_context):
+    put_transfer(table, 'CHUNK#000000', 't-1', ['/uploads/ok.csv'])
+    put_transfer(table, 'CHUNK#000001', 't-2', ['/uploads/bad.csv'])
+    transfer.results['t-1'] = [{'FilePath': '/uploads/ok.csv', 'StatusCode': 'COMPLETED'}]
+    transfer.results['t-2'] = [{'FilePath': '/uploads/bad.csv', 'StatusCode': 'FAILED'}]
+    def unavailable(failed_paths):
+        raise RuntimeError('manifest bucket unavailable')
+    monkeypatch.setattr(listener, 'forget_failed_files', unavailable)
+
+    response = listener.lambda_handler({}, lambda_context)
+
+    body = json.loads(response['body'])
+    assert (body['transfers_completed'], body['transfers_deferred']) == (1, 1)
+    clean = table.get_item(Key={'batch_id': 'batch-1', 'record_id': 'CHUNK#000000'})['Item']
+    held = table.get_item(Key={'batch_id': 'batch-1', 'record_id': 'CHUNK#000001'})['Item']
+    assert clean['status'] == 'COMPLETED'
+    # Closing it would leave /uploads/bad.csv in the manifest for good
+    assert held['pending_status'] == 'TRANSFER_STARTED'
+
+def test_finished_transfers_are_written_in_transactions(listener, table, transfer, aws, lambda_context):
+    for n in range(120):
+        transfer_id = f't-{n}'
+        put_transfer(table, f'CHUNK#{n:06d}', transfer_id, [f'/uploads/{n}.csv'])
+        transfer.results[transfer_id] = [{'FilePath': f'/uploads/{n}.csv', 'StatusCode': 'COMPLETED'}]
+    transactions = []
+    aws.get_resource('dynamodb').meta.client.meta.events.register(
+        'provide-client-params.dynamodb.TransactWriteItems',
+        lambda params, **kwargs: transactions.append(len(params['TransactItems']))
+    )
+
+    response = listener.lambda_handler({}, lambda_context)
+
+    assert json.loads(response['body'])['transfers_completed'] == 120
+    assert transactions == [100, 20]
+    items = table.scan()['Items']
+    assert {item['status'] for item in items} == {'COMPLETED'}
+    assert not any('pending_status' in item for item in items)
+
+def test_transfers_still_polled_at_the_deadline_stay_pending(listener, table, transfer, monkeypatch):
+    put_transfer(table, 'CHUNK#000000', 't-1', ['/uploads/slow.csv'])
+    released = threading.Event()
+    monkeypatch.setattr(transfer, 'list_file_transfer_results', lambda **kwargs: released.wait(5) and {})
+    monkeypatch.setenv('STATUS_CHECK_RESERVE_MS', '10000')
+
+    started = time.monotonic()
+    try:
+        response = listener.lambda_handler({}, LambdaContext(remaining_ms=10200))
+    finally:
+        released.set()
+
+    assert time.monotonic() - started < 2
+    body = json.loads(response['body'])
+    assert body['transfers_deferred'] == 1
+    assert body['transfers_completed'] == 0
+    item = table.get_item(Key={'batch_id': 'batch-1', 'record_id': 'CHUNK#000000'})['Item']
+    assert item['pending_status'] == 'TRANSFER_STARTED'
+
+def pending_record_ids(table):
+    response = table.query(IndexName='pending-status-index', KeyConditionExpression=Key('pending_status').eq('TRANSFER_STARTED'))
+    return sorted(item['record_id'] for item in response['Items'])
+
+def test_closed_transfers_leave_the_pending_status_index(listener, table, transfer, lambda_context):
+    put_transfer(table, 'CHUNK#000000', 't-done', ['/uploads/done.csv'])
+    put_transfer(table, 'CHUNK#000001', 't-running', ['/uploads/running.csv'])
+    transfer.results['t-done'] = [{'FilePath': '/uploads/done.csv', 'StatusCode': 'COMPLETED'}]
+    transfer.results['t-running'] = [{'FilePath': '/uploads/running.csv', 'StatusCode': 'IN_PROGRESS'}]
+    assert pending_record_ids(table) == ['CHUNK#000000', 'CHUNK#000001']
+
+    listener.lambda_handler({}, lambda_context)
+
+    # Only the transfer still running is read by the next check
+    assert pending_record_ids(table) == ['CHUNK#000001']
+    closed = table.get_item(Key={'batch_id': 'batch-1', 'record_id': 'CHUNK#000000'})['Item']
+    assert closed['status'] == 'COMPLETED' and 'pending_status' not in closed
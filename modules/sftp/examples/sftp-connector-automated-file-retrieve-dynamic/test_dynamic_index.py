@@ -0,0 +1,228 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the dynamic retrieve discovery handler (index.py)"""
+
+import io
+import json
+import time
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from conftest import LambdaContext
+
+HANDLER = 'examples/sftp-connector-automated-file-retrieve-dynamic/index.py'
+BUCKET = 'retrieve-bucket'
+CONNECTOR_ID = 'c-0123456789abcdef0'
+MANIFEST_KEY = 'manifests/retrieved.json.gz'
+
+def listing_body(paths, truncated=False):
+    return json.dumps({
+        'files': [{'filePath': path, 'size': 10, 'modifiedTimestamp': '2026-01-01T00:00:00Z'} for path in paths],
+        'paths': [],
+        'truncated': truncated
+    })
+
+def listing_completed_event(listing_id, listing_key):
+    """SFTP Connector Directory Listing Completed event as Transfer Family delivers it"""
+    return {
+        'version': '0',
+        'id': '5d4c3b2a-0000-4000-8000-000000000000',
+        'detail-type': 'SFTP Connector Directory Listing Completed',
+        'source': 'aws.transfer',
+        'account': '123456789012',
+        'time': '2026-01-01T00:00:05Z',
+        'region': 'us-east-1',
+        'resources': [f'arn:aws:transfer:us-east-1:123456789012:connector/{CONNECTOR_ID}'],
+        'detail': {
+            'connector-id': CONNECTOR_ID,
+            'listing-id': listing_id,
+            'remote-directory-path': '/uploads',
+            'url': 'sftp://example.com',
+            'item-count': 3,
+            'max-items': 10000,
+            'output-directory-path': f'/{BUCKET}/retrieved',
+            'truncated': False,
+            'status-code': 'COMPLETED',
+            'start-timestamp': '2026-01-01T00:00:01.000Z',
+            'end-timestamp': '2026-01-01T00:00:04.000Z',
+            'output-file-location': {'domain': 'S3', 'bucket': BUCKET, 'key': listing_key}
+        }
+    }
+
+@pytest.fixture
+def index(aws, transfer, load_module):
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    return load_module(HANDLER, CONNECTOR_ID=CONNECTOR_ID, S3_BUCKET=BUCKET, S3_PREFIX='retrieved', TRANSFER_RATE_PER_SECOND='1000')
+
+def test_listing_completed_event_retrieves_listed_files(index, transfer, lambda_context):
+    listing_id = 'a1b2c3d4-0000-4000-8000-000000000000'
+    listing_key = f'retrieved/{CONNECTOR_ID}-{listing_id}.json'
+    paths = ['/uploads/a.csv', '/uploads/b.csv', '/uploads/c.csv']
+    s3 = boto3.client('s3')
+    s3.put_object(Bucket=BUCKET, Key=listing_key, Body=listing_body(paths))
+
+    response = index.lambda_handler(listing_completed_event(listing_id, listing_key), lambda_context)
+
+    assert json.loads(response['body'])['transfers_started'] == 1
+    assert transfer.transfers[0]['RetrieveFilePaths'] == paths
+    assert transfer.transfers[0]['LocalDirectoryPath'] == f'/{BUCKET}/retrieved'
+    assert s3.list_objects_v2(Bucket=BUCKET)['KeyCount'] == 0
+
+def test_listing_completed_event_for_processed_listing_is_ignored(index, transfer, lambda_context):
+    event = listing_completed_event('a1b2c3d4-0000-4000-8000-000000000000', f'retrieved/{CONNECTOR_ID}-gone.json')
+
+    response = index.lambda_handler(event, lambda_context)
+
+    assert json.loads(response['body'])['message'] == 'Directory listing already processed'
+    assert transfer.transfers == []
+
+def read_listing(index, listing, chunk_size):
+    data = listing.encode('utf-8')
+    reader = index.DirectoryListingReader(StreamingBody(io.BytesIO(data), len(data)), chunk_size=chunk_size)
+    return list(reader.files()), reader.truncated
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64 * 1024])
+def test_listing_reader_handles_any_chunk_boundary(index, chunk_size):
+    files = [
+        {'filePath': '/uploads/r\u00e9sum\u00e9-\u65e5\u672c.csv', 'size': 1234567890, 'modifiedTimestamp': '2026-01-01T00:00:00Z'},
+        {'filePath': '/uploads/\U0001f4c4.txt', 'size': 0.5, 'modifiedTimestamp': '2026-01-02T00:00:00Z'},
+        {'filePath': '/uploads/empty', 'size': 0, 'modifiedTimestamp': None}
+    ]
+    listing = json.dumps({'paths': [{'path': '/uploads/sub'}], 'files': files, 'truncated': True}, ensure_ascii=False, indent=1)
+
+    assert read_listing(index, listing, chunk_size) == (files, True)
+
+def test_listing_reader_reads_truncated_before_files(index):
+    listing = '{"truncated":false,"files":[{"filePath":"/a","size":10}],"paths":[]}'
+
+    assert read_listing(index, listing, 4) == ([{'filePath': '/a', 'size': 10}], False)
+    assert read_listing(index, '{}', 1) == ([], False)
+
+def test_listing_reader_rejects_a_cut_off_listing(index):
+    with pytest.raises(ValueError):
+        read_listing(index, '{"files":[{"filePath":"/a","size":10},{"filePath":"/b","si', 5)
+
+class Interrupted(BaseException):
+    """Stands in for the invocation being cut off"""
+
+@pytest.fixture
+def incremental(aws, transfer, load_module):
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    return load_module(
+        HANDLER,
+        CONNECTOR_ID=CONNECTOR_ID,
+        S3_BUCKET=BUCKET,
+        S3_PREFIX='retrieved',
+        MANIFEST_KEY=MANIFEST_KEY,
+        TRANSFER_RATE_PER_SECOND='1000',
+        TRANSFER_MAX_CONCURRENCY='1',
+        MANIFEST_CHECKPOINT_TRANSFERS='2'
+    )
+
+def put_listing(count):
+    listing_key = f'retrieved/{CONNECTOR_ID}-listing.json'
+    paths = [f'/uploads/{n:03d}.csv' for n in range(count)]
+    boto3.client('s3').put_object(Bucket=BUCKET, Key=listing_key, Body=listing_body(paths))
+    return listing_completed_event('listing', listing_key)
+
+def manifest_paths(aws):
+    files, _ = aws.RemoteFileManifest(boto3.client('s3'), BUCKET, MANIFEST_KEY).load()
+    return set(files)
+
+def started_paths(transfer):
+    return {path for started in transfer.transfers for path in started['RetrieveFilePaths']}
+
+def test_submission_stops_before_the_deadline(incremental, transfer, aws, monkeypatch):
+    start_file_transfer = transfer.start_file_transfer
+    def slow_start(**kwargs):
+        time.sleep(0.05)
+        return start_file_transfer(**kwargs)
+    monkeypatch.setattr(transfer, 'start_file_transfer', slow_start)
+    monkeypatch.setenv('SUBMIT_DEADLINE_RESERVE_MS', '10000')
+
+    response = incremental.lambda_handler(put_listing(200), LambdaContext(remaining_ms=10200))
+
+    body = json.loads(response['body'])
+    assert body['deferred'] is True
+    assert 0 < body['transfers_started'] < 20
+    # Deferred files stay out of the manifest, so the next run starts them
+    assert manifest_paths(aws) == started_paths(transfer)
+
+def test_manifest_is_checkpointed_while_transfers_start(incremental, transfer, aws, monkeypatch, lambda_context):
+    start_file_transfer = transfer.start_file_transfer
+    def cut_off_after_five(**kwargs):
+        if len(transfer.transfers) == 5:
+            raise Interrupted()
+        return start_file_transfer(**kwargs)
+    monkeypatch.setattr(transfer, 'start_file_transfer', cut_off_after_five)
+
+    with pytest.raises(Interrupted):
+        incremental.lambda_handler(put_listing(100), lambda_context)
+
+    checkpointed = manifest_paths(aws)
+    assert len(checkpointed) >= 20
+    assert checkpointed <= started_paths(transfer)
+
+def throttling_error():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'StartFileTransfer')
+
+def test_throttled_submissions_are_retried(index, transfer, monkeypatch):
+    monkeypatch.setattr(index.random, 'uniform', lambda low, high: 0)
+    start_file_transfer = transfer.start_file_transfer
+    throttled = set()
+    def throttle_first_attempt(**kwargs):
+        first_path = kwargs['RetrieveFilePaths'][0]
+        if first_path not in throttled:
+            throttled.add(first_path)
+            raise throttling_error()
+        return start_file_transfer(**kwargs)
+    monkeypatch.setattr(transfer, 'start_file_transfer', throttle_first_attempt)
+    started, failed = [], []
+
+    totals = index.submit_transfers(
+        transfer, 'c-throttled-retry', (f'/uploads/{n:02d}.csv' for n in range(30)), '/retrieve-bucket/retrieved',
+        lambda chunk_index, transfer_id, chunk: started.append(chunk_index), failed.append
+    )
+
+    assert totals == (3, 30, 0, False)
+    assert sorted(started) == [0, 1, 2]
+    assert failed == []
+    # Throttling slowed the connector's shared token bucket down
+    limiter = index.get_rate_limiter('c-throttled-retry', 1000)
+    assert limiter.rate < limiter.max_rate
+
+def test_submissions_still_throttled_after_the_last_attempt_fail(index, transfer, monkeypatch):
+    monkeypatch.setattr(index.random, 'uniform', lambda low, high: 0)
+    monkeypatch.setenv('TRANSFER_MAX_ATTEMPTS', '3')
+    attempts = []
+    def always_throttled(**kwargs):
+        attempts.append(kwargs['RetrieveFilePaths'][0])
+        raise throttling_error()
+    monkeypatch.setattr(transfer, 'start_file_transfer', always_throttled)
+    failed = []
+
+    totals = index.submit_transfers(
+        transfer, 'c-throttled-failure', [f'/uploads/{n:02d}.csv' for n in range(10)], '/retrieve-bucket/retrieved',
+        lambda chunk_index, transfer_id, chunk: None, failed.append
+    )
+
+    assert totals == (0, 0, 10, False)
+    assert attempts == ['/uploads/00.csv'] * 3
+    assert failed == [[f'/uploads/{n:02d}.csv' for n in range(10)]]
+
+def test_other_errors_are_not_retried(index, transfer, monkeypatch):
+    attempts = []
+    def denied(**kwargs):
+        attempts.append(kwargs)
+        raise ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'Denied'}}, 'StartFileTransfer')
+    monkeypatch.setattr(transfer, 'start_file_transfer', denied)
+
+    totals = index.submit_transfers(
+        transfer, 'c-denied', ['/uploads/00.csv'], '/retrieve-bucket/retrieved',
+        lambda chunk_index, transfer_id, chunk: None, lambda chunk: None
+    )
+
+    assert totals == (0, 0, 1, False)
+    assert len(attempts) == 1
@@ -103,3 +103,86 @@ variable "test_connector_post_deployment" {
   type        = bool
   default     = true
 }
+
+variable "enable_metrics" {
+  description = "Whether the Lambda functions emit CloudWatch Embedded Metric Format metrics for stage latency, retries and throttles"
+  type        = bool
+  default     = true
+}
+
+variable "listing_completion_mode" {
+  description = "How the discovery Lambda waits for a directory listing: 'poll' polls for the listing file with backoff until the invocation deadline, 'event' returns immediately and resumes from the directory listing completed event"
+  type        = string
+  default     = "poll"
+
+  validation {
+    condition     = contains(["poll", "event"], var.listing_completion_mode)
+    error_message = "listing_completion_mode must be either 'poll' or 'event'."
+  }
+}
+
+variable "transfer_submit_rate_per_second" {
+  description = "Maximum StartFileTransfer requests per second the discovery Lambda submits for the connector. The rate is halved while Transfer Family throttles requests"
+  type        = number
+  default     = 5
+
+  validation {
+    condition     = var.transfer_submit_rate_per_second > 0
+    error_message = "transfer_submit_rate_per_second must be greater than 0."
+  }
+}
+
+variable "transfer_submit_max_concurrency" {
+  description = "Maximum number of StartFileTransfer requests the discovery Lambda has in flight. Each request retrieves up to 10 files"
+  type        = number
+  default     = 4
+
+  validation {
+    condition     = var.transfer_submit_max_concurrency >= 1 && var.transfer_submit_max_concurrency <= 32
+    error_message = "transfer_submit_max_concurrency must be between 1 and 32."
+  }
+}
+
+variable "enable_incremental_retrieval" {
+  description = "Only retrieve remote files that are new or whose size or modification time changed since they were last retrieved, using a manifest stored in the retrieval bucket. Requires enable_dynamodb_tracking, whose status checker removes failed files from the manifest so they are retried"
+  type        = bool
+  default     = false
+
+  validation {
+    condition     = !var.enable_incremental_retrieval || var.enable_dynamodb_tracking
+    error_message = "enable_incremental_retrieval requires enable_dynamodb_tracking = true, otherwise files whose transfer fails are never retried."
+  }
+}
+
+variable "listing_max_items" {
+  description = "Maximum number of entries returned by each directory listing (MaxItems). Listings that reach it are reported as truncated. Leave null to use the Transfer Family default"
+  type        = number
+  default     = null
+
+  validation {
+    condition     = var.listing_max_items == null || try(var.listing_max_items >= 1, false)
+    error_message = "listing_max_items must be at least 1."
+  }
+}
+
+variable "status_check_max_concurrency" {
+  description = "Maximum number of transfers the status checker Lambda polls for results in parallel"
+  type        = number
+  default     = 8
+
+  validation {
+    condition     = var.status_check_max_concurrency >= 1 && var.status_check_max_concurrency <= 32
+    error_message = "status_check_max_concurrency must be between 1 and 32."
+  }
+}
+
+variable "tracking_retention_days" {
+  description = "Days finished tracking items stay in the DynamoDB table before TTL removes them and they are archived to S3 under tracking-archive/. Set to 0 to keep them in the table"
+  type        = number
+  default     = 30
+
+  validation {
+    condition     = var.tracking_retention_days >= 0
+    error_message = "tracking_retention_days must be 0 or greater."
+  }
+}
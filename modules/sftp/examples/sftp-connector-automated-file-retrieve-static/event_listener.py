@@ -1,11 +1,22 @@
 import json
-import boto3
 import os
-from datetime import datetime
+import random
+import time
+from datetime import timedelta
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from sftp_runtime import Metrics, duration_ms, get_client, get_resource, parse_utc_timestamp, query_pages, tracking_expiry, utc_timestamp
 
-dynamodb = boto3.resource('dynamodb')
-transfer_client = boto3.client('transfer')
-table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+FILE_RESULT_EVENTS = {
+    'SFTP Connector File Retrieve Completed': 'files_completed',
+    'SFTP Connector File Retrieve Failed': 'files_failed'
+}
+
+# Most actions a single TransactWriteItems request accepts
+TRANSACT_MAX_ITEMS = 100
+
+metrics = Metrics('sftp-event-listener')
+table = get_resource('dynamodb', metrics).Table(os.environ['DYNAMODB_TABLE'])
 
 def lambda_handler(event, context):
     try:
@@ -13,6 +24,9 @@ def lambda_handler(event, context):
         if 'source' in event and event['source'] == 'aws.transfer':
             # Handle EventBridge Transfer Family events
             return handle_transfer_event(event)
+        elif event.get('action') == 'start_transfer':
+            # Scheduled retrieval
+            return start_transfer()
         else:
             # Handle status checker call
             return handle_status_check()
@@ -22,61 +36,258 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+    finally:
+        metrics.flush()
+
+def start_transfer():
+    """Start the scheduled retrieval and open its batch record, keyed on the transfer ID.
+
+    File events are correlated to the batch by their transfer-id, so every
+    run has its own record. Events that arrived before the record was opened
+    are already counted on it, and close it here if they were the last.
+    """
+    file_paths = json.loads(os.environ['FILE_PATHS'])
+    with metrics.stage('TransferStart'):
+        transfer_id = get_client('transfer', metrics).start_file_transfer(
+            ConnectorId=os.environ['CONNECTOR_ID'],
+            RetrieveFilePaths=file_paths,
+            LocalDirectoryPath=os.environ['LOCAL_DIRECTORY_PATH']
+        )['TransferId']
+
+    now = utc_timestamp()
+    with metrics.stage('DynamoDbUpdate'):
+        batch = table.update_item(
+            Key={'batch_id': transfer_id},
+            UpdateExpression='SET connector_id = :connector_id, files_uploaded = :files_uploaded, files_expected = :files_expected, '
+                             'started_at = :started_at, updated_at = :updated_at, #status = if_not_exists(#status, :started), pending_status = :started',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':connector_id': os.environ['CONNECTOR_ID'],
+                ':files_uploaded': ','.join(file_paths),
+                ':files_expected': len(file_paths),
+                ':started_at': now,
+                ':updated_at': now,
+                ':started': 'TRANSFER_STARTED'
+            },
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+    print(f"Started transfer {transfer_id} for {len(file_paths)} files")
+
+    if batch.get('files_completed', 0) + batch.get('files_failed', 0) >= batch['files_expected']:
+        close_batch(batch)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message': 'Transfer started', 'transfer_id': transfer_id})
+    }
 
 def handle_transfer_event(event):
-    """Handle EventBridge Transfer Family events"""
+    """Count a per-file result event on its transfer's batch record, closing the batch when its last file reports"""
     detail = event.get('detail', {})
-    transfer_id = detail.get('transferId')
-    connector_id = detail.get('connectorId')
+    transfer_id = detail.get('transfer-id')
+    counter = FILE_RESULT_EVENTS.get(event.get('detail-type'))
 
     if not transfer_id:
         print("No transfer ID in event")
         return {'statusCode': 200, 'body': json.dumps({'message': 'No transfer ID found'})}
 
-    # Log the transfer event
-    print(f"Processing transfer event for {transfer_id}")
+    if not counter:
+        print(f"Transfer {transfer_id}: {event.get('detail-type')} for {detail.get('file-path')}")
+        return {'statusCode': 200, 'body': json.dumps({'message': f'Transfer event processed for {transfer_id}'})}
+
+    # Each scheduled run is its own batch, keyed on the transfer ID
+    batch_id = transfer_id
+    file_transfer_id = detail.get('file-transfer-id', detail.get('file-path'))
+    file_bytes = int(detail.get('bytes', 0)) if counter == 'files_completed' else 0
+    now = utc_timestamp()
+
+    # EventBridge delivers at least once, so each file transfer ID is only counted the first time it is seen.
+    # An event may arrive before start_transfer opened the record, the counters then start it.
+    try:
+        with metrics.stage('DynamoDbUpdate'):
+            batch = table.update_item(
+                Key={'batch_id': batch_id},
+                UpdateExpression=f'ADD {counter} :one, bytes_transferred :bytes, file_transfer_ids :file_transfer_id SET updated_at = :updated_at',
+                ConditionExpression='(attribute_not_exists(#status) OR #status = :started) AND NOT contains(file_transfer_ids, :file_transfer_id_value)',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':one': 1,
+                    ':bytes': file_bytes,
+                    ':file_transfer_id': {file_transfer_id},
+                    ':file_transfer_id_value': file_transfer_id,
+                    ':started': 'TRANSFER_STARTED',
+                    ':updated_at': now
+                },
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        metrics.add('DuplicateEvents', 1)
+        print(f"Ignoring repeated or late event for {detail.get('file-path')} in transfer {transfer_id}")
+        return {'statusCode': 200, 'body': json.dumps({'message': f'Transfer event already counted for {transfer_id}'})}
+
+    metrics.add('FilesTransferred' if counter == 'files_completed' else 'FilesFailed', 1)
+    metrics.add('BytesTransferred', file_bytes, 'Bytes')
+    record_file_result(batch_id, file_transfer_id, detail, counter, file_bytes)
+
+    # Until start_transfer records files_expected the batch cannot be complete
+    if 'files_expected' in batch and batch.get('files_completed', 0) + batch.get('files_failed', 0) >= batch['files_expected']:
+        close_batch(batch)
 
-    # For now, just log the event - the status checker will handle updates
     return {
         'statusCode': 200,
         'body': json.dumps({'message': f'Transfer event processed for {transfer_id}'})
     }
 
-def handle_status_check():
-    """Handle status checker calls - check all pending transfers"""
+def record_file_result(batch_id, file_transfer_id, detail, counter, file_bytes):
+    """Keep one item per transferred file with its size and timings for throughput analysis"""
+    item = {
+        'batch_id': f"{batch_id}#{file_transfer_id}",
+        'record_type': 'FILE',
+        'parent_batch_id': batch_id,
+        'connector_id': detail.get('connector-id', ''),
+        'transfer_id': detail['transfer-id'],
+        'file_path': detail.get('file-path', ''),
+        'status': 'COMPLETED' if counter == 'files_completed' else 'FAILED',
+        'bytes_transferred': file_bytes
+    }
+    # Event timestamps are normalised so every tracking item uses the same UTC format
+    if detail.get('start-timestamp') and detail.get('end-timestamp'):
+        item['started_at'] = utc_timestamp(parse_utc_timestamp(detail['start-timestamp']))
+        item['completed_at'] = utc_timestamp(parse_utc_timestamp(detail['end-timestamp']))
+        item['duration_ms'] = duration_ms(item['started_at'], item['completed_at'])
+    if tracking_expiry():
+        item['expires_at'] = tracking_expiry()
+
     try:
-        # Scan for pending transfers
-        response = table.scan(
-            FilterExpression='#status = :status',
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={':status': 'TRANSFER_STARTED'}
-        )
+        with metrics.stage('DynamoDbPut'):
+            table.put_item(Item=item)
+    except Exception as e:
+        # The batch counters are already updated, a missing file record only affects analytics
+        print(f"Error recording file result for {item['file_path']}: {str(e)}")
 
-        pending_transfers = response.get('Items', [])
-        print(f"Found {len(pending_transfers)} pending transfers to check")
+def batch_transition(batch, now, expiry):
+    """Conditional update that closes a batch from its file counters.
+
+    Guarded on the batch still being TRANSFER_STARTED with the updated_at it
+    was read with, so a run working from a stale read, or racing another run
+    or a file event, cannot overwrite a newer result.
+    """
+    files_completed = batch.get('files_completed', 0)
+    files_failed = batch.get('files_failed', 0)
+    # Files that never reported count as failed
+    files_failed += max(0, batch.get('files_expected', 0) - files_completed - files_failed)
+    new_status = 'COMPLETED' if not files_failed else 'PARTIALLY_FAILED' if files_completed else 'FAILED'
+
+    update_expression = 'SET #status = :status, completed_at = :completed_at, updated_at = :updated_at'
+    expression_values = {
+        ':status': new_status,
+        ':started': 'TRANSFER_STARTED',
+        ':completed_at': now,
+        ':updated_at': now
+    }
+    # Finished records expire from the table and are archived to S3 from the stream
+    if expiry:
+        update_expression += ', expires_at = :expires_at'
+        expression_values[':expires_at'] = expiry
+
+    if 'updated_at' in batch:
+        condition = '#status = :started AND updated_at = :read_updated_at'
+        expression_values[':read_updated_at'] = batch['updated_at']
+    else:
+        condition = '#status = :started AND attribute_not_exists(updated_at)'
+
+    update = {
+        'TableName': table.name,
+        'Key': {'batch_id': batch['batch_id']},
+        'UpdateExpression': update_expression + ' REMOVE pending_status',
+        'ConditionExpression': condition,
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': expression_values
+    }
+    return update, f"{new_status}: {files_completed} completed, {files_failed} failed"
+
+def close_batch(batch):
+    """Move a batch to its terminal status from its file counters. Returns False if it changed since it was read"""
+    update, summary = batch_transition(batch, utc_timestamp(), tracking_expiry())
+    try:
+        with metrics.stage('DynamoDbUpdate'):
+            table.meta.client.update_item(**update)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
 
-        transfers_checked = 0
+    print(f"Marked batch {batch['batch_id']} as {summary}")
+    return True
 
-        for item in pending_transfers:
-            batch_id = item['batch_id']
-            files_uploaded = item.get('files_uploaded', '')
+def close_batches(batches, now, expiry, max_attempts=5):
+    """Close batches with TransactWriteItems, up to TRANSACT_MAX_ITEMS per request.
 
-            # Mark as completed immediately
+    Batches whose condition failed changed since they were read and are left
+    to their events or the next sweep, the rest of the transaction is retried
+    without them. Returns the number of batches closed.
+    """
+    closed = 0
+    for start in range(0, len(batches), TRANSACT_MAX_ITEMS):
+        transitions = [(batch['batch_id'], *batch_transition(batch, now, expiry)) for batch in batches[start:start + TRANSACT_MAX_ITEMS]]
+        for attempt in range(max_attempts):
             try:
-                table.update_item(
-                    Key={'batch_id': batch_id},
-                    UpdateExpression='SET #status = :status, completed_at = :completed_at, updated_at = :updated_at',
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={
-                        ':status': 'COMPLETED',
-                        ':completed_at': datetime.now().isoformat(),
-                        ':updated_at': datetime.now().isoformat()
-                    }
-                )
-                print(f"Marked batch {batch_id} as completed with files: {files_uploaded}")
-                transfers_checked += 1
-            except Exception as e:
-                print(f"Error updating batch {batch_id}: {str(e)}")
+                with metrics.stage('DynamoDbTransact'):
+                    table.meta.client.transact_write_items(TransactItems=[{'Update': update} for _, update, _ in transitions])
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException' or attempt == max_attempts - 1:
+                    raise
+                reasons = e.response.get('CancellationReasons', [])
+                changed = {i for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed'}
+                metrics.add('ConditionalCheckFailures', len(changed))
+                transitions = [t for i, t in enumerate(transitions) if i not in changed]
+                if not transitions:
+                    break
+                if not changed:
+                    # Cancelled by a conflicting write rather than a condition, back off before retrying
+                    time.sleep(random.uniform(0, min(5, 0.1 * 2 ** attempt)))
+                continue
+
+            for batch_id, _, summary in transitions:
+                print(f"Marked batch {batch_id} as {summary}")
+            closed += len(transitions)
+            break
+    return closed
+
+def last_activity(batch):
+    """Timestamp of the last file event or start of a batch, None when it has neither"""
+    return batch.get('updated_at') or batch.get('started_at')
+
+def handle_status_check():
+    """Consistency sweep - close batches whose file events stopped arriving"""
+    try:
+        # One timestamp and expiry for every transition made by this run
+        now = utc_timestamp()
+        expiry = tracking_expiry()
+        stale_after = timedelta(minutes=int(os.environ.get('STATUS_SWEEP_STALE_MINUTES', '15')))
+        cutoff = parse_utc_timestamp(now) - stale_after
+
+        # Only pending batches carry pending_status, so the sparse index holds just the in-flight transfers
+        with metrics.stage('PendingQuery'):
+            pending_transfers = list(query_pages(
+                table,
+                IndexName=os.environ.get('STATUS_INDEX', 'pending-status-index'),
+                KeyConditionExpression=Key('pending_status').eq('TRANSFER_STARTED')
+            ))
+
+        metrics.add('RecordsPerInvocation', len(pending_transfers))
+        print(f"Found {len(pending_transfers)} pending transfers to check")
+
+        # Batches are normally closed by their last file event, only those with no event for a while are settled here.
+        # Every file event moves updated_at, started_at only counts for records written before it was set.
+        # Compared as datetimes, batches opened by the earlier PutItem schedule carry second-precision timestamps
+        stale_batches = [
+            item for item in pending_transfers
+            if not last_activity(item) or parse_utc_timestamp(last_activity(item)) <= cutoff
+        ]
+        transfers_checked = close_batches(stale_batches, now, expiry)
 
         return {
             'statusCode': 200,
@@ -27,6 +27,12 @@ locals {
   connector_name = "retrieve-${random_pet.name.id}"
   create_secret  = var.existing_secret_arn == null
   kms_key_arn    = local.create_secret ? aws_kms_key.transfer_family_key[0].arn : data.aws_kms_key.existing[0].arn
+  status_index   = "pending-status-index"
+
+  local_directory_path = "/${module.retrieve_s3_bucket.s3_bucket_id}/${trimsuffix(var.s3_prefix, "/")}"
+
+  # TTL-expired tracking items are archived here, partitioned by day
+  tracking_archive_prefix = "tracking-archive"
 }
 
 # Get KMS key from existing secret if provided
@@ -257,46 +263,6 @@ module "retrieve_s3_bucket" {
   }
 }
 
-###################################################################
-# EventBridge Scheduler for DynamoDB logging (only if DynamoDB is enabled)
-###################################################################
-resource "aws_scheduler_schedule" "dynamodb_logging" {
-  count = var.enable_dynamodb_tracking ? 1 : 0
-
-  name                         = "sftp-dynamodb-log-${random_pet.name.id}"
-  schedule_expression          = var.eventbridge_schedule
-  schedule_expression_timezone = "UTC"
-  state                        = "ENABLED"
-  kms_key_arn                  = local.kms_key_arn
-
-  flexible_time_window {
-    mode = "OFF"
-  }
-
-  target {
-    arn      = "arn:aws:scheduler:::aws-sdk:dynamodb:putItem"
-    role_arn = aws_iam_role.scheduler_role.arn
-
-    input = jsonencode({
-      TableName = aws_dynamodb_table.file_transfer_tracking[0].name
-      Item = {
-        batch_id = {
-          S = "batch-${random_pet.name.id}"
-        }
-        connector_id = {
-          S = module.sftp_connector.connector_id
-        }
-        files_uploaded = {
-          S = join(",", var.file_paths_to_retrieve)
-        }
-        status = {
-          S = "TRANSFER_STARTED"
-        }
-      }
-    })
-  }
-}
-
 ###################################################################
 # EventBridge Scheduler for direct Transfer Family integration
 ###################################################################
@@ -312,8 +278,11 @@ resource "aws_sqs_queue" "dlq" {
   }
 }
 
+# Without tracking the scheduler calls StartFileTransfer directly
 resource "aws_scheduler_schedule" "sftp_retrieve_direct" {
   #checkov:skip=CKV_AWS_297: "KMS encryption not required for this demo scheduler"
+  count = var.enable_dynamodb_tracking ? 0 : 1
+
   name = "sftp-retrieve-direct-${random_pet.name.id}"
 
   schedule_expression = var.eventbridge_schedule
@@ -330,7 +299,7 @@ resource "aws_scheduler_schedule" "sftp_retrieve_direct" {
     input = jsonencode({
       ConnectorId        = module.sftp_connector.connector_id
       RetrieveFilePaths  = var.file_paths_to_retrieve
-      LocalDirectoryPath = "/${module.retrieve_s3_bucket.s3_bucket_id}/${trimsuffix(var.s3_prefix, "/")}"
+      LocalDirectoryPath = local.local_directory_path
     })
   }
 }
@@ -366,6 +335,28 @@ resource "aws_dynamodb_table" "file_transfer_tracking" {
     type = "S"
   }
 
+  # Set only while a transfer is in flight, so the index stays as small as the pending work
+  attribute {
+    name = "pending_status"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name               = local.status_index
+    hash_key           = "pending_status"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["files_uploaded", "files_expected", "files_completed", "files_failed", "started_at", "updated_at"]
+  }
+
+  # Finished items get expires_at, and the stream hands them to the archiver when TTL removes them
+  stream_enabled   = true
+  stream_view_type = "OLD_IMAGE"
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
   server_side_encryption {
     enabled     = true
     kms_key_arn = local.kms_key_arn
@@ -381,38 +372,6 @@ resource "aws_dynamodb_table" "file_transfer_tracking" {
   }
 }
 
-# IAM policy for DynamoDB access (only created if DynamoDB is enabled)
-resource "aws_iam_policy" "dynamodb_policy" {
-  count = var.enable_dynamodb_tracking ? 1 : 0
-
-  name        = "transfer-dynamodb-policy-${random_pet.name.id}"
-  description = "Policy for Transfer Family to access DynamoDB tracking table"
-
-  policy = jsonencode({
-    Version = "2012-10-17"
-    Statement = [
-      {
-        Effect = "Allow"
-        Action = [
-          "dynamodb:PutItem",
-          "dynamodb:GetItem",
-          "dynamodb:UpdateItem",
-          "dynamodb:Query"
-        ]
-        Resource = aws_dynamodb_table.file_transfer_tracking[0].arn
-      }
-    ]
-  })
-}
-
-# Attach DynamoDB policy to scheduler role (only if DynamoDB is enabled)
-resource "aws_iam_role_policy_attachment" "scheduler_dynamodb_policy" {
-  count = var.enable_dynamodb_tracking ? 1 : 0
-
-  role       = aws_iam_role.scheduler_role.name
-  policy_arn = aws_iam_policy.dynamodb_policy[0].arn
-}
-
 # IAM policy for EventBridge Scheduler
 resource "aws_iam_role_policy" "scheduler_policy" {
   name = "eventbridge-scheduler-policy-${random_pet.name.id}"
@@ -435,24 +394,7 @@ resource "aws_iam_role_policy" "scheduler_policy" {
         ]
         Resource = aws_sqs_queue.dlq.arn
       }
-      ], var.enable_dynamodb_tracking ? [
-      {
-        Effect = "Allow"
-        Action = [
-          "dynamodb:PutItem",
-          "dynamodb:UpdateItem"
-        ]
-        Resource = aws_dynamodb_table.file_transfer_tracking[0].arn
-      },
-      {
-        Effect = "Allow"
-        Action = [
-          "kms:Decrypt",
-          "kms:GenerateDataKey"
-        ]
-        Resource = local.kms_key_arn
-      }
-    ] : [])
+    ]
   })
 }
 
@@ -465,8 +407,18 @@ data "archive_file" "event_listener_zip" {
   count = var.enable_dynamodb_tracking ? 1 : 0
 
   type        = "zip"
-  source_file = "${path.module}/event_listener.py"
   output_path = "${path.module}/event_listener.zip"
+
+  source {
+    content  = file("${path.module}/event_listener.py")
+    filename = "event_listener.py"
+  }
+
+  # Shared instrumentation used by all SFTP Lambda handlers
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
 }
 
 resource "aws_lambda_function" "event_listener" {
@@ -488,7 +440,13 @@ resource "aws_lambda_function" "event_listener" {
 
   environment {
     variables = {
-      DYNAMODB_TABLE = aws_dynamodb_table.file_transfer_tracking[0].name
+      DYNAMODB_TABLE          = aws_dynamodb_table.file_transfer_tracking[0].name
+      STATUS_INDEX            = local.status_index
+      CONNECTOR_ID            = module.sftp_connector.connector_id
+      FILE_PATHS              = jsonencode(var.file_paths_to_retrieve)
+      LOCAL_DIRECTORY_PATH    = local.local_directory_path
+      METRICS_ENABLED         = tostring(var.enable_metrics)
+      TRACKING_RETENTION_DAYS = tostring(var.tracking_retention_days)
     }
   }
 
@@ -544,6 +502,7 @@ resource "aws_iam_role_policy" "event_listener_policy" {
       {
         Effect = "Allow"
         Action = [
+          "transfer:StartFileTransfer",
           "transfer:ListFileTransferResults"
         ]
         Resource = module.sftp_connector.connector_arn
@@ -551,10 +510,14 @@ resource "aws_iam_role_policy" "event_listener_policy" {
       {
         Effect = "Allow"
         Action = [
-          "dynamodb:Scan",
+          "dynamodb:Query",
+          "dynamodb:PutItem",
           "dynamodb:UpdateItem"
         ]
-        Resource = aws_dynamodb_table.file_transfer_tracking[0].arn
+        Resource = [
+          aws_dynamodb_table.file_transfer_tracking[0].arn,
+          "${aws_dynamodb_table.file_transfer_tracking[0].arn}/index/${local.status_index}"
+        ]
       },
       {
         Effect = "Allow"
@@ -572,7 +535,7 @@ resource "aws_iam_role_policy" "event_listener_policy" {
 # Status Checker Scheduler
 ###################################################################
 
-# EventBridge Scheduler for status checking
+# Consistency sweep for batches whose file events stopped arriving
 resource "aws_scheduler_schedule" "status_checker" {
   count = var.enable_dynamodb_tracking ? 1 : 0
 
@@ -583,7 +546,7 @@ resource "aws_scheduler_schedule" "status_checker" {
     mode = "OFF"
   }
 
-  schedule_expression = "rate(1 minute)"
+  schedule_expression = var.status_sweep_schedule
 
   target {
     arn      = aws_lambda_function.event_listener[0].arn
@@ -651,6 +614,37 @@ resource "aws_lambda_permission" "allow_scheduler_status_checker" {
   source_arn    = aws_scheduler_schedule.status_checker[0].arn
 }
 
+# With tracking the event listener starts each scheduled transfer, so it can open a batch record per transfer ID
+resource "aws_scheduler_schedule" "sftp_retrieve_tracked" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name                         = "sftp-retrieve-tracked-${random_pet.name.id}"
+  schedule_expression          = var.eventbridge_schedule
+  schedule_expression_timezone = "UTC"
+  state                        = "ENABLED"
+  kms_key_arn                  = local.kms_key_arn
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  target {
+    arn      = aws_lambda_function.event_listener[0].arn
+    role_arn = aws_iam_role.status_checker_scheduler_role[0].arn
+    input    = jsonencode({ action = "start_transfer" })
+  }
+}
+
+resource "aws_lambda_permission" "allow_scheduler_retrieve_tracked" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  statement_id  = "AllowExecutionFromRetrieveScheduler"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.event_listener[0].function_name
+  principal     = "scheduler.amazonaws.com"
+  source_arn    = aws_scheduler_schedule.sftp_retrieve_tracked[0].arn
+}
+
 # EventBridge rule for Transfer Family events
 resource "aws_cloudwatch_event_rule" "transfer_events" {
   count = var.enable_dynamodb_tracking ? 1 : 0
@@ -665,6 +659,9 @@ resource "aws_cloudwatch_event_rule" "transfer_events" {
       "SFTP Connector File Retrieve Failed",
       "SFTP Connector File Retrieve Started"
     ]
+    detail = {
+      "connector-id" = [module.sftp_connector.connector_id]
+    }
   })
 
   tags = {
@@ -692,3 +689,181 @@ resource "aws_lambda_permission" "allow_eventbridge_event_listener" {
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.transfer_events[0].arn
 }
+
+###################################################################
+# Tracking Archive - TTL-expired tracking items compacted to S3
+###################################################################
+data "archive_file" "tracking_archiver_zip" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  type        = "zip"
+  output_path = "${path.module}/tracking_archiver.zip"
+
+  source {
+    content  = file("${path.module}/../../lambda/tracking_archiver.py")
+    filename = "tracking_archiver.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
+}
+
+resource "aws_lambda_function" "tracking_archiver" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  #checkov:skip=CKV_AWS_272: "Lambda function does not require code signing for this use case"
+  #checkov:skip=CKV_AWS_116: "Lambda function does not require DLQ for this use case"
+  #checkov:skip=CKV_AWS_117: "Lambda function does not require VPC configuration for this use case"
+  filename                       = data.archive_file.tracking_archiver_zip[0].output_path
+  function_name                  = "sftp-tracking-archiver-${random_pet.name.id}"
+  role                           = aws_iam_role.tracking_archiver_role[0].arn
+  handler                        = "tracking_archiver.lambda_handler"
+  runtime                        = "python3.12"
+  timeout                        = 120
+  memory_size                    = 256
+  reserved_concurrent_executions = 10
+  kms_key_arn                    = local.kms_key_arn
+  source_code_hash               = data.archive_file.tracking_archiver_zip[0].output_base64sha256
+
+  environment {
+    variables = {
+      ARCHIVE_BUCKET  = module.retrieve_s3_bucket.s3_bucket_id
+      ARCHIVE_PREFIX  = local.tracking_archive_prefix
+      METRICS_ENABLED = tostring(var.enable_metrics)
+    }
+  }
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  tags = {
+    Environment = "Demo"
+    Project     = "SFTP Tracking Archive"
+  }
+}
+
+# Stream batches the archiver still fails on after its retries are recorded here. The message
+# holds the shard and sequence range, not the items, and the stream keeps them for 24 hours.
+resource "aws_sqs_queue" "tracking_archiver_failures" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name                              = "sftp-tracking-archiver-failures-${random_pet.name.id}"
+  kms_master_key_id                 = local.kms_key_arn
+  kms_data_key_reuse_period_seconds = 300
+  message_retention_seconds         = 1209600
+
+  tags = {
+    Environment = "Demo"
+    Project     = "SFTP Tracking Archive"
+  }
+}
+
+# Only items removed by TTL reach the archiver, deletes made by anything else are not archived
+resource "aws_lambda_event_source_mapping" "tracking_archiver" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  event_source_arn                   = aws_dynamodb_table.file_transfer_tracking[0].stream_arn
+  function_name                      = aws_lambda_function.tracking_archiver[0].arn
+  starting_position                  = "TRIM_HORIZON"
+  batch_size                         = 1000
+  maximum_batching_window_in_seconds = 300
+  maximum_retry_attempts             = 10
+  # Halve a failing batch so one bad record does not hold back the rest of the shard
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.tracking_archiver_failures[0].arn
+    }
+  }
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName = ["REMOVE"]
+        userIdentity = {
+          type        = ["Service"]
+          principalId = ["dynamodb.amazonaws.com"]
+        }
+      })
+    }
+  }
+}
+
+# IAM role for tracking archiver Lambda
+resource "aws_iam_role" "tracking_archiver_role" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name = "lambda-tracking-archiver-role-${random_pet.name.id}"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+# IAM policy for tracking archiver Lambda
+resource "aws_iam_role_policy" "tracking_archiver_policy" {
+  count = var.enable_dynamodb_tracking ? 1 : 0
+
+  name = "lambda-tracking-archiver-policy-${random_pet.name.id}"
+  role = aws_iam_role.tracking_archiver_role[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams"
+        ]
+        Resource = aws_dynamodb_table.file_transfer_tracking[0].stream_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage"
+        ]
+        Resource = aws_sqs_queue.tracking_archiver_failures[0].arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:PutObject"
+        ]
+        Resource = "${module.retrieve_s3_bucket.s3_bucket_arn}/${local.tracking_archive_prefix}/*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "kms:Decrypt",
+          "kms:GenerateDataKey"
+        ]
+        Resource = local.kms_key_arn
+      }
+    ]
+  })
+}
@@ -29,12 +29,12 @@ output "kms_key_arn" {
 
 output "eventbridge_schedule_name" {
   description = "Name of the EventBridge schedule"
-  value       = aws_scheduler_schedule.sftp_retrieve_direct.name
+  value       = var.enable_dynamodb_tracking ? aws_scheduler_schedule.sftp_retrieve_tracked[0].name : aws_scheduler_schedule.sftp_retrieve_direct[0].name
 }
 
 output "eventbridge_schedule_arn" {
   description = "ARN of the EventBridge schedule"
-  value       = aws_scheduler_schedule.sftp_retrieve_direct.arn
+  value       = var.enable_dynamodb_tracking ? aws_scheduler_schedule.sftp_retrieve_tracked[0].arn : aws_scheduler_schedule.sftp_retrieve_direct[0].arn
 }
 
 output "sftp_credentials_secret_arn" {
@@ -0,0 +1,140 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the static retrieve event listener (event_listener.py)"""
+
+import json
+
+import boto3
+import pytest
+
+HANDLER = 'examples/sftp-connector-automated-file-retrieve-static/event_listener.py'
+TABLE = 'static-tracking'
+CONNECTOR_ID = 'c-0123456789abcdef0'
+FILE_PATHS = ['/uploads/report.csv', '/data/file1.txt']
+
+@pytest.fixture
+def table(aws):
+    boto3.client('dynamodb').create_table(
+        TableName=TABLE,
+        KeySchema=[{'AttributeName': 'batch_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'batch_id', 'AttributeType': 'S'},
+            {'AttributeName': 'pending_status', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'pending-status-index',
+            'KeySchema': [{'AttributeName': 'pending_status', 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return boto3.resource('dynamodb').Table(TABLE)
+
+@pytest.fixture
+def listener(table, transfer, load_module):
+    return load_module(
+        HANDLER,
+        DYNAMODB_TABLE=TABLE,
+        CONNECTOR_ID=CONNECTOR_ID,
+        FILE_PATHS=json.dumps(FILE_PATHS),
+        LOCAL_DIRECTORY_PATH='/retrieve-bucket/retrieved-files'
+    )
+
+def file_event(transfer_id, path, detail_type='SFTP Connector File Retrieve Completed'):
+    return {
+        'source': 'aws.transfer',
+        'detail-type': detail_type,
+        'detail': {
+            'connector-id': CONNECTOR_ID,
+            'transfer-id': transfer_id,
+            'file-transfer-id': f'{transfer_id}/{path}',
+            'file-path': path,
+            'bytes': 100,
+            'status-code': 'COMPLETED',
+            'start-timestamp': '2026-01-01T00:00:00.000Z',
+            'end-timestamp': '2026-01-01T00:00:01.000Z'
+        }
+    }
+
+def start_run(listener, lambda_context):
+    return json.loads(listener.lambda_handler({'action': 'start_transfer'}, lambda_context)['body'])['transfer_id']
+
+def test_each_scheduled_run_has_its_own_batch(listener, table, transfer, lambda_context):
+    first = start_run(listener, lambda_context)
+    second = start_run(listener, lambda_context)
+
+    # A late event of the first run does not count against the second
+    listener.lambda_handler(file_event(first, FILE_PATHS[0]), lambda_context)
+    listener.lambda_handler(file_event(second, FILE_PATHS[0]), lambda_context)
+    listener.lambda_handler(file_event(first, FILE_PATHS[1]), lambda_context)
+
+    first_batch = table.get_item(Key={'batch_id': first})['Item']
+    second_batch = table.get_item(Key={'batch_id': second})['Item']
+    assert first_batch['status'] == 'COMPLETED'
+    assert first_batch['files_completed'] == 2
+    assert second_batch['status'] == 'TRANSFER_STARTED'
+    assert second_batch['files_completed'] == 1
+    assert transfer.transfers[0]['RetrieveFilePaths'] == FILE_PATHS
+    assert transfer.transfers[0]['LocalDirectoryPath'] == '/retrieve-bucket/retrieved-files'
+
+def test_repeated_event_is_counted_once(listener, table, lambda_context):
+    transfer_id = start_run(listener, lambda_context)
+
+    listener.lambda_handler(file_event(transfer_id, FILE_PATHS[0]), lambda_context)
+    listener.lambda_handler(file_event(transfer_id, FILE_PATHS[0]), lambda_context)
+
+    batch = table.get_item(Key={'batch_id': transfer_id})['Item']
+    assert batch['files_completed'] == 1
+    assert batch['status'] == 'TRANSFER_STARTED'
+
+def test_events_before_the_batch_record_are_kept(listener, table, transfer, lambda_context):
+    # Both file events beat start_transfer's write, the batch is closed once files_expected is known
+    transfer_id = 't-0000'
+    listener.lambda_handler(file_event(transfer_id, FILE_PATHS[0]), lambda_context)
+    listener.lambda_handler(file_event(transfer_id, FILE_PATHS[1], 'SFTP Connector File Retrieve Failed'), lambda_context)
+    assert table.get_item(Key={'batch_id': transfer_id})['Item'].get('status') is None
+
+    assert start_run(listener, lambda_context) == transfer_id
+
+    batch = table.get_item(Key={'batch_id': transfer_id})['Item']
+    assert batch['status'] == 'PARTIALLY_FAILED'
+    assert 'pending_status' not in batch
+
+def test_sweep_compares_started_at_as_time(listener, table, lambda_context, monkeypatch):
+    monkeypatch.setattr(listener, 'utc_timestamp', lambda moment=None: '2026-01-01T00:15:00.500Z')
+    for batch_id, started_at in (
+        ('stale-seconds', '2026-01-01T00:00:00Z'),
+        ('stale-millis', '2026-01-01T00:00:00.400Z'),
+        ('fresh-seconds', '2026-01-01T00:00:01Z')
+    ):
+        table.put_item(Item={
+            'batch_id': batch_id,
+            'status': 'TRANSFER_STARTED',
+            'pending_status': 'TRANSFER_STARTED',
+            'files_expected': 1,
+            'started_at': started_at
+        })
+
+    response = listener.lambda_handler({}, lambda_context)
+
+    assert json.loads(response['body'])['transfers_completed'] == 2
+    assert table.get_item(Key={'batch_id': 'stale-seconds'})['Item']['status'] == 'FAILED'
+    assert table.get_item(Key={'batch_id': 'stale-millis'})['Item']['status'] == 'FAILED'
+    assert table.get_item(Key={'batch_id': 'fresh-seconds'})['Item']['status'] == 'TRANSFER_STARTED'
+
+def test_sweep_keeps_old_batches_that_still_receive_events(listener, table, lambda_context, monkeypatch):
+    monkeypatch.setattr(listener, 'utc_timestamp', lambda moment=None: '2026-01-01T02:00:00.000Z')
+    for batch_id, updated_at in (('active', '2026-01-01T01:59:00.000Z'), ('quiet', '2026-01-01T01:30:00.000Z')):
+        table.put_item(Item={
+            'batch_id': batch_id,
+            'status': 'TRANSFER_STARTED',
+            'pending_status': 'TRANSFER_STARTED',
+            'files_expected': 1000,
+            'files_completed': 400,
+            'started_at': '2026-01-01T00:00:00.000Z',
+            'updated_at': updated_at
+        })
+
+    listener.lambda_handler({}, lambda_context)
+
+    assert table.get_item(Key={'batch_id': 'active'})['Item']['status'] == 'TRANSFER_STARTED'
+    assert table.get_item(Key={'batch_id': 'quiet'})['Item']['status'] == 'PARTIALLY_FAILED'
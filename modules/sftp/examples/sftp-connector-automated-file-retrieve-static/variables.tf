@@ -108,3 +108,31 @@ variable "test_connector_post_deployment" {
   type        = bool
   default     = false
 }
+
+variable "enable_metrics" {
+  description = "Whether the Lambda functions emit CloudWatch Embedded Metric Format metrics for stage latency, retries and throttles"
+  type        = bool
+  default     = true
+}
+
+variable "status_sweep_schedule" {
+  description = "Schedule expression for the status checker sweep that closes batches whose file events stopped arriving. Batches are normally closed by their last file event"
+  type        = string
+  default     = "rate(15 minutes)"
+
+  validation {
+    condition     = can(regex("^(rate\\([0-9]+ (minute|minutes|hour|hours|day|days)\\)|cron\\(.+\\))$", var.status_sweep_schedule))
+    error_message = "status_sweep_schedule must be in rate() or cron() format. Examples: 'rate(15 minutes)', 'cron(0 * * * ? *)'."
+  }
+}
+
+variable "tracking_retention_days" {
+  description = "Days finished tracking items stay in the DynamoDB table before TTL removes them and they are archived to S3 under tracking-archive/. Set to 0 to keep them in the table"
+  type        = number
+  default     = 30
+
+  validation {
+    condition     = var.tracking_retention_days >= 0
+    error_message = "tracking_retention_days must be 0 or greater."
+  }
+}
@@ -1,21 +1,406 @@
-import boto3
 import os
+import io
 import json
+import hashlib
+import posixpath
+import random
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from botocore.exceptions import ClientError
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from sftp_runtime import Metrics, get_client, get_rate_limiter, is_throttling_error, utc_timestamp
+
+# Most paths a single StartFileTransfer request accepts in SendFilePaths
+SEND_FILE_PATHS_MAX = 10
+
+# Size of each multipart upload part of a bundle, above the 5 MiB S3 minimum
+BUNDLE_PART_SIZE = 8 * 1024 * 1024
+
+metrics = Metrics('sftp-file-send')
 
 def handler(event, context):
-    transfer_client = boto3.client('transfer')
+    """
+    Start SFTP transfers for S3 Object Created events.
+    Invoked directly by EventBridge with one event, or by the SQS send queue
+    with a batch of them.
+    """
+    try:
+        if 'Records' in event:
+            return handle_queued_events(event['Records'], context)
+        return handle_object_created(event)
+    finally:
+        metrics.flush()
+
+class SendScheduler:
+    """Paces StartFileTransfer requests for the connector and tracks how many are in flight at once.
+
+    Every request waits for a token from the connector's token bucket, shared
+    by every invocation in the container. When Transfer Family throttles, the
+    bucket halves its rate and the request is retried with jittered backoff.
+    """
+
+    def __init__(self, transfer_client, connector_id):
+        self.transfer_client = transfer_client
+        self.limiter = get_rate_limiter(connector_id, float(os.environ.get('TRANSFER_RATE_PER_SECOND', '5')))
+        self.max_attempts = int(os.environ.get('TRANSFER_MAX_ATTEMPTS', '5'))
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @contextmanager
+    def request_in_flight(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def start_transfer(self, send_file_paths, remote_directory):
+        """Start one transfer, returning its transfer ID"""
+        request = transfer_request(send_file_paths, remote_directory)
+        for attempt in range(self.max_attempts):
+            self.limiter.acquire()
+            try:
+                with self.request_in_flight(), metrics.stage('TransferStart'):
+                    response = self.transfer_client.start_file_transfer(**request)
+            except ClientError as e:
+                if not is_throttling_error(e) or attempt == self.max_attempts - 1:
+                    raise
+                self.limiter.throttled()
+                time.sleep(random.uniform(0, min(20, 0.5 * 2 ** attempt)))
+                continue
+
+            self.limiter.succeeded()
+            return response['TransferId']
+
+def handle_object_created(event):
+    """Send the single object of a direct EventBridge invocation"""
+    scheduler = SendScheduler(get_client('transfer', metrics), os.environ['CONNECTOR_ID'])
 
     source_bucket = event['detail']['bucket']['name']
     source_key = event['detail']['object']['key']
 
-    response = transfer_client.start_file_transfer(
-        ConnectorId=os.environ['CONNECTOR_ID'],
-        SendFilePaths=[f'/{source_bucket}/{source_key}']
-    )
+    transfer_id = scheduler.start_transfer([f'/{source_bucket}/{source_key}'], destination_directory(source_key))
+    metrics.add('FilesSent', 1)
+    metrics.add('BytesSent', event['detail']['object'].get('size', 0), 'Bytes')
 
-    print(f'Transfer started: {response["TransferId"]}')
+    print(f'Transfer started: {transfer_id}')
 
     return {
         'statusCode': 200,
         'body': json.dumps('Transfer initiated')
     }
+
+def handle_queued_events(records, context):
+    """Send a batch of queued Object Created events with as few transfers as possible.
+
+    Objects are grouped by destination directory and sent SEND_FILE_PATHS_MAX
+    paths per StartFileTransfer request, or coalesced into bundles when
+    BUNDLE_FORMAT is set, at most TRANSFER_MAX_CONCURRENCY transfers at a time
+    and paced by the SendScheduler. Requests not started
+    SEND_RESERVE_MS before the invocation deadline are left in the queue.
+    Messages whose transfer was not started are returned as batch item
+    failures so SQS redelivers only those.
+    """
+    scheduler = SendScheduler(get_client('transfer', metrics), os.environ['CONNECTOR_ID'])
+    s3_client = get_client('s3', metrics)
+    # destination directory -> send path -> (message IDs, size)
+    destinations = {}
+    failed_message_ids = []
+
+    for record in records:
+        try:
+            detail = json.loads(record['body'])['detail']
+            source_key = detail['object']['key']
+            send_path = f"/{detail['bucket']['name']}/{source_key}"
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Unreadable send queue message {record.get('messageId')}: {str(e)}")
+            failed_message_ids.append(record['messageId'])
+            continue
+
+        # The same object can be queued more than once, it is sent once for all of its messages
+        files = destinations.setdefault(destination_directory(source_key), {})
+        message_ids, _ = files.get(send_path, ([], 0))
+        message_ids.append(record['messageId'])
+        files[send_path] = (message_ids, detail['object'].get('size', 0))
+
+    chunks = [
+        (remote_directory, chunk, files, bundled)
+        for remote_directory, files in destinations.items()
+        for chunk, bundled in plan_transfers(files)
+    ]
+
+    max_concurrency = max(1, int(os.environ.get('TRANSFER_MAX_CONCURRENCY', '4')))
+    reserve_ms = int(os.environ.get('SEND_RESERVE_MS', '10000'))
+    # Without a Lambda context (local runs) fall back to the function timeout
+    remaining_ms = context.get_remaining_time_in_millis() if context else 60000
+    deadline = time.monotonic() + (remaining_ms - reserve_ms) / 1000
+
+    totals = {'started': 0, 'deferred': 0}
+
+    def settle(done):
+        for future in done:
+            remote_directory, chunk, files, bundled = in_flight.pop(future)
+            try:
+                transfer_id = future.result()
+            except Exception as e:
+                print(f"Failed to start transfer of {len(chunk)} files to {remote_directory or 'the default directory'}: {str(e)}")
+                failed_message_ids.extend(message_id for path in chunk for message_id in files[path][0])
+                continue
+
+            totals['started'] += 1
+            metrics.add('FilesSent', len(chunk))
+            metrics.add('BytesSent', sum(files[path][1] for path in chunk), 'Bytes')
+            print(f"Transfer started: {transfer_id} ({len(chunk)} files{' in a bundle' if bundled else ''})")
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for position, (remote_directory, chunk, files, bundled) in enumerate(chunks):
+            if time.monotonic() >= deadline:
+                # Back to the queue rather than racing the timeout, the next delivery sends them
+                for _, deferred_chunk, deferred_files, _ in chunks[position:]:
+                    totals['deferred'] += 1
+                    failed_message_ids.extend(message_id for path in deferred_chunk for message_id in deferred_files[path][0])
+                print(f"Time budget reached, returning {totals['deferred']} transfers to the send queue")
+                break
+            if len(in_flight) >= max_concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                settle(done)
+            if bundled:
+                future = executor.submit(send_bundle, scheduler, s3_client, chunk, remote_directory)
+            else:
+                future = executor.submit(scheduler.start_transfer, chunk, remote_directory)
+            in_flight[future] = (remote_directory, chunk, files, bundled)
+        settle(list(in_flight))
+
+    metrics.add('TransfersStarted', totals['started'])
+    metrics.add('TransfersDeferred', totals['deferred'])
+    metrics.add('TransferRequestsInFlight', scheduler.peak_in_flight)
+    metrics.add('RecordsPerInvocation', len(records))
+    metrics.add('BatchItemFailures', len(failed_message_ids))
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
+
+def plan_transfers(files):
+    """Split the files of one destination into (send paths, bundled) transfers.
+
+    With BUNDLE_FORMAT set, files up to BUNDLE_SMALL_FILE_MAX_BYTES are
+    coalesced into bundles of at most BUNDLE_MAX_FILES files and
+    BUNDLE_MAX_BYTES. Larger files are sent as they are.
+    """
+    send_paths = list(files)
+    if os.environ.get('BUNDLE_FORMAT', 'none') != 'none':
+        small_file_max = int(os.environ.get('BUNDLE_SMALL_FILE_MAX_BYTES', '1048576'))
+        small_paths = [path for path in send_paths if files[path][1] <= small_file_max]
+        # Up to SEND_FILE_PATHS_MAX files already fit in one request, bundling only pays off beyond that
+        if len(small_paths) > SEND_FILE_PATHS_MAX:
+            max_files = int(os.environ.get('BUNDLE_MAX_FILES', '1000'))
+            max_bytes = int(os.environ.get('BUNDLE_MAX_BYTES', str(256 * 1024 * 1024)))
+            bundle, bundle_bytes = [], 0
+            for path in small_paths:
+                if bundle and (len(bundle) == max_files or bundle_bytes + files[path][1] > max_bytes):
+                    yield bundle, True
+                    bundle, bundle_bytes = [], 0
+                bundle.append(path)
+                bundle_bytes += files[path][1]
+            yield bundle, True
+            send_paths = [path for path in send_paths if files[path][1] > small_file_max]
+
+    for start in range(0, len(send_paths), SEND_FILE_PATHS_MAX):
+        yield send_paths[start:start + SEND_FILE_PATHS_MAX], False
+
+def send_bundle(scheduler, s3_client, send_paths, remote_directory):
+    """Stream objects into one tar.gz or zip bundle and send it with its manifest.
+
+    The bundle is written to BUNDLE_BUCKET under BUNDLE_PREFIX with a multipart
+    upload, nothing is staged on local disk. The manifest lists every file with
+    its size and SHA-256 so the partner can verify and unpack the bundle.
+    Returns the transfer ID.
+    """
+    bundle_format = os.environ['BUNDLE_FORMAT']
+    bucket = os.environ['BUNDLE_BUCKET']
+    created_at = utc_timestamp()
+    bundle_name = f"bundle-{created_at[:19].replace('-', '').replace(':', '')}Z-{uuid.uuid4().hex[:12]}.{bundle_format}"
+    bundle_key = posixpath.join(os.environ.get('BUNDLE_PREFIX', 'sftp-bundles'), bundle_name)
+    members, missing = [], []
+
+    with metrics.stage('BundleWrite'):
+        with MultipartUploadWriter(s3_client, bucket, bundle_key) as upload:
+            with bundle_archive(bundle_format, upload) as add_member:
+                for send_path, body in fetch_objects(s3_client, send_paths):
+                    source_key = send_path.split('/', 2)[2]
+                    if body is None:
+                        # Deleted since it was queued, there is nothing left to send
+                        missing.append(source_key)
+                        continue
+                    add_member(source_key, body)
+                    members.append({'key': source_key, 'size': len(body), 'sha256': hashlib.sha256(body).hexdigest()})
+
+    manifest = {
+        'bundle': bundle_name,
+        'format': bundle_format,
+        'created_at': created_at,
+        'sha256': upload.sha256.hexdigest(),
+        'bytes': upload.size,
+        'file_count': len(members),
+        'files': members,
+        'missing': missing
+    }
+    manifest_key = f'{bundle_key}.manifest.json'
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=manifest_key,
+            Body=json.dumps(manifest, indent=2).encode('utf-8'),
+            ContentType='application/json'
+        )
+        transfer_id = scheduler.start_transfer([f'/{bucket}/{bundle_key}', f'/{bucket}/{manifest_key}'], remote_directory)
+    except Exception:
+        # The retried messages build a new bundle, this one would never be sent
+        delete_bundle(s3_client, bucket, [bundle_key, manifest_key])
+        raise
+
+    metrics.add('BundlesSent', 1)
+    metrics.add('BundleBytes', upload.size, 'Bytes')
+    return transfer_id
+
+def delete_bundle(s3_client, bucket, keys):
+    """Remove a bundle and its manifest whose transfer was not started"""
+    try:
+        s3_client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+    except Exception as e:
+        print(f"Failed to delete unsent bundle {keys[0]}: {str(e)}")
+
+def fetch_objects(s3_client, send_paths):
+    """Yield (send path, body) in order, reading a few objects ahead in parallel.
+
+    Only small files are bundled, so each body is read whole. The body is None
+    for objects that no longer exist.
+    """
+    lookahead = max(1, int(os.environ.get('TRANSFER_MAX_CONCURRENCY', '4'))) * 2
+
+    def fetch(send_path):
+        bucket, key = send_path[1:].split('/', 1)
+        try:
+            return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            return None
+
+    with ThreadPoolExecutor(max_workers=lookahead) as executor:
+        pending = deque()
+        for send_path in send_paths:
+            pending.append((send_path, executor.submit(fetch, send_path)))
+            if len(pending) > lookahead:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+@contextmanager
+def bundle_archive(bundle_format, fileobj):
+    """Yield a function adding (name, bytes) members to a tar.gz or zip archive streamed to fileobj"""
+    if bundle_format == 'zip':
+        # fileobj cannot seek, so zipfile writes data descriptors after each member
+        with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            yield archive.writestr
+        return
+
+    with tarfile.open(fileobj=fileobj, mode='w|gz') as archive:
+        def add_member(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(data))
+        yield add_member
+
+class MultipartUploadWriter:
+    """Write-only file object streaming to an S3 object with a multipart upload.
+
+    Writes are buffered and uploaded BUNDLE_PART_SIZE bytes at a time, so a
+    bundle of any size holds one part in memory. The upload is completed when
+    the context exits cleanly and aborted otherwise.
+    """
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def __enter__(self):
+        self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                print(f"Failed to abort the upload of {self.key}: {str(e)}")
+            return False
+
+        # The last part may be smaller than the minimum, and an upload needs at least one part
+        if self.buffer or not self.parts:
+            self.upload_part(bytes(self.buffer))
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+        return False
+
+    def write(self, data):
+        self.buffer += data
+        self.sha256.update(data)
+        self.size += len(data)
+        while len(self.buffer) >= BUNDLE_PART_SIZE:
+            self.upload_part(bytes(self.buffer[:BUNDLE_PART_SIZE]))
+            del self.buffer[:BUNDLE_PART_SIZE]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def upload_part(self, data):
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+def destination_directory(source_key):
+    """Remote directory an object is sent to, None for the connector user's default directory"""
+    remote_directory = os.environ.get('REMOTE_DIRECTORY_PATH', '')
+    key_prefix = posixpath.dirname(source_key)
+    if os.environ.get('PRESERVE_KEY_PREFIXES') == 'true' and key_prefix:
+        remote_directory = posixpath.join(remote_directory or '/', key_prefix)
+    return remote_directory or None
+
+def transfer_request(send_file_paths, remote_directory):
+    request = {
+        'ConnectorId': os.environ['CONNECTOR_ID'],
+        'SendFilePaths': send_file_paths
+    }
+    if remote_directory:
+        request['RemoteDirectoryPath'] = remote_directory
+    return request
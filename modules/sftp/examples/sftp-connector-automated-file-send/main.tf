@@ -30,6 +30,8 @@ locals {
   connector_name = "retrieve-${random_pet.name.id}"
   create_secret  = var.existing_secret_arn == null
   kms_key_arn    = local.create_secret ? aws_kms_key.transfer_family_key[0].arn : data.aws_kms_key.existing[0].arn
+  bundle_prefix  = "sftp-bundles"
+  bundle_enabled = var.bundle_format != "none"
 }
 
 # Get KMS key from existing secret if provided
@@ -265,6 +267,10 @@ resource "aws_cloudwatch_event_rule" "s3_object_created" {
       bucket = {
         name = [module.test_s3_bucket.s3_bucket_id]
       }
+      # Bundles are written to the same bucket and sent by the Lambda function itself
+      object = {
+        key = [{ "anything-but" = { prefix = "${local.bundle_prefix}/" } }]
+      }
     }
   })
 }
@@ -386,7 +392,7 @@ resource "aws_lambda_function" "sftp_transfer" {
   role                           = aws_iam_role.lambda_role.arn
   handler                        = "index.handler"
   runtime                        = "python3.12"
-  timeout                        = 60
+  timeout                        = local.bundle_enabled ? 300 : 60
   memory_size                    = 256
   reserved_concurrent_executions = 10
   kms_key_arn                    = local.kms_key_arn
@@ -405,7 +411,19 @@ resource "aws_lambda_function" "sftp_transfer" {
 
   environment {
     variables = {
-      CONNECTOR_ID = module.sftp_connector.connector_id
+      CONNECTOR_ID             = module.sftp_connector.connector_id
+      METRICS_ENABLED          = tostring(var.enable_metrics)
+      REMOTE_DIRECTORY_PATH    = var.remote_directory_path == null ? "" : var.remote_directory_path
+      PRESERVE_KEY_PREFIXES    = tostring(var.preserve_key_prefixes)
+      TRANSFER_RATE_PER_SECOND = tostring(var.transfer_send_rate_per_second)
+      TRANSFER_MAX_CONCURRENCY = tostring(var.transfer_send_max_concurrency)
+
+      BUNDLE_FORMAT               = var.bundle_format
+      BUNDLE_BUCKET               = module.test_s3_bucket.s3_bucket_id
+      BUNDLE_PREFIX               = local.bundle_prefix
+      BUNDLE_SMALL_FILE_MAX_BYTES = tostring(var.bundle_small_file_max_bytes)
+      BUNDLE_MAX_FILES            = tostring(var.bundle_max_files)
+      BUNDLE_MAX_BYTES            = tostring(var.bundle_max_bytes)
     }
   }
 }
@@ -413,19 +431,169 @@ resource "aws_lambda_function" "sftp_transfer" {
 data "archive_file" "lambda_zip" {
   type        = "zip"
   output_path = "${path.module}/lambda_function.zip"
-  source_file = "${path.module}/index.py"
+
+  source {
+    content  = file("${path.module}/index.py")
+    filename = "index.py"
+  }
+
+  # Shared instrumentation used by all SFTP Lambda handlers
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
 }
 
 resource "aws_cloudwatch_event_target" "lambda_target" {
+  count = var.send_mode == "direct" ? 1 : 0
+
   rule      = aws_cloudwatch_event_rule.s3_object_created.name
   target_id = "SendToLambda"
   arn       = aws_lambda_function.sftp_transfer.arn
 }
 
 resource "aws_lambda_permission" "allow_eventbridge" {
+  count = var.send_mode == "direct" ? 1 : 0
+
   statement_id  = "AllowExecutionFromEventBridge"
   action        = "lambda:InvokeFunction"
   function_name = aws_lambda_function.sftp_transfer.function_name
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.s3_object_created.arn
 }
+
+# Both existed without count before send_mode, existing deployments keep them in place
+moved {
+  from = aws_cloudwatch_event_target.lambda_target
+  to   = aws_cloudwatch_event_target.lambda_target[0]
+}
+
+moved {
+  from = aws_lambda_permission.allow_eventbridge
+  to   = aws_lambda_permission.allow_eventbridge[0]
+}
+
+###################################################################
+# SQS send queue - Object Created events are buffered and sent in batches
+###################################################################
+resource "aws_sqs_queue" "send_queue" {
+  count = var.send_mode == "sqs" ? 1 : 0
+
+  name = "sftp-send-queue-${random_pet.name.id}"
+
+  # Six times the Lambda timeout, so a batch is not redelivered while it is still being sent
+  visibility_timeout_seconds = aws_lambda_function.sftp_transfer.timeout * 6
+  sqs_managed_sse_enabled    = true
+
+  # Throttled or deferred messages are received again, so they get more attempts before the DLQ
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.lambda_dlq.arn
+    maxReceiveCount     = 10
+  })
+
+  tags = {
+    Purpose = "SFTP Send Queue"
+  }
+}
+
+resource "aws_sqs_queue_policy" "send_queue" {
+  count = var.send_mode == "sqs" ? 1 : 0
+
+  queue_url = aws_sqs_queue.send_queue[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Principal = {
+          Service = "events.amazonaws.com"
+        },
+        Action   = "sqs:SendMessage",
+        Resource = aws_sqs_queue.send_queue[0].arn,
+        Condition = {
+          ArnEquals = {
+            "aws:SourceArn" = aws_cloudwatch_event_rule.s3_object_created.arn
+          }
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_cloudwatch_event_target" "send_queue_target" {
+  count = var.send_mode == "sqs" ? 1 : 0
+
+  rule      = aws_cloudwatch_event_rule.s3_object_created.name
+  target_id = "SendToQueue"
+  arn       = aws_sqs_queue.send_queue[0].arn
+}
+
+resource "aws_lambda_event_source_mapping" "send_queue" {
+  count = var.send_mode == "sqs" ? 1 : 0
+
+  event_source_arn                   = aws_sqs_queue.send_queue[0].arn
+  function_name                      = aws_lambda_function.sftp_transfer.arn
+  batch_size                         = var.send_batch_size
+  maximum_batching_window_in_seconds = var.send_batch_window_seconds
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  # Bounds how many invocations drain the queue, each paced by its own token bucket
+  scaling_config {
+    maximum_concurrency = var.send_queue_max_concurrency
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_send_queue_policy" {
+  count = var.send_mode == "sqs" ? 1 : 0
+
+  name = "lambda-sftp-send-queue-policy-${random_pet.name.id}"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ],
+        Resource = aws_sqs_queue.send_queue[0].arn
+      }
+    ]
+  })
+}
+
+###################################################################
+# Small-file bundles - written by the send Lambda with a multipart upload
+###################################################################
+resource "aws_iam_role_policy" "lambda_bundle_policy" {
+  count = local.bundle_enabled ? 1 : 0
+
+  name = "lambda-sftp-bundle-policy-${random_pet.name.id}"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:PutObject",
+          "s3:AbortMultipartUpload",
+          "s3:DeleteObject"
+        ],
+        Resource = "${module.test_s3_bucket.s3_bucket_arn}/${local.bundle_prefix}/*"
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "kms:GenerateDataKey"
+        ],
+        Resource = local.kms_key_arn
+      }
+    ]
+  })
+}
@@ -46,3 +46,8 @@ output "connector_static_ips" {
   description = "Static IP addresses of the SFTP connector"
   value       = module.sftp_connector.connector_static_ips
 }
+
+output "send_queue_url" {
+  description = "URL of the SQS queue buffering Object Created events for the send Lambda, null when send_mode is \"direct\""
+  value       = var.send_mode == "sqs" ? aws_sqs_queue.send_queue[0].id : null
+}
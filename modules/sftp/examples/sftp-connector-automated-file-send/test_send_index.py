@@ -0,0 +1,139 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the send handler (index.py)"""
+
+import hashlib
+import io
+import json
+import tarfile
+import time
+import zipfile
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+HANDLER = 'examples/sftp-connector-automated-file-send/index.py'
+BUCKET = 'send-bucket'
+CONNECTOR_ID = 'c-0123456789abcdef0'
+
+@pytest.fixture
+def bucket(aws):
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    return boto3.client('s3')
+
+@pytest.fixture
+def send(bucket, transfer, load_module):
+    def load(**env):
+        return load_module(
+            HANDLER,
+            CONNECTOR_ID=CONNECTOR_ID,
+            BUNDLE_BUCKET=BUCKET,
+            TRANSFER_RATE_PER_SECOND='1000',
+            **env
+        )
+    return load
+
+def queued_events(bucket, keys, size=10):
+    """SQS records carrying Object Created events for objects uploaded to the bucket"""
+    records = []
+    for n, key in enumerate(keys):
+        bucket.put_object(Bucket=BUCKET, Key=key, Body=f'data-{key}'.encode('utf-8'))
+        body = {'detail': {'bucket': {'name': BUCKET}, 'object': {'key': key, 'size': size}}}
+        records.append({'messageId': f'm-{n}', 'body': json.dumps(body)})
+    return {'Records': records}
+
+def bundle_keys(bucket):
+    return [item['Key'] for item in bucket.list_objects_v2(Bucket=BUCKET, Prefix='sftp-bundles/').get('Contents', [])]
+
+def test_bundle_is_deleted_when_its_transfer_does_not_start(send, bucket, transfer, monkeypatch, lambda_context):
+    handler = send(BUNDLE_FORMAT='tar.gz')
+    def refuse(**kwargs):
+        raise ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': 'Unknown connector'}}, 'StartFileTransfer')
+    monkeypatch.setattr(transfer, 'start_file_transfer', refuse)
+    event = queued_events(bucket, [f'drop/{n:02d}.csv' for n in range(20)])
+
+    response = handler.handler(event, lambda_context)
+
+    assert len(response['batchItemFailures']) == 20
+    assert bundle_keys(bucket) == []
+
+@pytest.mark.parametrize('bundle_format', ['tar.gz', 'zip'])
+def test_small_files_are_streamed_into_one_bundle_with_its_manifest(send, bucket, transfer, lambda_context, bundle_format):
+    handler = send(BUNDLE_FORMAT=bundle_format)
+    keys = [f'drop/{n:02d}.csv' for n in range(20)]
+
+    response = handler.handler(queued_events(bucket, keys), lambda_context)
+
+    assert response == {'batchItemFailures': []}
+    assert len(transfer.transfers) == 1
+    bundle_path, manifest_path = transfer.transfers[0]['SendFilePaths']
+    assert manifest_path == f'{bundle_path}.manifest.json'
+    assert bundle_path.startswith(f'/{BUCKET}/sftp-bundles/') and bundle_path.endswith(f'.{bundle_format}')
+
+    bundle = bucket.get_object(Bucket=BUCKET, Key=bundle_path.split('/', 2)[2])['Body'].read()
+    manifest = json.loads(bucket.get_object(Bucket=BUCKET, Key=manifest_path.split('/', 2)[2])['Body'].read())
+    if bundle_format == 'zip':
+        with zipfile.ZipFile(io.BytesIO(bundle)) as archive:
+            members = {name: archive.read(name) for name in archive.namelist()}
+    else:
+        with tarfile.open(fileobj=io.BytesIO(bundle), mode='r:gz') as archive:
+            members = {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+
+    assert members == {key: f'data-{key}'.encode('utf-8') for key in keys}
+    assert manifest['sha256'] == hashlib.sha256(bundle).hexdigest()
+    assert manifest['bytes'] == len(bundle)
+    assert manifest['file_count'] == 20
+    assert manifest['files'][0] == {'key': keys[0], 'size': len(members[keys[0]]), 'sha256': hashlib.sha256(members[keys[0]]).hexdigest()}
+    assert bucket.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []) == []
+
+def test_failed_bundle_write_aborts_the_multipart_upload(send, bucket):
+    handler = send(BUNDLE_FORMAT='tar.gz')
+
+    with pytest.raises(RuntimeError):
+        with handler.MultipartUploadWriter(bucket, BUCKET, 'sftp-bundles/broken.tar.gz') as upload:
+            upload.write(b'partial bundle')
+            raise RuntimeError('object read failed')
+
+    assert bucket.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []) == []
+    assert bundle_keys(bucket) == []
+
+def test_transfers_past_the_time_budget_are_left_in_the_queue(send, bucket, transfer, monkeypatch, lambda_context):
+    handler = send(TRANSFER_MAX_CONCURRENCY='1', SEND_RESERVE_MS='10000')
+    clock = {'now': 0}
+    def monotonic():
+        # Every deadline check costs 20 seconds, the budget of 50 seconds covers the first two chunks
+        clock['now'] += 20
+        return clock['now']
+    monkeypatch.setattr(handler, 'time', SimpleNamespace(monotonic=monotonic, sleep=time.sleep, time=time.time))
+    event = queued_events(bucket, [f'drop/{n:02d}.csv' for n in range(25)])
+
+    response = handler.handler(event, lambda_context)
+
+    assert [len(request['SendFilePaths']) for request in transfer.transfers] == [10, 10]
+    assert response['batchItemFailures'] == [{'itemIdentifier': f'm-{n}'} for n in range(20, 25)]
+
+def test_files_are_planned_into_bundles_and_plain_transfers(send):
+    handler = send(BUNDLE_FORMAT='tar.gz', BUNDLE_SMALL_FILE_MAX_BYTES='100', BUNDLE_MAX_FILES='8')
+    files = {f'/{BUCKET}/small/{n:02d}': ([f'm-{n}'], 10) for n in range(20)}
+    files.update({f'/{BUCKET}/large/{n}': ([f'l-{n}'], 1000) for n in range(2)})
+
+    plan = list(handler.plan_transfers(files))
+
+    assert [(len(paths), bundled) for paths, bundled in plan] == [(8, True), (8, True), (4, True), (2, False)]
+    # Up to SEND_FILE_PATHS_MAX small files fit in one request and are not bundled
+    few = {path: value for path, value in list(files.items())[:5]}
+    assert list(handler.plan_transfers(few)) == [(list(few), False)]
+
+def test_files_are_grouped_by_destination_directory(send, bucket, transfer, lambda_context):
+    handler = send(PRESERVE_KEY_PREFIXES='true', REMOTE_DIRECTORY_PATH='/inbox')
+    event = queued_events(bucket, ['orders/1.csv', 'invoices/1.csv', 'orders/2.csv', 'top.csv'])
+
+    handler.handler(event, lambda_context)
+
+    requests = {request.get('RemoteDirectoryPath'): request['SendFilePaths'] for request in transfer.transfers}
+    assert requests == {
+        '/inbox/orders': [f'/{BUCKET}/orders/1.csv', f'/{BUCKET}/orders/2.csv'],
+        '/inbox/invoices': [f'/{BUCKET}/invoices/1.csv'],
+        '/inbox': [f'/{BUCKET}/top.csv']
+    }
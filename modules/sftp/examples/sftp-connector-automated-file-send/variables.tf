@@ -64,3 +64,131 @@ variable "test_connector_post_deployment" {
   type        = bool
   default     = false
 }
+
+variable "enable_metrics" {
+  description = "Whether the Lambda function emits CloudWatch Embedded Metric Format metrics for stage latency, retries and throttles"
+  type        = bool
+  default     = true
+}
+
+variable "send_mode" {
+  description = "How S3 Object Created events reach the send Lambda. \"direct\" invokes the Lambda once per object, \"sqs\" buffers them in an SQS queue so each invocation sends a batch of files with as few StartFileTransfer requests as possible"
+  type        = string
+  default     = "direct"
+
+  validation {
+    condition     = contains(["sqs", "direct"], var.send_mode)
+    error_message = "send_mode must be \"sqs\" or \"direct\"."
+  }
+}
+
+variable "send_batch_size" {
+  description = "Maximum number of queued events delivered to one send Lambda invocation when send_mode is \"sqs\""
+  type        = number
+  default     = 100
+
+  validation {
+    condition     = var.send_batch_size >= 1 && var.send_batch_size <= 10000
+    error_message = "send_batch_size must be between 1 and 10000."
+  }
+}
+
+variable "send_batch_window_seconds" {
+  description = "Maximum time SQS waits to fill a batch before invoking the send Lambda when send_mode is \"sqs\""
+  type        = number
+  default     = 20
+
+  validation {
+    condition     = var.send_batch_window_seconds >= 0 && var.send_batch_window_seconds <= 300 && (var.send_batch_size <= 10 || var.send_batch_window_seconds >= 1)
+    error_message = "send_batch_window_seconds must be between 0 and 300, and at least 1 when send_batch_size is greater than 10."
+  }
+}
+
+variable "remote_directory_path" {
+  description = "Directory on the remote SFTP server files are sent to. Leave null to use the connector user's default directory"
+  type        = string
+  default     = null
+}
+
+variable "preserve_key_prefixes" {
+  description = "Send each object into the sub-directory of remote_directory_path matching its S3 key prefix. Objects are grouped per destination directory"
+  type        = bool
+  default     = false
+}
+
+variable "transfer_send_rate_per_second" {
+  description = "Maximum StartFileTransfer requests per second each send Lambda invocation submits for the connector. The rate is halved while Transfer Family throttles requests"
+  type        = number
+  default     = 5
+
+  validation {
+    condition     = var.transfer_send_rate_per_second > 0
+    error_message = "transfer_send_rate_per_second must be greater than 0."
+  }
+}
+
+variable "transfer_send_max_concurrency" {
+  description = "Maximum number of StartFileTransfer requests each send Lambda invocation has in flight. Each request sends up to 10 files"
+  type        = number
+  default     = 4
+
+  validation {
+    condition     = var.transfer_send_max_concurrency >= 1 && var.transfer_send_max_concurrency <= 32
+    error_message = "transfer_send_max_concurrency must be between 1 and 32."
+  }
+}
+
+variable "send_queue_max_concurrency" {
+  description = "Maximum number of send Lambda invocations draining the send queue at once when send_mode is \"sqs\". The connector receives at most this many times transfer_send_rate_per_second requests per second"
+  type        = number
+  default     = 2
+
+  validation {
+    condition     = var.send_queue_max_concurrency >= 2 && var.send_queue_max_concurrency <= 10
+    error_message = "send_queue_max_concurrency must be between 2 and 10, the Lambda function's reserved concurrency."
+  }
+}
+
+variable "bundle_format" {
+  description = "Coalesce small files into compressed bundles before sending them. \"tar.gz\" or \"zip\" sends each bundle with a JSON manifest, \"none\" sends every file as it is. Requires send_mode \"sqs\""
+  type        = string
+  default     = "none"
+
+  validation {
+    condition     = contains(["none", "tar.gz", "zip"], var.bundle_format) && (var.bundle_format == "none" || var.send_mode == "sqs")
+    error_message = "bundle_format must be \"none\", \"tar.gz\" or \"zip\", and bundles require send_mode \"sqs\"."
+  }
+}
+
+variable "bundle_small_file_max_bytes" {
+  description = "Largest file, in bytes, that is coalesced into a bundle. Larger files are sent as they are"
+  type        = number
+  default     = 1048576
+
+  validation {
+    condition     = var.bundle_small_file_max_bytes >= 1 && var.bundle_small_file_max_bytes <= 16777216
+    error_message = "bundle_small_file_max_bytes must be between 1 and 16777216 (16 MiB)."
+  }
+}
+
+variable "bundle_max_files" {
+  description = "Maximum number of files in one bundle"
+  type        = number
+  default     = 1000
+
+  validation {
+    condition     = var.bundle_max_files > 10
+    error_message = "bundle_max_files must be greater than 10, the number of files a single transfer already sends."
+  }
+}
+
+variable "bundle_max_bytes" {
+  description = "Maximum uncompressed size, in bytes, of the files in one bundle"
+  type        = number
+  default     = 268435456
+
+  validation {
+    condition     = var.bundle_max_bytes >= var.bundle_small_file_max_bytes
+    error_message = "bundle_max_bytes must be at least bundle_small_file_max_bytes."
+  }
+}
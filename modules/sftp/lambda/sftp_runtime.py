@@ -0,0 +1,315 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+# Shared runtime for the SFTP Lambda handlers, packaged next to each handler by archive_file.
+
+import boto3
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# CloudWatch Embedded Metric Format limits per log line
+EMF_MAX_METRICS = 100
+EMF_MAX_VALUES = 100
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'Throttled'
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def client_config():
+    """botocore Config shared by every pooled client"""
+    return Config(
+        retries={
+            'mode': os.environ.get('CLIENT_RETRY_MODE', 'adaptive'),
+            'total_max_attempts': int(os.environ.get('CLIENT_MAX_ATTEMPTS', '5'))
+        },
+        max_pool_connections=int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', '50')),
+        tcp_keepalive=True
+    )
+
+def get_client(service_name, metrics=None):
+    """Return the container-wide client for a service, creating it on first use"""
+    return _get_pooled(('client', service_name), lambda: boto3.client(service_name, config=client_config()), metrics)
+
+def get_resource(service_name, metrics=None):
+    """Return the container-wide resource for a service, creating it on first use"""
+    return _get_pooled(('resource', service_name), lambda: boto3.resource(service_name, config=client_config()), metrics)
+
+def _get_pooled(key, factory, metrics):
+    pooled = _clients.get(key)
+    if pooled is not None:
+        return pooled
+
+    with _clients_lock:
+        pooled = _clients.get(key)
+        if pooled is None:
+            pooled = factory()
+            if metrics:
+                metrics.instrument_client(pooled.meta.client if key[0] == 'resource' else pooled)
+            _clients[key] = pooled
+    return pooled
+
+_rate_limiters = {}
+
+class TokenBucket:
+    """Thread-safe token bucket that slows down when the service throttles.
+
+    throttled() halves the refill rate, down to a tenth of the configured
+    rate. Each succeeded() call adds back a twentieth of the configured rate
+    until it is fully restored.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = float(rate)
+        self.min_rate = self.max_rate / 10
+        self.rate = self.max_rate
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+def get_rate_limiter(key, rate, capacity=None):
+    """Return the container-wide token bucket for a key such as a connector ID"""
+    with _clients_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = TokenBucket(rate, capacity)
+    return limiter
+
+def is_throttling_error(error):
+    """Whether a botocore ClientError is a throttling response"""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def utc_timestamp(moment=None):
+    """ISO 8601 UTC timestamp with millisecond precision and a Z suffix, the format of every tracking timestamp"""
+    moment = (moment or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    return moment.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+def parse_utc_timestamp(value):
+    """Parse a tracking or event timestamp, reading naive values written by older versions as UTC"""
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def duration_ms(started_at, completed_at):
+    """Milliseconds between two tracking timestamps"""
+    return int((parse_utc_timestamp(completed_at) - parse_utc_timestamp(started_at)).total_seconds() * 1000)
+
+def tracking_expiry():
+    """TTL value in epoch seconds for a finished tracking item, None when TRACKING_RETENTION_DAYS is 0"""
+    days = int(os.environ.get('TRACKING_RETENTION_DAYS', '0'))
+    return int(time.time()) + days * 86400 if days > 0 else None
+
+def query_pages(table, **params):
+    """Yield every item of a DynamoDB Table query, following LastEvaluatedKey"""
+    while True:
+        response = table.query(**params)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+class DynamoBatchWriter:
+    """Buffers DynamoDB puts and writes them with BatchWriteItem, 25 items per request.
+
+    Unprocessed items are retried with exponential backoff and jitter, items
+    still unprocessed after max_attempts are counted in unprocessed. Works
+    with the client of a DynamoDB resource, so items use Python types.
+    """
+
+    MAX_ITEMS = 25
+
+    def __init__(self, client, table_name, max_attempts=8):
+        self.client = client
+        self.table_name = table_name
+        self.max_attempts = max_attempts
+        self.buffer = []
+        self.unprocessed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def put_item(self, Item):
+        self.buffer.append({'PutRequest': {'Item': Item}})
+        if len(self.buffer) >= self.MAX_ITEMS:
+            self.flush()
+
+    def flush(self):
+        while self.buffer:
+            requests, self.buffer = self.buffer[:self.MAX_ITEMS], self.buffer[self.MAX_ITEMS:]
+            for attempt in range(self.max_attempts):
+                response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if not requests or attempt == self.max_attempts - 1:
+                    break
+                time.sleep(random.uniform(0, min(10, 0.05 * 2 ** attempt)))
+            self.unprocessed += len(requests)
+
+class RemoteFileManifest:
+    """Gzipped JSON object in S3 mapping each retrieved remote path to [size, modified timestamp].
+
+    The whole manifest is loaded into a dict, so checking a directory listing
+    against it is one lookup per file. Writes are read-modify-write with S3
+    conditional requests, retried when another writer got there first.
+    """
+
+    def __init__(self, s3_client, bucket, key, max_attempts=5):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.max_attempts = max_attempts
+
+    def load(self):
+        """Return the manifest entries and the ETag they were read at (None when missing)"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}, None
+            raise
+        return json.loads(gzip.decompress(response['Body'].read()))['files'], response['ETag']
+
+    def update(self, apply):
+        """Apply a function to the manifest entries and store the result"""
+        for attempt in range(self.max_attempts):
+            files, etag = self.load()
+            apply(files)
+            body = gzip.compress(json.dumps({'files': files}, separators=(',', ':')).encode('utf-8'))
+            condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+            try:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=body, ContentType='application/gzip', **condition)
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict') or attempt == self.max_attempts - 1:
+                    raise
+
+class Metrics:
+    """Collects per-stage latency and throughput metrics and emits them as CloudWatch EMF.
+
+    Values are aggregated in memory during an invocation and written as a
+    handful of EMF log lines by flush(), so instrumenting a hot path costs a
+    dictionary append. Set METRICS_ENABLED=false to turn collection off.
+    """
+
+    def __init__(self, service, namespace=None, enabled=None):
+        self.service = service
+        self.namespace = namespace or os.environ.get('METRICS_NAMESPACE', 'SFTP/Lambda')
+        self.enabled = os.environ.get('METRICS_ENABLED', 'true') == 'true' if enabled is None else enabled
+        self.values = {}
+        self.units = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value, unit='Count'):
+        """Record one observation of a metric"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work and record it as <name>Latency in milliseconds"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Latency", (time.perf_counter() - start) * 1000, 'Milliseconds')
+
+    def instrument_client(self, client):
+        """Count retries and throttling responses for every call made by a boto3 client"""
+        if not self.enabled:
+            return client
+
+        def after_call(parsed, **kwargs):
+            retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            if retries:
+                self.add('Retries', retries)
+
+        def needs_retry(response, **kwargs):
+            if response and response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+                self.add('Throttles', 1)
+
+        client.meta.events.register('after-call', after_call)
+        client.meta.events.register('needs-retry', needs_retry)
+        return client
+
+    def flush(self):
+        """Write collected metrics as EMF log lines and reset for the next invocation"""
+        with self.lock:
+            values, units = self.values, self.units
+            self.values, self.units = {}, {}
+
+        if not self.enabled or not values:
+            return
+
+        names = sorted(values)
+        for start in range(0, len(names), EMF_MAX_METRICS):
+            chunk = names[start:start + EMF_MAX_METRICS]
+            rounds = max(len(values[name]) for name in chunk)
+            # Each metric holds at most EMF_MAX_VALUES values per line, so large series span several lines
+            for offset in range(0, rounds, EMF_MAX_VALUES):
+                document = {
+                    '_aws': {
+                        'Timestamp': int(time.time() * 1000),
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': [['Service']],
+                            'Metrics': []
+                        }]
+                    },
+                    'Service': self.service,
+                    'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', self.service)
+                }
+                for name in chunk:
+                    series = values[name][offset:offset + EMF_MAX_VALUES]
+                    if not series:
+                        continue
+                    document['_aws']['CloudWatchMetrics'][0]['Metrics'].append({'Name': name, 'Unit': units[name]})
+                    document[name] = series
+                print(json.dumps(document))
@@ -0,0 +1,241 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the shared runtime of the SFTP Lambda handlers (sftp_runtime.py)"""
+
+import json
+import threading
+import time
+
+import pytest
+from boto3.dynamodb.conditions import Key
+
+def test_clients_are_created_once_per_container(aws):
+    s3 = aws.get_client('s3')
+
+    assert aws.get_client('s3') is s3
+    assert aws.get_client('sqs') is not s3
+    # A resource is pooled apart from the client of the same service
+    assert aws.get_resource('dynamodb') is aws.get_resource('dynamodb')
+    assert aws.get_resource('dynamodb') is not aws.get_client('dynamodb')
+
+def test_concurrent_first_use_creates_one_client(aws, monkeypatch):
+    created = []
+    def slow_client(service_name, config):
+        time.sleep(0.05)
+        created.append(service_name)
+        return object()
+    monkeypatch.setattr(aws.boto3, 'client', slow_client)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(aws.get_client('transfer'))) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == ['transfer']
+    assert len({id(client) for client in clients}) == 1
+
+def test_pooled_clients_are_instrumented_once(aws):
+    metrics = aws.Metrics('test', enabled=True)
+    registered = []
+    metrics.instrument_client = lambda client: registered.append(client) or client
+
+    client = aws.get_client('s3', metrics)
+    aws.get_client('s3', metrics)
+    resource = aws.get_resource('dynamodb', metrics)
+
+    # A resource's calls go through its low-level client, which is what gets instrumented
+    assert registered == [client, resource.meta.client]
+
+def test_clients_retry_adaptively_by_default(aws):
+    config = aws.get_client('s3').meta.config
+
+    assert config.retries == {'mode': 'adaptive', 'total_max_attempts': 5}
+    assert config.max_pool_connections == 50
+    assert config.tcp_keepalive is True
+
+def test_client_config_reads_its_overrides(aws, monkeypatch):
+    monkeypatch.setenv('CLIENT_RETRY_MODE', 'standard')
+    monkeypatch.setenv('CLIENT_MAX_ATTEMPTS', '3')
+    monkeypatch.setenv('CLIENT_MAX_POOL_CONNECTIONS', '10')
+
+    config = aws.client_config()
+
+    assert config.retries == {'mode': 'standard', 'total_max_attempts': 3}
+    assert config.max_pool_connections == 10
+
+class FakeClock:
+    """Stands in for the time module, sleeping only advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def time(self):
+        return self.now
+
+def emf_documents(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+def test_metrics_are_flushed_as_emf(aws, capsys, monkeypatch):
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'sftp-file-discovery')
+    metrics = aws.Metrics('sftp-discovery', namespace='SFTP/Test', enabled=True)
+    metrics.add('FilesDiscovered', 3)
+    metrics.add('FilesDiscovered', 4)
+    metrics.add('BytesSent', 2048, 'Bytes')
+
+    metrics.flush()
+
+    [document] = emf_documents(capsys)
+    assert document['_aws']['CloudWatchMetrics'] == [{
+        'Namespace': 'SFTP/Test',
+        'Dimensions': [['Service']],
+        'Metrics': [{'Name': 'BytesSent', 'Unit': 'Bytes'}, {'Name': 'FilesDiscovered', 'Unit': 'Count'}]
+    }]
+    assert isinstance(document['_aws']['Timestamp'], int)
+    assert (document['Service'], document['FunctionName']) == ('sftp-discovery', 'sftp-file-discovery')
+    assert (document['FilesDiscovered'], document['BytesSent']) == ([3, 4], [2048])
+    # Collected values are reset for the next invocation
+    metrics.flush()
+    assert capsys.readouterr().out == ''
+
+def test_emf_lines_hold_at_most_100_metrics_and_100_values(aws, capsys):
+    metrics = aws.Metrics('sftp-discovery', enabled=True)
+    for n in range(150):
+        metrics.add(f'Metric{n:03d}', n)
+    for n in range(250):
+        metrics.add('Latency', n, 'Milliseconds')
+
+    metrics.flush()
+
+    documents = emf_documents(capsys)
+    for document in documents:
+        names = [metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']]
+        assert len(names) <= aws.EMF_MAX_METRICS
+        assert all(len(document[name]) <= aws.EMF_MAX_VALUES for name in names)
+    values = {}
+    for document in documents:
+        for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']:
+            values.setdefault(metric['Name'], []).extend(document[metric['Name']])
+    assert len(values) == 151
+    assert values['Latency'] == list(range(250))
+
+def test_disabled_metrics_collect_nothing(aws, capsys):
+    metrics = aws.Metrics('sftp-discovery', enabled=False)
+    metrics.add('FilesDiscovered', 3)
+    with metrics.stage('Listing'):
+        pass
+
+    metrics.flush()
+
+    assert metrics.values == {}
+    assert capsys.readouterr().out == ''
+
+def test_token_bucket_blocks_until_tokens_refill(aws, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(aws, 'time', clock)
+    bucket = aws.TokenBucket(rate=10, capacity=2)
+
+    # The bucket starts full, then each token takes a tenth of a second to refill
+    for _ in range(4):
+        bucket.acquire()
+
+    assert clock.slept == pytest.approx([0.1, 0.1])
+    clock.now += 1
+    bucket.acquire()
+    bucket.acquire()
+    # Refill stops at the capacity, however long the bucket was idle
+    assert len(clock.slept) == 2
+
+def test_token_bucket_slows_down_on_throttling_and_recovers(aws, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(aws, 'time', clock)
+    bucket = aws.TokenBucket(rate=10)
+
+    for _ in range(5):
+        bucket.throttled()
+
+    # Halved each time, never below a tenth of the configured rate
+    assert bucket.rate == 1
+    assert bucket.tokens == 0
+    bucket.acquire()
+    assert clock.slept == pytest.approx([1.0])
+    for _ in range(30):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+def test_rate_limiters_are_shared_per_key(aws):
+    limiter = aws.get_rate_limiter('c-test-shared', 5)
+
+    assert aws.get_rate_limiter('c-test-shared', 50) is limiter
+    assert aws.get_rate_limiter('c-test-other', 5) is not limiter
+
+class PartialBatchWriteClient:
+    """DynamoDB client leaving the last `unprocessed` items of each BatchWriteItem request unprocessed"""
+
+    def __init__(self, unprocessed):
+        self.unprocessed = list(unprocessed)
+        self.requests = []
+
+    def batch_write_item(self, RequestItems):
+        [(table_name, requests)] = RequestItems.items()
+        self.requests.append([request['PutRequest']['Item']['id'] for request in requests])
+        left = self.unprocessed.pop(0) if self.unprocessed else 0
+        if not left:
+            return {'UnprocessedItems': {}}
+        return {'UnprocessedItems': {table_name: requests[-left:]}}
+
+def test_batch_writer_retries_unprocessed_items(aws, monkeypatch):
+    monkeypatch.setattr(aws, 'time', FakeClock())
+    client = PartialBatchWriteClient(unprocessed=[5, 2])
+
+    with aws.DynamoBatchWriter(client, 'tracking') as writer:
+        for n in range(30):
+            writer.put_item(Item={'id': n})
+
+    # The first 25 are written in three requests, each resending what was left unprocessed
+    assert client.requests == [list(range(25)), list(range(20, 25)), [23, 24], list(range(25, 30))]
+    assert writer.unprocessed == 0
+
+def test_batch_writer_counts_items_left_after_the_last_attempt(aws, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(aws, 'time', clock)
+    client = PartialBatchWriteClient(unprocessed=[3, 3, 3])
+
+    with aws.DynamoBatchWriter(client, 'tracking', max_attempts=3) as writer:
+        for n in range(10):
+            writer.put_item(Item={'id': n})
+
+    assert len(client.requests) == 3
+    assert writer.unprocessed == 3
+    # Backed off between attempts, not after the last one
+    assert len(clock.slept) == 2
+
+def test_query_pages_follows_last_evaluated_key(aws):
+    dynamodb = aws.get_resource('dynamodb')
+    table = dynamodb.create_table(
+        TableName='tracking',
+        KeySchema=[{'AttributeName': 'batch_id', 'KeyType': 'HASH'}, {'AttributeName': 'record_id', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'batch_id', 'AttributeType': 'S'}, {'AttributeName': 'record_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for n in range(7):
+        table.put_item(Item={'batch_id': 'batch-1', 'record_id': f'CHUNK#{n:06d}'})
+    queries = []
+    query = table.query
+    table.query = lambda **params: queries.append(dict(params)) or query(**params)
+
+    items = list(aws.query_pages(table, KeyConditionExpression=Key('batch_id').eq('batch-1'), Limit=3))
+
+    assert [item['record_id'] for item in items] == [f'CHUNK#{n:06d}' for n in range(7)]
+    # Pages of 3, 3 and 1 items, each query starting after the last key of the page before
+    assert len(queries) == 3
+    assert 'ExclusiveStartKey' not in queries[0]
+    assert queries[2]['ExclusiveStartKey'] == {'batch_id': 'batch-1', 'record_id': 'CHUNK#000005'}
@@ -0,0 +1,78 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+# Archives tracking items expired by DynamoDB TTL to S3, packaged next to sftp_runtime.py by archive_file.
+
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from sftp_runtime import Metrics, get_client, parse_utc_timestamp
+
+metrics = Metrics('sftp-tracking-archiver')
+deserializer = TypeDeserializer()
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Cannot archive value of type {type(value).__name__}")
+
+def partition_date(item, record):
+    """UTC day an item belongs to, from when it finished, started or was removed"""
+    timestamp = item.get('completed_at') or item.get('started_at')
+    if timestamp:
+        try:
+            return parse_utc_timestamp(timestamp).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    removed_at = record['dynamodb'].get('ApproximateCreationDateTime', 0)
+    return datetime.fromtimestamp(removed_at, timezone.utc).strftime('%Y-%m-%d')
+
+def lambda_handler(event, context):
+    """
+    Write the old image of every TTL-expired tracking item to date-partitioned,
+    gzipped newline-delimited JSON in S3. Object keys are derived from the first
+    sequence number of the batch, so a retried batch overwrites its own output.
+    """
+    try:
+        records = event.get('Records', [])
+        partitions = {}
+
+        for record in records:
+            # Only TTL deletions are archived, the event source mapping filter also drops everything else
+            if record.get('eventName') != 'REMOVE' or record.get('userIdentity', {}).get('principalId') != 'dynamodb.amazonaws.com':
+                continue
+            image = record['dynamodb'].get('OldImage')
+            if not image:
+                continue
+            item = {k: deserializer.deserialize(v) for k, v in image.items()}
+            partitions.setdefault(partition_date(item, record), []).append(item)
+
+        if not partitions:
+            return {'statusCode': 200, 'body': json.dumps({'archived': 0})}
+
+        bucket = os.environ['ARCHIVE_BUCKET']
+        prefix = os.environ.get('ARCHIVE_PREFIX', 'tracking-archive')
+        batch_key = records[0]['dynamodb']['SequenceNumber']
+        s3_client = get_client('s3', metrics)
+
+        archived = 0
+        for day, items in sorted(partitions.items()):
+            lines = ''.join(json.dumps(item, default=json_default, separators=(',', ':')) + '\n' for item in items)
+            key = f"{prefix}/dt={day}/{batch_key}.jsonl.gz"
+            with metrics.stage('S3Put'):
+                s3_client.put_object(Bucket=bucket, Key=key, Body=gzip.compress(lines.encode('utf-8')), ContentType='application/gzip')
+            archived += len(items)
+            logger.info(f"Archived {len(items)} tracking items to s3://{bucket}/{key}")
+
+        metrics.add('RecordsArchived', archived)
+        metrics.add('ArchiveObjects', len(partitions))
+        return {'statusCode': 200, 'body': json.dumps({'archived': archived})}
+    finally:
+        metrics.flush()
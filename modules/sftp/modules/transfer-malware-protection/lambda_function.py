@@ -1,37 +1,361 @@
 import json
-import boto3
+import hashlib
 import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from sftp_runtime import Metrics, get_client
 
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
+metrics = Metrics('transfer-malware-protection')
+
+MIB = 1024 * 1024
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * MIB
+MAX_PART_SIZE = 5 * 1024 * MIB
+
+# SNS PublishBatch limits
+SNS_BATCH_MAX_ENTRIES = 10
+SNS_BATCH_MAX_BYTES = 256 * 1024
+SNS_SUBJECT_MAX_LENGTH = 100
+# Objects listed in a summary notification; the total count is always included
+SUMMARY_MAX_OBJECTS = 100
+
+# S3 DeleteObjects limit
+DELETE_OBJECTS_MAX_KEYS = 1000
+
+SCAN_STATUSES = {'NO_THREATS_FOUND', 'THREATS_FOUND', 'UNSUPPORTED', 'ACCESS_DENIED', 'FAILED'}
+ROUTING_RULES_FILE = 'routing_rules.json'
+
+# Object attributes that CopyObject carries over and a multipart copy must set explicitly
+COPIED_HEAD_ATTRIBUTES = [
+    'CacheControl',
+    'ContentDisposition',
+    'ContentEncoding',
+    'ContentLanguage',
+    'ContentType',
+    'Expires',
+    'Metadata',
+    'WebsiteRedirectLocation'
+]
+
+# Outcome of a single SQS record, used to settle deletes, idempotency and threat alerts after the batch
+RecordResult = namedtuple('RecordResult', ['message_id', 'succeeded', 'source_object', 'idempotency_key', 'threat'], defaults=(None,))
+
+class ScanEventInProgressError(Exception):
+    """Raised when the same scan event is being processed by another worker"""
+
+class IdempotencyStore:
+    """Tracks processed scan events to skip duplicate deliveries.
+
+    Completed keys are kept in an in-container LRU cache. When a DynamoDB
+    table is configured, events are also claimed with a conditional write so
+    duplicates delivered to other containers are detected; claims that are
+    never completed expire after in_progress_seconds.
+    """
+
+    def __init__(self, cache_size, table_name=None, ttl_seconds=86400, in_progress_seconds=60):
+        self.cache_size = cache_size
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.in_progress_seconds = in_progress_seconds
+        self.completed = OrderedDict()
+        self.in_progress = set()
+        self.lock = threading.Lock()
+        self.dynamodb = get_client('dynamodb', metrics) if table_name else None
+
+    def begin(self, key):
+        """Claim a key. Returns False for an already processed event"""
+        with self.lock:
+            if key in self.completed:
+                self.completed.move_to_end(key)
+                return False
+            if key in self.in_progress:
+                raise ScanEventInProgressError(key)
+            self.in_progress.add(key)
+
+        if not self.dynamodb:
+            return True
+
+        try:
+            with metrics.stage('Idempotency'):
+                claimed = self.claim(key)
+        except Exception:
+            with self.lock:
+                self.in_progress.discard(key)
+            raise
+
+        if not claimed:
+            with self.lock:
+                self.in_progress.discard(key)
+                self.remember(key)
+        return claimed
+
+    def claim(self, key):
+        """Claim a key in DynamoDB. Returns False when it is already completed"""
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'idempotency_key': {'S': key},
+                    'status': {'S': 'IN_PROGRESS'},
+                    'in_progress_until': {'N': str(now + self.in_progress_seconds)},
+                    'expires_at': {'N': str(now + self.ttl_seconds)}
+                },
+                ConditionExpression='attribute_not_exists(idempotency_key) OR expires_at < :now OR (#status = :in_progress AND in_progress_until < :now)',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':now': {'N': str(now)}, ':in_progress': {'S': 'IN_PROGRESS'}},
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            if e.response.get('Item', {}).get('status', {}).get('S') != 'COMPLETED':
+                raise ScanEventInProgressError(key)
+            return False
+
+        return True
+
+    def complete(self, key):
+        """Mark a claimed key as processed"""
+        if self.dynamodb:
+            try:
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key={'idempotency_key': {'S': key}},
+                    UpdateExpression='SET #status = :completed, expires_at = :expires_at REMOVE in_progress_until',
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues={
+                        ':completed': {'S': 'COMPLETED'},
+                        ':expires_at': {'N': str(int(time.time()) + self.ttl_seconds)}
+                    }
+                )
+            except Exception as e:
+                print(f"Failed to record completed scan event {key}: {str(e)}")
+
+        with self.lock:
+            self.in_progress.discard(key)
+            self.remember(key)
+
+    def release(self, key):
+        """Release a claimed key so the event can be retried"""
+        if self.dynamodb:
+            try:
+                self.dynamodb.delete_item(TableName=self.table_name, Key={'idempotency_key': {'S': key}})
+            except Exception as e:
+                print(f"Failed to release scan event {key}: {str(e)}")
+
+        with self.lock:
+            self.in_progress.discard(key)
+
+    def remember(self, key):
+        if self.cache_size <= 0:
+            return
+        self.completed[key] = True
+        self.completed.move_to_end(key)
+        while len(self.completed) > self.cache_size:
+            self.completed.popitem(last=False)
+
+def build_idempotency_key(detail):
+    """Build the idempotency key for a scan event from bucket, key, version/ETag and scan status"""
+    s3_details = detail.get('s3ObjectDetails', {})
+    identity = [
+        s3_details.get('bucketName'),
+        s3_details.get('objectKey'),
+        s3_details.get('versionId') or s3_details.get('eTag'),
+        detail.get('scanResultDetails', {}).get('scanResultStatus')
+    ]
+    return hashlib.sha256(json.dumps(identity).encode('utf-8')).hexdigest()
+
+def create_idempotency_store():
+    """Create the idempotency store from environment variables"""
+    return IdempotencyStore(
+        cache_size=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '0')),
+        table_name=os.environ.get('IDEMPOTENCY_TABLE') or None,
+        ttl_seconds=int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400')),
+        in_progress_seconds=int(os.environ.get('IDEMPOTENCY_IN_PROGRESS_SECONDS', '60'))
+    )
 
 def load_routing_config():
     """Load routing configuration from environment variable"""
     routing_json = os.environ.get('ROUTING_CONFIG', '{}')
     return json.loads(routing_json)
 
-def send_threat_notification(source_bucket, object_key, scan_details):
-    """Send SNS notification for threat detection"""
+def load_routing_rules():
+    """Load routing rules packaged next to this file at deploy time"""
+    rules_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ROUTING_RULES_FILE)
+    if not os.path.exists(rules_path):
+        return []
+    with open(rules_path) as rules_file:
+        return json.load(rules_file)
+
+class RoutingTable:
+    """Routing rules compiled into a prefix trie per scan status.
+
+    A lookup walks the object key once through the trie of its scan status,
+    collecting the rules whose source prefix matches, and returns the
+    destination of the first declared rule that also matches the file
+    extension and size. Statuses without a matching rule fall back to the
+    ROUTING_CONFIG destination.
+    """
+
+    def __init__(self, routing_config, routing_rules):
+        self.defaults = {status: dest for status, dest in routing_config.items() if dest}
+        self.tries = {}
+        self.size_statuses = set()
+
+        for index, rule in enumerate(routing_rules):
+            scan_status = rule.get('scan_status')
+            destination = rule.get('destination')
+            if scan_status not in SCAN_STATUSES or not destination:
+                raise ValueError(f"Invalid routing rule {index}: {rule}")
+
+            min_size_mb = rule.get('min_size_mb')
+            max_size_mb = rule.get('max_size_mb')
+            compiled_rule = (
+                index,
+                tuple(extension.lower() for extension in rule.get('file_extensions') or []),
+                None if min_size_mb is None else int(min_size_mb * MIB),
+                None if max_size_mb is None else int(max_size_mb * MIB),
+                destination
+            )
+            if min_size_mb is not None or max_size_mb is not None:
+                self.size_statuses.add(scan_status)
+
+            node = self.tries.setdefault(scan_status, {'children': {}, 'rules': []})
+            for char in rule.get('source_prefix') or '':
+                node = node['children'].setdefault(char, {'children': {}, 'rules': []})
+            node['rules'].append(compiled_rule)
+
+    def needs_object_size(self, scan_status):
+        """Whether resolving a destination for this status needs the object size"""
+        return scan_status in self.size_statuses
+
+    def resolve(self, scan_status, object_key, object_size=None):
+        """Return the destination path for an object, or None to leave it in place"""
+        node = self.tries.get(scan_status)
+        best = None
+        lower_key = object_key.lower()
+        position = 0
+
+        while node is not None:
+            for rule in node['rules']:
+                index, extensions, min_size, max_size, destination = rule
+                if best is not None and index >= best[0]:
+                    continue
+                if extensions and not lower_key.endswith(extensions):
+                    continue
+                if min_size is not None and (object_size is None or object_size < min_size):
+                    continue
+                if max_size is not None and (object_size is None or object_size >= max_size):
+                    continue
+                best = rule
+            if position == len(object_key):
+                break
+            node = node['children'].get(object_key[position])
+            position += 1
+
+        if best is not None:
+            return best[4]
+        return self.defaults.get(scan_status)
+
+class ThreatNotifier:
+    """Collects threat notifications for an invocation and publishes them with SNS PublishBatch.
+
+    In "individual" mode every infected object gets its own message; in
+    "summary" mode one digest is published per source bucket.
+    """
+
+    def __init__(self, topic_arn, mode='individual'):
+        self.topic_arn = topic_arn
+        self.mode = mode
+        self.threats = []
+        self.lock = threading.Lock()
+
+    def add(self, source_bucket, object_key, scan_details):
+        with self.lock:
+            self.threats.append((source_bucket, object_key, scan_details))
+
+    def build_entries(self):
+        """Build PublishBatch entries from the collected threats"""
+        if self.mode != 'summary':
+            return [
+                {
+                    'Subject': f"Malware Detected: {object_key}"[:SNS_SUBJECT_MAX_LENGTH],
+                    'Message': json.dumps({
+                        "alert": "Malware Detected",
+                        "bucket": source_bucket,
+                        "object": object_key,
+                        "scan_details": scan_details
+                    })
+                }
+                for source_bucket, object_key, scan_details in self.threats
+            ]
+
+        threats_by_bucket = {}
+        for source_bucket, object_key, scan_details in self.threats:
+            threats_by_bucket.setdefault(source_bucket, []).append({"object": object_key, "scan_details": scan_details})
+
+        return [
+            {
+                'Subject': f"Malware Detected: {len(objects)} objects in {source_bucket}"[:SNS_SUBJECT_MAX_LENGTH],
+                'Message': json.dumps({
+                    "alert": "Malware Detected",
+                    "bucket": source_bucket,
+                    "threat_count": len(objects),
+                    "objects": objects[:SUMMARY_MAX_OBJECTS],
+                    "objects_truncated": len(objects) > SUMMARY_MAX_OBJECTS
+                })
+            }
+            for source_bucket, objects in threats_by_bucket.items()
+        ]
+
+    def flush(self):
+        """Publish collected notifications in batches of up to 10 entries and 256 KB"""
+        with self.lock:
+            entries = self.build_entries()
+            self.threats = []
+
+        batch, batch_bytes = [], 0
+        for entry in entries:
+            entry_bytes = len(entry['Subject'].encode('utf-8')) + len(entry['Message'].encode('utf-8'))
+            if batch and (len(batch) == SNS_BATCH_MAX_ENTRIES or batch_bytes + entry_bytes > SNS_BATCH_MAX_BYTES):
+                self.publish_batch(batch)
+                batch, batch_bytes = [], 0
+            batch.append(entry)
+            batch_bytes += entry_bytes
+
+        if batch:
+            self.publish_batch(batch)
+
+    def publish_batch(self, entries):
+        request_entries = [dict(entry, Id=str(index)) for index, entry in enumerate(entries)]
+        try:
+            with metrics.stage('SnsPublish'):
+                response = get_client('sns', metrics).publish_batch(TopicArn=self.topic_arn, PublishBatchRequestEntries=request_entries)
+            for failure in response.get('Failed', []):
+                subject = request_entries[int(failure['Id'])]['Subject']
+                print(f"Failed to send SNS notification '{subject}': {failure.get('Message')}")
+            print(f"SNS notifications sent: {len(response.get('Successful', []))} of {len(request_entries)}")
+        except Exception as e:
+            print(f"Failed to send SNS notifications: {str(e)}")
+
+def create_threat_notifier():
+    """Create a notifier for this invocation, or None when no SNS topic is configured"""
     sns_topic_arn = os.environ.get('SNS_TOPIC_ARN_FOR_THREATS')
     if not sns_topic_arn:
-        return
+        return None
+    return ThreatNotifier(sns_topic_arn, os.environ.get('THREAT_NOTIFICATION_MODE', 'individual'))
 
-    message = {
-        "alert": "Malware Detected",
-        "bucket": source_bucket,
-        "object": object_key,
-        "scan_details": scan_details
-    }
-
-    try:
-        sns.publish(
-            TopicArn=sns_topic_arn,
-            Subject=f"Malware Detected: {object_key}",
-            Message=json.dumps(message, indent=2)
-        )
-        print(f"SNS notification sent for threat: {object_key}")
-    except Exception as e:
-        print(f"Failed to send SNS notification: {str(e)}")
+def send_threat_notification(notifier, source_bucket, object_key, scan_details):
+    """Queue an SNS notification for threat detection"""
+    if notifier is None:
+        return
+    notifier.add(source_bucket, object_key, scan_details)
+    print(f"SNS notification queued for threat: {object_key}")
 
 def extract_s3_details(detail):
     """Extract S3 details from GuardDuty scan event"""
@@ -40,7 +364,81 @@ def extract_s3_details(detail):
     object_key = s3_details.get('objectKey')
     return source_bucket, object_key
 
-def process_file(source_bucket, object_key, dest_path, scan_status):
+def copy_object(source_bucket, object_key, dest_bucket_name, dest_key, head=None):
+    """Copy an object server-side, using a parallel multipart copy for large objects.
+
+    Scan events do not carry the object size, so the object is read with
+    HEAD unless a size-based routing rule already did. Objects at or above
+    MULTIPART_THRESHOLD_BYTES are copied with ranged UploadPartCopy calls.
+    """
+    s3 = get_client('s3', metrics)
+    copy_source = {'Bucket': source_bucket, 'Key': object_key}
+    threshold = int(os.environ.get('MULTIPART_THRESHOLD_BYTES', str(512 * MIB)))
+
+    with metrics.stage('S3Copy'):
+        if head is None:
+            head = s3.head_object(Bucket=source_bucket, Key=object_key)
+        if head['ContentLength'] < threshold:
+            s3.copy_object(CopySource=copy_source, Bucket=dest_bucket_name, Key=dest_key)
+        else:
+            multipart_copy(copy_source, head, dest_bucket_name, dest_key)
+
+    metrics.add('BytesCopied', head['ContentLength'], 'Bytes')
+
+def multipart_copy(copy_source, head, dest_bucket_name, dest_key):
+    """Copy a large object with ranged UploadPartCopy calls run in parallel"""
+    s3 = get_client('s3', metrics)
+    object_size = head['ContentLength']
+    part_size = int(os.environ.get('MULTIPART_PART_SIZE_BYTES', str(128 * MIB)))
+    # Grow the part size when the object would otherwise need more than MAX_PARTS parts
+    part_size = min(max(part_size, MIN_PART_SIZE, -(-object_size // MAX_PARTS)), MAX_PART_SIZE)
+    max_concurrency = int(os.environ.get('MULTIPART_MAX_CONCURRENCY', '10'))
+
+    create_params = {key: head[key] for key in COPIED_HEAD_ATTRIBUTES if head.get(key)}
+    tag_set = s3.get_object_tagging(Bucket=copy_source['Bucket'], Key=copy_source['Key']).get('TagSet', [])
+    if tag_set:
+        create_params['Tagging'] = urlencode({tag['Key']: tag['Value'] for tag in tag_set})
+
+    upload_id = s3.create_multipart_upload(Bucket=dest_bucket_name, Key=dest_key, **create_params)['UploadId']
+    print(f"Started multipart copy of {copy_source['Key']} ({object_size} bytes) to {dest_bucket_name}/{dest_key}")
+
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, object_size) - 1
+        response = s3.upload_part_copy(
+            Bucket=dest_bucket_name,
+            Key=dest_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={start}-{end}",
+            # Fail the copy if the source object is replaced while parts are in flight
+            CopySourceIfMatch=head['ETag']
+        )
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    part_numbers = range(1, -(-object_size // part_size) + 1)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(part_numbers)))) as executor:
+            parts = list(executor.map(copy_part, part_numbers))
+
+        s3.complete_multipart_upload(
+            Bucket=dest_bucket_name,
+            Key=dest_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        try:
+            s3.abort_multipart_upload(Bucket=dest_bucket_name, Key=dest_key, UploadId=upload_id)
+            print(f"Aborted multipart copy of {copy_source['Key']} to {dest_bucket_name}/{dest_key}")
+        except Exception as e:
+            print(f"Failed to abort multipart copy {upload_id}: {str(e)}")
+        raise
+
+    print(f"Completed multipart copy of {copy_source['Key']} in {len(parts)} parts")
+
+def process_file(source_bucket, object_key, dest_path, scan_status, head=None):
     """Process file by moving it to destination path"""
     if not dest_path:
         print(f"No destination path configured for {scan_status}, skipping")
@@ -55,56 +453,199 @@ def process_file(source_bucket, object_key, dest_path, scan_status):
         dest_bucket_name = dest_path
         dest_key = object_key
 
-    copy_source = {'Bucket': source_bucket, 'Key': object_key}
-    s3.copy_object(CopySource=copy_source, Bucket=dest_bucket_name, Key=dest_key)
+    copy_object(source_bucket, object_key, dest_bucket_name, dest_key, head)
 
     print(f"Successfully processed {object_key} to {dest_bucket_name}/{dest_key}")
 
-    # Delete from source if enabled
-    if os.environ.get('DELETE_FROM_SOURCE') == 'true':
-        s3.delete_object(Bucket=source_bucket, Key=object_key)
-        print(f"Deleted {object_key} from {source_bucket}")
+def delete_source_objects(pending_deletes):
+    """Delete copied source objects with DeleteObjects, grouped by bucket.
 
-def handler(event, context):
-    routing_config = load_routing_config()
+    pending_deletes is a list of (owner, (bucket, key)) pairs, where the owner
+    is the SQS messageId the delete belongs to. Returns the owners whose
+    delete failed.
+    """
+    s3 = get_client('s3', metrics)
+    owners_by_bucket = {}
+    for owner, (source_bucket, object_key) in pending_deletes:
+        owners_by_bucket.setdefault(source_bucket, {}).setdefault(object_key, []).append(owner)
+
+    failed_owners = []
+    for source_bucket, owners_by_key in owners_by_bucket.items():
+        object_keys = list(owners_by_key)
+        for start in range(0, len(object_keys), DELETE_OBJECTS_MAX_KEYS):
+            chunk = object_keys[start:start + DELETE_OBJECTS_MAX_KEYS]
+            try:
+                with metrics.stage('S3Delete'):
+                    response = s3.delete_objects(
+                        Bucket=source_bucket,
+                        Delete={'Objects': [{'Key': object_key} for object_key in chunk], 'Quiet': True}
+                    )
+                errors = response.get('Errors', [])
+            except Exception as e:
+                errors = [{'Key': object_key, 'Message': str(e)} for object_key in chunk]
+
+            for error in errors:
+                print(f"Failed to delete {error['Key']} from {source_bucket}: {error.get('Message')}")
+                failed_owners.extend(owners_by_key.get(error['Key'], []))
+            print(f"Deleted {len(chunk) - len(errors)} of {len(chunk)} objects from {source_bucket}")
+
+    return failed_owners
+
+def process_scan_event(guardduty_event, routing_table, message_id=None):
+    """Process a scan event unless it was already processed, returning a RecordResult.
+
+    The threat alert of an infected object travels in the result and is only
+    queued by settle_results, so a record that fails and is redelivered does
+    not alert twice.
+    """
+    idempotency_key = build_idempotency_key(guardduty_event['detail'])
+    if not IDEMPOTENCY_STORE.begin(idempotency_key):
+        object_key = guardduty_event['detail'].get('s3ObjectDetails', {}).get('objectKey')
+        print(f"Skipping duplicate scan event for {object_key}")
+        metrics.add('DuplicateEvents', 1)
+        return RecordResult(message_id, True, None, None)
 
     try:
-        # Extract events to process
-        events_to_process = []
-        if 'Records' in event:
-            # SQS events - extract EventBridge events from SQS message bodies
-            events_to_process = [json.loads(record['body']) for record in event['Records']]
+        source_object = process_guardduty_event(guardduty_event, routing_table)
+    except Exception:
+        IDEMPOTENCY_STORE.release(idempotency_key)
+        raise
+
+    return RecordResult(message_id, True, source_object, idempotency_key, threat_alert(guardduty_event['detail']))
+
+def threat_alert(detail):
+    """The (bucket, key, scan details) to alert on for an infected object, otherwise None"""
+    scan_details = detail.get('scanResultDetails', {})
+    if scan_details.get('scanResultStatus') != 'THREATS_FOUND':
+        return None
+    source_bucket, object_key = extract_s3_details(detail)
+    return source_bucket, object_key, scan_details
+
+def settle_results(results, notifier=None):
+    """Delete copied source objects, settle idempotency claims and queue threat alerts, returning failed messageIds"""
+    failed_message_ids = [result.message_id for result in results if not result.succeeded]
+    failed_deletes = delete_source_objects([
+        (result.message_id, result.source_object)
+        for result in results if result.succeeded and result.source_object
+    ])
+    failed_message_ids.extend(failed_deletes)
+    metrics.add('RecordsPerInvocation', len(results))
+    metrics.add('FailedRecords', len(failed_message_ids))
+
+    for result in results:
+        if not result.idempotency_key:
+            continue
+        if result.message_id in failed_deletes:
+            IDEMPOTENCY_STORE.release(result.idempotency_key)
         else:
-            # Direct EventBridge event
-            events_to_process = [event]
+            IDEMPOTENCY_STORE.complete(result.idempotency_key)
+            if result.threat:
+                send_threat_notification(notifier, *result.threat)
 
-        # Process all events
-        for guardduty_event in events_to_process:
-            process_guardduty_event(guardduty_event, routing_config)
+    return failed_message_ids
 
+def process_sqs_record(record, routing_table):
+    """Process a single SQS record, returning a RecordResult"""
+    message_id = record.get('messageId')
+    try:
+        # SQS events - extract EventBridge event from the SQS message body
+        guardduty_event = json.loads(record['body'])
+        return process_scan_event(guardduty_event, routing_table, message_id)
     except Exception as e:
-        print(f"Error processing event: {str(e)}")
-        raise e
+        print(f"Error processing SQS message {message_id}: {str(e)}")
+        return RecordResult(message_id, False, None, None)
+
+def process_sqs_records(records, routing_table, notifier):
+    """Process SQS records on a bounded worker pool and return failed messageIds.
+
+    Source objects are only deleted once their copy has succeeded, in bulk
+    after the whole batch has been routed.
+    """
+    max_workers = max(1, min(int(os.environ.get('MAX_WORKERS', '1')), len(records)))
+
+    if max_workers == 1:
+        results = [process_sqs_record(record, routing_table) for record in records]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda record: process_sqs_record(record, routing_table), records))
+
+    return settle_results(results, notifier)
+
+def handler(event, context):
+    try:
+        if 'replay' in event:
+            # Operator-invoked bulk replay, imported here because replay builds on this module
+            from replay import handle_replay
+            return handle_replay(event['replay'], context)
+        return handle_event(event)
+    finally:
+        metrics.flush()
+
+def handle_event(event):
+    routing_table = ROUTING_TABLE
+    notifier = create_threat_notifier()
+
+    if 'Records' not in event:
+        # Direct EventBridge event
+        try:
+            if settle_results([process_scan_event(event, routing_table)], notifier):
+                raise RuntimeError("Failed to delete the processed file from the ingest bucket")
+        except Exception as e:
+            print(f"Error processing event: {str(e)}")
+            raise e
+        finally:
+            if notifier:
+                notifier.flush()
+
+        return {'statusCode': 200}
+
+    failed_message_ids = process_sqs_records(event['Records'], routing_table, notifier)
+    if notifier:
+        notifier.flush()
+
+    if os.environ.get('REPORT_BATCH_ITEM_FAILURES') == 'true':
+        # Only the failed messages become visible again on the queue
+        print(f"Processed {len(event['Records'])} SQS records, {len(failed_message_ids)} failed")
+        return {
+            'statusCode': 200,
+            'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+        }
+
+    if failed_message_ids:
+        raise RuntimeError(f"Failed to process {len(failed_message_ids)} of {len(event['Records'])} SQS records")
 
     return {'statusCode': 200}
 
-def process_guardduty_event(event, routing_config):
-    """Process a single GuardDuty event"""
+def process_guardduty_event(event, routing_table):
+    """Process a single GuardDuty event.
+
+    Returns the (bucket, key) of the source object when it was copied and
+    should be deleted from the ingest bucket, otherwise None.
+    """
     detail = event['detail']
 
     # Handle GuardDuty Malware Protection Object Scan Result events
     scan_status = detail.get('scanResultDetails', {}).get('scanResultStatus')
     source_bucket, object_key = extract_s3_details(detail)
 
-    # Send SNS notification for threats
-    if scan_status == 'THREATS_FOUND':
-        scan_details = detail.get('scanResultDetails', {})
-        send_threat_notification(source_bucket, object_key, scan_details)
+    # Size-based rules need the object size, which the scan event does not carry
+    head = None
+    if routing_table.needs_object_size(scan_status):
+        head = get_client('s3', metrics).head_object(Bucket=source_bucket, Key=object_key)
 
-    #looping through all scan_status
-    if scan_status in routing_config:
-        dest_path = routing_config[scan_status]
-        process_file(source_bucket, object_key, dest_path, scan_status)
+    dest_path = routing_table.resolve(scan_status, object_key, head['ContentLength'] if head else None)
+    if dest_path:
+        process_file(source_bucket, object_key, dest_path, scan_status, head)
         print(f"Successfully processed {scan_status} file: {object_key} has been copied from {source_bucket} to {dest_path}")
+
+        # Delete from source if enabled, deferred to the caller so deletes can be batched
+        if os.environ.get('DELETE_FROM_SOURCE') == 'true':
+            return source_bucket, object_key
     else:
         print(f"No routing configured for scan status: {scan_status}. The files will stay in the {source_bucket} bucket")
+
+    return None
+
+# Compiled once per container at cold start
+ROUTING_TABLE = RoutingTable(load_routing_config(), load_routing_rules())
+IDEMPOTENCY_STORE = create_idempotency_store()
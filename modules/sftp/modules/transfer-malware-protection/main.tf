@@ -13,6 +13,12 @@
 data "aws_region" "current" {}
 data "aws_caller_identity" "current" {}
 
+locals {
+  # Scan statuses and destinations from both the per-status routing_config and the routing_rules
+  routed_scan_statuses = distinct(concat(keys(var.routing_config), [for rule in var.routing_rules : rule.scan_status]))
+  routing_destinations = distinct(compact(concat(values(var.routing_config), [for rule in var.routing_rules : rule.destination])))
+}
+
 #####################################################################################
 # GuardDuty Malware Protection Plan
 #####################################################################################
@@ -138,7 +144,7 @@ resource "aws_cloudwatch_event_rule" "guardduty_scan_results" {
         bucketName = [var.s3_ingest_bucket.bucket_name]
       }
       scanResultDetails = {
-        scanResultStatus = keys(var.routing_config)
+        scanResultStatus = local.routed_scan_statuses
       }
     }
   })
@@ -156,7 +162,7 @@ resource "aws_sqs_queue" "guardduty_events" {
 
   name                       = "${var.name_prefix}-guardduty-events"
   kms_master_key_id          = var.create_kms_key_for_lambda_sqs ? aws_kms_key.lambda_env[0].arn : null
-  visibility_timeout_seconds = 61
+  visibility_timeout_seconds = var.lambda_timeout + 1
 
   redrive_policy = var.create_sqs_dlq ? jsonencode({
     deadLetterTargetArn = aws_sqs_queue.dlq[0].arn
@@ -204,8 +210,11 @@ resource "aws_cloudwatch_event_target" "sqs_target" {
 resource "aws_lambda_event_source_mapping" "sqs_trigger" {
   count = var.enable_sqs_buffer ? 1 : 0
 
-  event_source_arn = aws_sqs_queue.guardduty_events[count.index].arn
-  function_name    = aws_lambda_function.file_transfer_function.arn
+  event_source_arn                   = aws_sqs_queue.guardduty_events[count.index].arn
+  function_name                      = aws_lambda_function.file_transfer_function.arn
+  batch_size                         = var.sqs_batch_size
+  maximum_batching_window_in_seconds = var.sqs_maximum_batching_window_in_seconds
+  function_response_types            = var.sqs_report_batch_item_failures ? ["ReportBatchItemFailures"] : []
 
   depends_on = [
     aws_iam_role_policy.lambda_policy
@@ -243,8 +252,30 @@ resource "aws_lambda_permission" "allow_eventbridge" {
 
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda_function.py"
-  output_path = "${path.module}/lambda_function.zip"
+  output_path = "${path.module}/lambda_function_${var.name_prefix}.zip"
+
+  source {
+    content  = file("${path.module}/lambda_function.py")
+    filename = "lambda_function.py"
+  }
+
+  # Shared instrumentation used by all SFTP Lambda handlers
+  source {
+    content  = file("${path.module}/../../lambda/sftp_runtime.py")
+    filename = "sftp_runtime.py"
+  }
+
+  # Bulk replay of the dead letter queue or an ingest bucket prefix, invoked with a "replay" event
+  source {
+    content  = file("${path.module}/replay.py")
+    filename = "replay.py"
+  }
+
+  # Routing rules are packaged with the code so they are compiled once per container
+  source {
+    content  = jsonencode(var.routing_rules)
+    filename = "routing_rules.json"
+  }
 }
 
 #####################################################################################
@@ -258,14 +289,29 @@ resource "aws_lambda_function" "file_transfer_function" {
   handler                        = "lambda_function.handler"
   runtime                        = "python3.12"
   source_code_hash               = data.archive_file.lambda_zip.output_base64sha256
-  timeout                        = 60
+  timeout                        = var.lambda_timeout
   reserved_concurrent_executions = -1
 
   environment {
     variables = {
-      ROUTING_CONFIG            = jsonencode(var.routing_config)
-      DELETE_FROM_SOURCE        = tostring(var.delete_processed_file_from_ingest_bucket)
-      SNS_TOPIC_ARN_FOR_THREATS = var.sns_topic_arn_for_threats
+      ROUTING_CONFIG                  = jsonencode(var.routing_config)
+      DELETE_FROM_SOURCE              = tostring(var.delete_processed_file_from_ingest_bucket)
+      SNS_TOPIC_ARN_FOR_THREATS       = var.sns_topic_arn_for_threats
+      THREAT_NOTIFICATION_MODE        = var.threat_notification_mode
+      MAX_WORKERS                     = tostring(var.lambda_max_workers)
+      REPORT_BATCH_ITEM_FAILURES      = tostring(var.enable_sqs_buffer && var.sqs_report_batch_item_failures)
+      MULTIPART_THRESHOLD_BYTES       = tostring(var.multipart_copy_threshold_mb * 1024 * 1024)
+      MULTIPART_PART_SIZE_BYTES       = tostring(var.multipart_copy_part_size_mb * 1024 * 1024)
+      MULTIPART_MAX_CONCURRENCY       = tostring(var.multipart_copy_max_concurrency)
+      IDEMPOTENCY_CACHE_SIZE          = tostring(var.idempotency_cache_size)
+      IDEMPOTENCY_TABLE               = var.enable_idempotency_table ? aws_dynamodb_table.idempotency[0].name : ""
+      IDEMPOTENCY_TTL_SECONDS         = tostring(var.idempotency_ttl_seconds)
+      IDEMPOTENCY_IN_PROGRESS_SECONDS = tostring(var.lambda_timeout)
+      METRICS_ENABLED                 = tostring(var.enable_metrics)
+      METRICS_NAMESPACE               = var.metrics_namespace
+      CLIENT_MAX_POOL_CONNECTIONS     = tostring(max(10, var.lambda_max_workers * var.multipart_copy_max_concurrency))
+      DLQ_URL                         = var.create_sqs_dlq ? aws_sqs_queue.dlq[0].url : ""
+      INGEST_BUCKET                   = var.s3_ingest_bucket.bucket_name
     }
   }
 
@@ -341,14 +387,14 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "s3:DeleteObject",
           "s3:PutObject",
           "s3:PutObjectTagging",
-          "s3:PutObjectAcl"
+          "s3:PutObjectAcl",
+          "s3:AbortMultipartUpload"
         ]
         Resource = concat([
           "arn:aws:s3:::${var.s3_ingest_bucket.bucket_name}/*"
           ], distinct([
-            for dest_path in values(var.routing_config) :
+            for dest_path in local.routing_destinations :
             "arn:aws:s3:::${split("/", dest_path)[0]}/*"
-            if dest_path != null
         ]))
       },
       {
@@ -360,9 +406,8 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Resource = concat([
           "arn:aws:s3:::${var.s3_ingest_bucket.bucket_name}"
           ], distinct([
-            for dest_path in values(var.routing_config) :
+            for dest_path in local.routing_destinations :
             "arn:aws:s3:::${split("/", dest_path)[0]}"
-            if dest_path != null
         ]))
       },
       ], var.ingest_bucket_kms_key_arn != null ? [{
@@ -392,10 +437,29 @@ resource "aws_iam_role_policy" "lambda_policy" {
         }] : [], var.create_sqs_dlq ? [{
         Effect = "Allow"
         Action = [
-          "sqs:SendMessage"
+          "sqs:SendMessage",
+          # Replay mode drains the queue
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
         ]
         Resource = aws_sqs_queue.dlq[0].arn
-        }] : [], var.enable_sqs_buffer && var.create_kms_key_for_lambda_sqs ? [{
+        }] : [], (var.enable_sqs_buffer || var.create_sqs_dlq) && var.create_kms_key_for_lambda_sqs ? [{
+        Effect = "Allow"
+        Action = [
+          "kms:Decrypt",
+          "kms:GenerateDataKey"
+        ]
+        Resource = aws_kms_key.lambda_env[0].arn
+        }] : [], var.enable_idempotency_table ? [{
+        Effect = "Allow"
+        Action = [
+          "dynamodb:PutItem",
+          "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem"
+        ]
+        Resource = aws_dynamodb_table.idempotency[0].arn
+        }] : [], var.enable_idempotency_table && var.create_kms_key_for_lambda_sqs ? [{
         Effect = "Allow"
         Action = [
           "kms:Decrypt",
@@ -471,3 +535,37 @@ resource "aws_sqs_queue" "dlq" {
 
   tags = var.tags
 }
+
+#####################################################################################
+# DynamoDB Idempotency Table (optional)
+#####################################################################################
+
+# Records processed scan events so duplicates delivered to other Lambda containers are skipped
+resource "aws_dynamodb_table" "idempotency" {
+  count = var.enable_idempotency_table ? 1 : 0
+
+  name         = "${var.name_prefix}-idempotency"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "idempotency_key"
+
+  attribute {
+    name = "idempotency_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  server_side_encryption {
+    enabled     = true
+    kms_key_arn = var.create_kms_key_for_lambda_sqs ? aws_kms_key.lambda_env[0].arn : null
+  }
+
+  point_in_time_recovery {
+    enabled = true
+  }
+
+  tags = var.tags
+}
@@ -20,3 +20,13 @@ output "sqs_queue_arn" {
   description = "ARN of the SQS queue for GuardDuty events"
   value       = var.enable_sqs_buffer ? aws_sqs_queue.guardduty_events[0].arn : null
 }
+
+output "idempotency_table_name" {
+  description = "Name of the DynamoDB table recording processed scan events"
+  value       = var.enable_idempotency_table ? aws_dynamodb_table.idempotency[0].name : null
+}
+
+output "dlq_url" {
+  description = "URL of the Lambda dead letter queue, drained by the replay mode"
+  value       = var.create_sqs_dlq ? aws_sqs_queue.dlq[0].url : null
+}
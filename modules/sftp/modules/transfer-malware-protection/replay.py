@@ -0,0 +1,392 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Bulk replay for the malware-protection pipeline.
+
+Drains the dead letter queue with parallel workers, or re-routes objects that
+are still in the ingest bucket by listing a prefix and reading the scan status
+GuardDuty tagged them with. Both go through process_scan_event, the same path
+as the Lambda handler, and repeated objects are only routed once per replay.
+Progress is checkpointed so a large replay can be stopped and restarted.
+
+Runs in the deployed function when it is invoked with a "replay" event, or
+locally:
+
+    python replay.py dlq --queue-url <dlq-url> [--workers 8] [--checkpoint replay.json]
+    python replay.py prefix --bucket <ingest-bucket> --prefix uploads/ [--checkpoint replay.json]
+
+Set AWS_ENDPOINT_URL, for example to http://localhost:4566 for LocalStack or
+to a moto server, to replay against a local stand-in.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import sftp_runtime  # noqa: F401 - in the Lambda package, or on PYTHONPATH, it sits next to this file
+except ImportError:
+    # Run from a checkout without PYTHONPATH, the shared runtime lives in modules/sftp/lambda
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda'))
+
+import lambda_function as pipeline
+from lambda_function import RecordResult, build_idempotency_key, process_scan_event, settle_results
+from sftp_runtime import get_client, utc_timestamp
+
+# Tag GuardDuty Malware Protection for S3 writes on scanned objects
+SCAN_STATUS_TAG = 'GuardDutyMalwareScanStatus'
+
+# SQS ReceiveMessage and DeleteMessageBatch limit
+SQS_BATCH_MAX_MESSAGES = 10
+
+# Consecutive empty receives after which a worker considers the queue drained
+EMPTY_RECEIVES_TO_STOP = 2
+
+metrics = pipeline.metrics
+
+class ReplayCheckpoint:
+    """Replay progress, saved as JSON after every settled batch.
+
+    The dead letter queue needs no position, processed messages are deleted,
+    so its checkpoint only carries the counters. A prefix replay also records
+    the last listed key, and a restarted replay lists from there.
+    """
+
+    def __init__(self, path=None, state=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {'replayed': 0, 'failed': 0, 'duplicates': 0, 'skipped': 0, 'failed_keys': [], 'complete': False}
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.state.update(json.load(checkpoint_file))
+        if state:
+            self.state.update(state)
+
+    def record(self, replayed=0, failed=0, duplicates=0, skipped=0, failed_keys=(), start_after=None):
+        with self.lock:
+            self.state['replayed'] += replayed
+            self.state['failed'] += failed
+            self.state['duplicates'] += duplicates
+            self.state['skipped'] += skipped
+            self.state['failed_keys'].extend(failed_keys)
+            if start_after is not None:
+                self.state['start_after'] = start_after
+            self.state['updated_at'] = utc_timestamp()
+            self.save()
+
+    def finish(self, complete):
+        with self.lock:
+            self.state['complete'] = complete
+            self.state['updated_at'] = utc_timestamp()
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # Written next to the checkpoint and renamed, so an interrupted write never loses progress
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+class SeenObjects:
+    """Scan events already routed or in flight in this replay"""
+
+    def __init__(self):
+        self.keys = set()
+        self.lock = threading.Lock()
+
+    def claim(self, key):
+        """Returns False when the event was already claimed"""
+        with self.lock:
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+            return True
+
+    def release(self, key):
+        """Forget a failed event so a later copy of it is processed"""
+        with self.lock:
+            self.keys.discard(key)
+
+def replay_event(guardduty_event, owner, routing_table, seen):
+    """Route one scan event unless this replay already saw it.
+
+    Returns a RecordResult owned by owner, or None for a duplicate.
+    """
+    key = build_idempotency_key(guardduty_event['detail'])
+    if not seen.claim(key):
+        return None
+    try:
+        return process_scan_event(guardduty_event, routing_table, owner)
+    except Exception as e:
+        print(f"Error replaying scan event {owner}: {str(e)}")
+        seen.release(key)
+        return RecordResult(owner, False, None, None)
+
+def settle_replayed(results, seen, guardduty_events, notifier):
+    """Delete source objects, settle idempotency and queue threat alerts for replayed events, returning the failed owners"""
+    failed_owners = set(settle_results(results, notifier))
+    for result in results:
+        if result.message_id in failed_owners and result.message_id in guardduty_events:
+            seen.release(build_idempotency_key(guardduty_events[result.message_id]['detail']))
+    return failed_owners
+
+def drain_queue(queue_url, routing_table, notifier, checkpoint, workers=4, max_messages=None, deadline=None, visibility_timeout=900):
+    """Replay every message of a dead letter queue on parallel workers.
+
+    Each worker receives up to 10 messages at a time and deletes those that
+    were routed or were duplicates of an event already routed in this replay.
+    Failed messages stay in the queue and become visible again after
+    visibility_timeout. Workers stop once the queue is empty, max_messages
+    were received or the deadline (a time.monotonic() value) has passed.
+    """
+    sqs = get_client('sqs', metrics)
+    seen = SeenObjects()
+    received = {'count': 0}
+    received_lock = threading.Lock()
+
+    def reserve(count):
+        """Reserve up to count messages of the max_messages budget"""
+        with received_lock:
+            if max_messages is not None:
+                count = max(0, min(count, max_messages - received['count']))
+            received['count'] += count
+            return count
+
+    def give_back(count):
+        with received_lock:
+            received['count'] -= count
+
+    def worker():
+        empty_receives = 0
+        while empty_receives < EMPTY_RECEIVES_TO_STOP and (deadline is None or time.monotonic() < deadline):
+            batch_size = reserve(SQS_BATCH_MAX_MESSAGES)
+            if batch_size <= 0:
+                return
+            with metrics.stage('DlqReceive'):
+                messages = sqs.receive_message(
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=batch_size,
+                    WaitTimeSeconds=1,
+                    VisibilityTimeout=visibility_timeout
+                ).get('Messages', [])
+            give_back(batch_size - len(messages))
+            if not messages:
+                empty_receives += 1
+                continue
+            empty_receives = 0
+            replay_messages(messages)
+
+    def replay_messages(messages):
+        messages_by_id = {message['MessageId']: message for message in messages}
+        guardduty_events, results, duplicates, unreadable = {}, [], [], 0
+        for message in messages:
+            try:
+                guardduty_event = parse_scan_event(message['Body'])
+            except ValueError as e:
+                print(f"Unreadable dead letter message {message['MessageId']}: {str(e)}")
+                unreadable += 1
+                continue
+            guardduty_events[message['MessageId']] = guardduty_event
+            result = replay_event(guardduty_event, message['MessageId'], routing_table, seen)
+            if result is None:
+                duplicates.append(message)
+            else:
+                results.append(result)
+
+        failed_owners = settle_replayed(results, seen, guardduty_events, notifier)
+        routed = [messages_by_id[result.message_id] for result in results if result.message_id not in failed_owners]
+        delete_messages(sqs, queue_url, routed + duplicates)
+        # Alerts go out before progress is saved, a replay stopped after the checkpoint never loses them
+        if notifier:
+            notifier.flush()
+        checkpoint.record(replayed=len(routed), failed=unreadable + len(failed_owners), duplicates=len(duplicates))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in [executor.submit(worker) for _ in range(max(1, workers))]:
+            future.result()
+
+    complete = deadline is None or time.monotonic() < deadline
+    if max_messages is not None and received['count'] >= max_messages:
+        complete = False
+    checkpoint.finish(complete)
+    return checkpoint.state
+
+def parse_scan_event(body):
+    """Parse a dead letter message body into the GuardDuty scan event it carries"""
+    guardduty_event = json.loads(body)
+    if not isinstance(guardduty_event, dict) or not isinstance(guardduty_event.get('detail'), dict):
+        raise ValueError("message is not a GuardDuty scan result event")
+    return guardduty_event
+
+def delete_messages(sqs, queue_url, messages):
+    """Delete replayed messages with DeleteMessageBatch"""
+    for start in range(0, len(messages), SQS_BATCH_MAX_MESSAGES):
+        chunk = messages[start:start + SQS_BATCH_MAX_MESSAGES]
+        response = sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']} for index, message in enumerate(chunk)]
+        )
+        for failure in response.get('Failed', []):
+            # The message becomes visible again and is replayed once more, which the idempotency store absorbs
+            print(f"Failed to delete replayed message {chunk[int(failure['Id'])]['MessageId']}: {failure.get('Message')}")
+
+def replay_prefix(bucket, prefix, routing_table, notifier, checkpoint, workers=4, scan_status=None, deadline=None):
+    """Re-route the objects under a prefix of the ingest bucket.
+
+    Each object is routed with the scan status from its GuardDuty tag, or
+    scan_status for untagged objects, which are skipped when it is None.
+    Objects are listed from the checkpoint's start_after and routed one
+    ListObjectsV2 page at a time, and the checkpoint advances once a page is
+    settled. Failed keys are recorded in the checkpoint for a follow-up run.
+    """
+    s3 = get_client('s3', metrics)
+    seen = SeenObjects()
+    paginator = s3.get_paginator('list_objects_v2')
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if checkpoint.state.get('start_after'):
+        params['StartAfter'] = checkpoint.state['start_after']
+
+    def replay_object(listed_object):
+        """Returns the (scan event, RecordResult) of an object"""
+        object_key = listed_object['Key']
+        try:
+            with metrics.stage('S3Tagging'):
+                tag_set = s3.get_object_tagging(Bucket=bucket, Key=object_key).get('TagSet', [])
+        except Exception as e:
+            print(f"Error reading the scan status of {object_key}: {str(e)}")
+            return None, RecordResult(object_key, False, None, None)
+
+        status = next((tag['Value'] for tag in tag_set if tag['Key'] == SCAN_STATUS_TAG), scan_status)
+        if not status:
+            return None, None
+
+        guardduty_event = {
+            'detail': {
+                's3ObjectDetails': {
+                    'bucketName': bucket,
+                    'objectKey': object_key,
+                    'eTag': listed_object.get('ETag', '').strip('"')
+                },
+                'scanResultDetails': {'scanResultStatus': status}
+            }
+        }
+        return guardduty_event, replay_event(guardduty_event, object_key, routing_table, seen)
+
+    complete = True
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for page in paginator.paginate(**params):
+            listed_objects = page.get('Contents', [])
+            if not listed_objects:
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                complete = False
+                break
+
+            replayed = list(executor.map(replay_object, listed_objects))
+            # (None, None) is an untagged object that was skipped, (event, None) a duplicate
+            results = [result for _, result in replayed if result is not None]
+            guardduty_events = {event['detail']['s3ObjectDetails']['objectKey']: event for event, _ in replayed if event}
+            failed_keys = sorted(settle_replayed(results, seen, guardduty_events, notifier))
+            if notifier:
+                notifier.flush()
+            checkpoint.record(
+                replayed=len(results) - len(failed_keys),
+                failed=len(failed_keys),
+                duplicates=sum(1 for event, result in replayed if event and result is None),
+                skipped=sum(1 for event, result in replayed if not event and result is None),
+                failed_keys=failed_keys,
+                start_after=listed_objects[-1]['Key']
+            )
+
+    checkpoint.finish(complete)
+    return checkpoint.state
+
+def handle_replay(request, context=None):
+    """Replay mode of the deployed function.
+
+    request is {"source": "dlq"} to drain the function's dead letter queue, or
+    {"source": "prefix", "prefix": "...", "start_after": "..."} to re-route
+    objects in the ingest bucket. The returned checkpoint carries the counters
+    and, for a prefix, the start_after to pass to the next invocation when
+    complete is false.
+    """
+    workers = int(request.get('workers', os.environ.get('MAX_WORKERS', '4')))
+    # Stop starting new work 10 seconds before the invocation times out
+    remaining_ms = context.get_remaining_time_in_millis() if context else 60000
+    deadline = time.monotonic() + (remaining_ms - 10000) / 1000
+    notifier = pipeline.create_threat_notifier()
+    checkpoint = ReplayCheckpoint(state={'start_after': request['start_after']} if request.get('start_after') else None)
+
+    try:
+        if request.get('source', 'dlq') == 'dlq':
+            if not os.environ.get('DLQ_URL'):
+                raise ValueError("The function has no dead letter queue, set create_sqs_dlq = true")
+            return drain_queue(
+                os.environ['DLQ_URL'], pipeline.ROUTING_TABLE, notifier, checkpoint,
+                workers=workers, max_messages=request.get('max_messages'), deadline=deadline
+            )
+
+        return replay_prefix(
+            request.get('bucket', os.environ.get('INGEST_BUCKET')), request.get('prefix', ''),
+            pipeline.ROUTING_TABLE, notifier, checkpoint,
+            workers=workers, scan_status=request.get('scan_status'), deadline=deadline
+        )
+    finally:
+        if notifier:
+            notifier.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help='Parallel workers (default: 8)')
+    parser.add_argument('--checkpoint', help='JSON file progress is saved to and resumed from')
+    parser.add_argument('--routing-rules', help='routing_rules JSON file (default: routing_rules.json next to this file)')
+    parser.add_argument('--region', help='AWS region')
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    dlq = modes.add_parser('dlq', help='Drain a dead letter queue')
+    dlq.add_argument('--queue-url', required=True)
+    dlq.add_argument('--max-messages', type=int)
+    dlq.add_argument('--visibility-timeout', type=int, default=900, help='Seconds before a failed message can be replayed again')
+
+    prefix = modes.add_parser('prefix', help='Re-route objects under a prefix of the ingest bucket')
+    prefix.add_argument('--bucket', required=True)
+    prefix.add_argument('--prefix', default='')
+    # Untagged objects were never scanned, so they are never treated as clean
+    prefix.add_argument('--scan-status', choices=sorted(pipeline.SCAN_STATUSES - {'NO_THREATS_FOUND'}), help='Scan status for objects without a GuardDuty tag (default: skip them)')
+
+    args = parser.parse_args(argv)
+    if args.region:
+        os.environ['AWS_DEFAULT_REGION'] = args.region
+
+    routing_table = pipeline.ROUTING_TABLE
+    if args.routing_rules:
+        with open(args.routing_rules) as rules_file:
+            routing_table = pipeline.RoutingTable(pipeline.load_routing_config(), json.load(rules_file))
+
+    checkpoint = ReplayCheckpoint(args.checkpoint)
+    notifier = pipeline.create_threat_notifier()
+    try:
+        if args.mode == 'dlq':
+            state = drain_queue(
+                args.queue_url, routing_table, notifier, checkpoint,
+                workers=args.workers, max_messages=args.max_messages, visibility_timeout=args.visibility_timeout
+            )
+        else:
+            state = replay_prefix(
+                args.bucket, args.prefix, routing_table, notifier, checkpoint,
+                workers=args.workers, scan_status=args.scan_status
+            )
+    finally:
+        if notifier:
+            notifier.flush()
+        metrics.flush()
+
+    json.dump(state, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the clean file copy in the malware protection handler (lambda_function.py)"""
+
+import boto3
+import pytest
+
+HANDLER = 'modules/transfer-malware-protection/lambda_function.py'
+SOURCE = 'scan-bucket'
+CLEAN = 'clean-bucket'
+
+class RecordingS3:
+    """moto S3 client that records HEAD and multipart copy requests"""
+
+    def __init__(self):
+        self.client = boto3.client('s3')
+        self.heads = []
+        self.multipart_uploads = []
+
+    def head_object(self, **kwargs):
+        self.heads.append(kwargs['Key'])
+        return self.client.head_object(**kwargs)
+
+    def create_multipart_upload(self, **kwargs):
+        self.multipart_uploads.append(kwargs['Key'])
+        return self.client.create_multipart_upload(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+@pytest.fixture
+def handler(aws, load_module):
+    s3 = boto3.client('s3')
+    for bucket in (SOURCE, CLEAN):
+        s3.create_bucket(Bucket=bucket)
+    return load_module(HANDLER, MULTIPART_THRESHOLD_BYTES=str(5 * 1024 * 1024))
+
+@pytest.fixture
+def s3(aws):
+    client = RecordingS3()
+    aws._clients[('client', 's3')] = client
+    return client
+
+def test_small_object_is_copied_with_copy_object(handler, s3):
+    s3.put_object(Bucket=SOURCE, Key='in/report.csv', Body=b'data')
+
+    handler.copy_object(SOURCE, 'in/report.csv', CLEAN, 'out/report.csv')
+
+    assert s3.heads == ['in/report.csv']
+    assert s3.multipart_uploads == []
+    assert s3.get_object(Bucket=CLEAN, Key='out/report.csv')['Body'].read() == b'data'
+
+def test_object_over_the_threshold_uses_multipart_copy(handler, s3):
+    body = b'x' * (6 * 1024 * 1024)
+    s3.put_object(Bucket=SOURCE, Key='in/large.bin', Body=body, ContentType='application/octet-stream')
+
+    handler.copy_object(SOURCE, 'in/large.bin', CLEAN, 'out/large.bin')
+
+    assert s3.multipart_uploads == ['out/large.bin']
+    copied = s3.get_object(Bucket=CLEAN, Key='out/large.bin')
+    assert copied['Body'].read() == body
+    assert copied['ContentType'] == 'application/octet-stream'
+
+def test_size_read_for_routing_is_not_read_again(handler, s3):
+    s3.put_object(Bucket=SOURCE, Key='in/large.bin', Body=b'x' * (6 * 1024 * 1024))
+    head = s3.client.head_object(Bucket=SOURCE, Key='in/large.bin')
+
+    handler.copy_object(SOURCE, 'in/large.bin', CLEAN, 'out/large.bin', head=head)
+
+    assert s3.heads == []
+    assert s3.multipart_uploads == ['out/large.bin']
@@ -0,0 +1,126 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for SQS batch processing in the malware protection handler (lambda_function.py)"""
+
+import json
+
+import boto3
+import pytest
+
+HANDLER = 'modules/transfer-malware-protection/lambda_function.py'
+INGEST = 'ingest-bucket'
+CLEAN = 'clean-bucket'
+
+def sqs_record(message_id, object_key):
+    body = {
+        'detail': {
+            's3ObjectDetails': {'bucketName': INGEST, 'objectKey': object_key, 'eTag': 'etag'},
+            'scanResultDetails': {'scanResultStatus': 'NO_THREATS_FOUND'}
+        }
+    }
+    return {'messageId': message_id, 'body': json.dumps(body)}
+
+@pytest.fixture
+def sqs_event(aws):
+    s3 = boto3.client('s3')
+    for bucket in (INGEST, CLEAN):
+        s3.create_bucket(Bucket=bucket)
+    records = []
+    for n in range(6):
+        s3.put_object(Bucket=INGEST, Key=f'uploads/{n}.csv', Body=b'data')
+        records.append(sqs_record(f'm-{n}', f'uploads/{n}.csv'))
+    records.append({'messageId': 'm-unreadable', 'body': 'not json'})
+    records.append(sqs_record('m-missing', 'uploads/missing.csv'))
+    return {'Records': records}
+
+def load_handler(load_module, **env):
+    return load_module(
+        HANDLER,
+        ROUTING_CONFIG=json.dumps({'NO_THREATS_FOUND': CLEAN}),
+        DELETE_FROM_SOURCE='true',
+        MAX_WORKERS='4',
+        **env
+    )
+
+def test_only_failed_records_are_reported(sqs_event, load_module):
+    handler = load_handler(load_module, REPORT_BATCH_ITEM_FAILURES='true')
+
+    response = handler.handler(sqs_event, None)
+
+    assert sorted(failure['itemIdentifier'] for failure in response['batchItemFailures']) == ['m-missing', 'm-unreadable']
+    s3 = boto3.client('s3')
+    assert sorted(item['Key'] for item in s3.list_objects_v2(Bucket=CLEAN)['Contents']) == [f'uploads/{n}.csv' for n in range(6)]
+    # Every routed source object was deleted with the batch
+    assert s3.list_objects_v2(Bucket=INGEST)['KeyCount'] == 0
+
+def test_failed_records_fail_the_batch_without_partial_reporting(sqs_event, load_module):
+    handler = load_handler(load_module, REPORT_BATCH_ITEM_FAILURES='false')
+
+    with pytest.raises(RuntimeError, match='Failed to process 2 of 8 SQS records'):
+        handler.handler(sqs_event, None)
+
+class RecordingS3:
+    """S3 client recording DeleteObjects requests and failing the keys in failing_keys"""
+
+    def __init__(self, client, failing_keys=()):
+        self.client = client
+        self.failing_keys = set(failing_keys)
+        self.deletes = []
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [item['Key'] for item in Delete['Objects']]
+        self.deletes.append((Bucket, len(keys)))
+        response = self.client.delete_objects(Bucket=Bucket, Delete={
+            'Objects': [{'Key': key} for key in keys if key not in self.failing_keys],
+            'Quiet': True
+        })
+        response['Errors'] = [{'Key': key, 'Code': 'AccessDenied', 'Message': 'Access Denied'} for key in keys if key in self.failing_keys]
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+def test_delete_errors_fail_every_record_of_the_object(sqs_event, load_module, aws):
+    handler = load_handler(load_module)
+    s3 = RecordingS3(boto3.client('s3'), failing_keys=['uploads/1.csv'])
+    aws._clients[('client', 's3')] = s3
+
+    failed_owners = handler.delete_source_objects([
+        ('m-0', (INGEST, 'uploads/0.csv')),
+        ('m-1', (INGEST, 'uploads/1.csv')),
+        # A second record for the same object shares its delete, and its failure
+        ('m-1-again', (INGEST, 'uploads/1.csv')),
+        ('m-2', (INGEST, 'uploads/2.csv'))
+    ])
+
+    assert sorted(failed_owners) == ['m-1', 'm-1-again']
+    assert s3.deletes == [(INGEST, 3)]
+    remaining = [item['Key'] for item in boto3.client('s3').list_objects_v2(Bucket=INGEST)['Contents']]
+    assert 'uploads/1.csv' in remaining and 'uploads/0.csv' not in remaining
+
+def test_deletes_are_sent_1000_keys_at_a_time_per_bucket(sqs_event, load_module, aws):
+    handler = load_handler(load_module)
+    s3 = RecordingS3(boto3.client('s3'))
+    aws._clients[('client', 's3')] = s3
+    pending = [(f'm-{n}', (INGEST, f'bulk/{n:05d}.csv')) for n in range(2500)]
+    pending += [(f'c-{n}', (CLEAN, f'bulk/{n:05d}.csv')) for n in range(10)]
+
+    assert handler.delete_source_objects(pending) == []
+    assert s3.deletes == [(INGEST, 1000), (INGEST, 1000), (INGEST, 500), (CLEAN, 10)]
+
+def test_a_failed_delete_request_fails_only_its_chunk(sqs_event, load_module, aws):
+    handler = load_handler(load_module)
+    s3 = RecordingS3(boto3.client('s3'))
+    calls = []
+    def delete_objects(Bucket, Delete):
+        calls.append(len(Delete['Objects']))
+        if len(calls) == 2:
+            raise RuntimeError('connection reset')
+        return {'Deleted': []}
+    s3.delete_objects = delete_objects
+    aws._clients[('client', 's3')] = s3
+    pending = [(f'm-{n}', (INGEST, f'bulk/{n:05d}.csv')) for n in range(1500)]
+
+    failed_owners = handler.delete_source_objects(pending)
+
+    assert calls == [1000, 500]
+    assert failed_owners == [f'm-{n}' for n in range(1000, 1500)]
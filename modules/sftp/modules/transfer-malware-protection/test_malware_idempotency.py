@@ -0,0 +1,72 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the scan event idempotency store (lambda_function.py)"""
+
+import boto3
+import pytest
+
+HANDLER = 'modules/transfer-malware-protection/lambda_function.py'
+TABLE = 'scan-idempotency'
+
+@pytest.fixture
+def pipeline(aws, load_module):
+    return load_module(HANDLER, ROUTING_CONFIG='{}')
+
+@pytest.fixture
+def table(aws):
+    boto3.client('dynamodb').create_table(
+        TableName=TABLE,
+        KeySchema=[{'AttributeName': 'idempotency_key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'idempotency_key', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return TABLE
+
+def test_completed_keys_are_kept_least_recently_used_first(pipeline):
+    store = pipeline.IdempotencyStore(cache_size=2)
+    for key in ('a', 'b', 'c'):
+        assert store.begin(key)
+        store.complete(key)
+
+    # a was evicted, reading b makes c the oldest entry
+    assert store.begin('a')
+    assert not store.begin('b')
+    store.complete('a')
+
+    assert list(store.completed) == ['b', 'a']
+    assert store.begin('c')
+
+def test_key_in_flight_in_the_same_container_is_refused(pipeline):
+    store = pipeline.IdempotencyStore(cache_size=10)
+    assert store.begin('a')
+
+    with pytest.raises(pipeline.ScanEventInProgressError):
+        store.begin('a')
+
+    store.release('a')
+    assert store.begin('a')
+
+def test_conditional_claim_is_shared_between_containers(pipeline, table):
+    first = pipeline.IdempotencyStore(cache_size=10, table_name=table)
+    second = pipeline.IdempotencyStore(cache_size=10, table_name=table)
+
+    assert first.begin('a')
+    with pytest.raises(pipeline.ScanEventInProgressError):
+        second.begin('a')
+
+    first.complete('a')
+    assert not second.begin('a')
+    # The completed key is now cached, so the next duplicate needs no DynamoDB request
+    assert 'a' in second.completed
+
+def test_released_and_expired_claims_can_be_taken_over(pipeline, table):
+    first = pipeline.IdempotencyStore(cache_size=10, table_name=table, in_progress_seconds=-1)
+    second = pipeline.IdempotencyStore(cache_size=10, table_name=table)
+
+    # A claim whose in_progress_until has passed belongs to a worker that never finished
+    assert first.begin('a')
+    assert second.begin('a')
+
+    second.release('a')
+    item = boto3.client('dynamodb').get_item(TableName=table, Key={'idempotency_key': {'S': 'a'}})
+    assert 'Item' not in item
+    assert pipeline.IdempotencyStore(cache_size=10, table_name=table).begin('a')
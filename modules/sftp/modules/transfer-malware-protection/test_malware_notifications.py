@@ -0,0 +1,127 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for threat notifications in the malware protection handler (lambda_function.py)"""
+
+import json
+
+import boto3
+import pytest
+
+HANDLER = 'modules/transfer-malware-protection/lambda_function.py'
+INGEST = 'ingest-bucket'
+QUARANTINE = 'quarantine-bucket'
+
+class RecordingSns:
+    """SNS client recording PublishBatch requests, optionally failing some entries"""
+
+    def __init__(self, client, failed_ids=()):
+        self.client = client
+        self.failed_ids = set(failed_ids)
+        self.batches = []
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.batches.append(PublishBatchRequestEntries)
+        response = self.client.publish_batch(TopicArn=TopicArn, PublishBatchRequestEntries=[
+            entry for entry in PublishBatchRequestEntries if entry['Id'] not in self.failed_ids
+        ])
+        response['Failed'] = [
+            {'Id': entry_id, 'Code': 'InternalError', 'Message': 'Service unavailable', 'SenderFault': False}
+            for entry_id in sorted(self.failed_ids)
+        ]
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+@pytest.fixture
+def topic_arn(aws):
+    return boto3.client('sns').create_topic(Name='malware-alerts')['TopicArn']
+
+@pytest.fixture
+def handler(topic_arn, load_module):
+    s3 = boto3.client('s3')
+    for bucket in (INGEST, QUARANTINE):
+        s3.create_bucket(Bucket=bucket)
+    return load_module(
+        HANDLER,
+        ROUTING_CONFIG=json.dumps({'THREATS_FOUND': QUARANTINE}),
+        DELETE_FROM_SOURCE='true',
+        SNS_TOPIC_ARN_FOR_THREATS=topic_arn,
+        REPORT_BATCH_ITEM_FAILURES='true'
+    )
+
+@pytest.fixture
+def sns(aws):
+    recording = RecordingSns(boto3.client('sns'))
+    aws._clients[('client', 'sns')] = recording
+    return recording
+
+def threat_record(message_id, object_key):
+    body = {
+        'detail': {
+            's3ObjectDetails': {'bucketName': INGEST, 'objectKey': object_key, 'eTag': 'etag'},
+            'scanResultDetails': {'scanResultStatus': 'THREATS_FOUND', 'threats': [{'name': 'EICAR-Test-File'}]}
+        }
+    }
+    return {'messageId': message_id, 'body': json.dumps(body)}
+
+def test_notifications_are_published_ten_at_a_time(handler, topic_arn, sns):
+    notifier = handler.ThreatNotifier(topic_arn)
+    for n in range(23):
+        notifier.add(INGEST, f'uploads/{n}.exe', {'scanResultStatus': 'THREATS_FOUND'})
+
+    notifier.flush()
+
+    assert [len(batch) for batch in sns.batches] == [10, 10, 3]
+    assert [entry['Id'] for entry in sns.batches[0]] == [str(n) for n in range(10)]
+    assert notifier.threats == []
+
+def test_notifications_are_split_at_256_kb(handler, topic_arn, sns):
+    notifier = handler.ThreatNotifier(topic_arn)
+    for n in range(3):
+        notifier.add(INGEST, f'uploads/{n}.exe', {'scanResultStatus': 'THREATS_FOUND', 'evidence': 'x' * 100000})
+
+    notifier.flush()
+
+    # Two 100 KB messages fit under the PublishBatch limit, a third does not
+    assert [len(batch) for batch in sns.batches] == [2, 1]
+    for batch in sns.batches:
+        assert sum(len(entry['Subject']) + len(entry['Message']) for entry in batch) <= handler.SNS_BATCH_MAX_BYTES
+
+def test_summary_mode_publishes_one_digest_per_bucket(handler, topic_arn, sns):
+    notifier = handler.ThreatNotifier(topic_arn, 'summary')
+    for bucket in (INGEST, 'other-ingest-bucket'):
+        for n in range(3):
+            notifier.add(bucket, f'uploads/{n}.exe', {'scanResultStatus': 'THREATS_FOUND'})
+
+    notifier.flush()
+
+    assert len(sns.batches) == 1
+    digests = [json.loads(entry['Message']) for entry in sns.batches[0]]
+    assert [(digest['bucket'], digest['threat_count']) for digest in digests] == [(INGEST, 3), ('other-ingest-bucket', 3)]
+
+def test_failed_entries_are_reported_without_failing_the_flush(handler, topic_arn, aws, capsys):
+    sns = RecordingSns(boto3.client('sns'), failed_ids=['1'])
+    aws._clients[('client', 'sns')] = sns
+    notifier = handler.ThreatNotifier(topic_arn)
+    for n in range(3):
+        notifier.add(INGEST, f'uploads/{n}.exe', {'scanResultStatus': 'THREATS_FOUND'})
+
+    notifier.flush()
+
+    output = capsys.readouterr().out
+    assert "Failed to send SNS notification 'Malware Detected: uploads/1.exe': Service unavailable" in output
+    assert 'SNS notifications sent: 2 of 3' in output
+
+def test_threats_alert_once_their_record_settles(handler, sns):
+    boto3.client('s3').put_object(Bucket=INGEST, Key='uploads/infected.exe', Body=b'data')
+    event = {'Records': [threat_record('m-routed', 'uploads/infected.exe'), threat_record('m-missing', 'uploads/missing.exe')]}
+
+    response = handler.handler(event, None)
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'm-missing'}]
+    # The record that failed is redelivered and alerts when it is routed, not now as well
+    assert [json.loads(entry['Message'])['object'] for batch in sns.batches for entry in batch] == ['uploads/infected.exe']
+
+    # A duplicate delivery of the routed record was already alerted on
+    handler.handler({'Records': [threat_record('m-again', 'uploads/infected.exe')]}, None)
+    assert len(sns.batches) == 1
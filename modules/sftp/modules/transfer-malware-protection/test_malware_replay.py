@@ -0,0 +1,143 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the dead letter queue and prefix replay (replay.py)"""
+
+import json
+import os
+import sys
+
+import boto3
+import pytest
+
+INGEST = 'ingest-bucket'
+CLEAN = 'clean-bucket'
+QUARANTINE = 'quarantine-bucket'
+SCAN_STATUS_TAG = 'GuardDutyMalwareScanStatus'
+
+@pytest.fixture
+def replay(aws, monkeypatch):
+    """replay.py imported with the pipeline it wraps, both reading this test's environment"""
+    monkeypatch.setenv('ROUTING_CONFIG', json.dumps({'NO_THREATS_FOUND': CLEAN, 'THREATS_FOUND': QUARANTINE}))
+    monkeypatch.setenv('DELETE_FROM_SOURCE', 'true')
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.abspath(__file__)))
+    for name in ('lambda_function', 'replay'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    s3 = boto3.client('s3')
+    for bucket in (INGEST, CLEAN, QUARANTINE):
+        s3.create_bucket(Bucket=bucket)
+
+    import replay
+    yield replay
+    for name in ('lambda_function', 'replay'):
+        sys.modules.pop(name, None)
+
+@pytest.fixture
+def queue_url(aws):
+    return boto3.client('sqs').create_queue(QueueName='scan-dlq')['QueueUrl']
+
+def scan_event(object_key, status='NO_THREATS_FOUND'):
+    return {
+        'detail': {
+            's3ObjectDetails': {'bucketName': INGEST, 'objectKey': object_key, 'eTag': 'etag'},
+            'scanResultDetails': {'scanResultStatus': status}
+        }
+    }
+
+def dead_letter(queue_url, keys, copies=1):
+    """Upload each key to the ingest bucket and send copies of its scan event to the queue"""
+    s3, sqs = boto3.client('s3'), boto3.client('sqs')
+    for object_key in keys:
+        s3.put_object(Bucket=INGEST, Key=object_key, Body=b'data')
+    for _ in range(copies):
+        for object_key in keys:
+            sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(scan_event(object_key)))
+
+def object_count(bucket):
+    return boto3.client('s3').list_objects_v2(Bucket=bucket)['KeyCount']
+
+def queue_depth(queue_url):
+    attributes = boto3.client('sqs').get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+    return int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+
+def test_drain_routes_each_object_once(replay, queue_url):
+    keys = [f'uploads/{n:02d}.csv' for n in range(20)]
+    dead_letter(queue_url, keys, copies=2)
+    boto3.client('sqs').send_message(QueueUrl=queue_url, MessageBody='not a scan event')
+    checkpoint = replay.ReplayCheckpoint()
+
+    state = replay.drain_queue(queue_url, replay.pipeline.ROUTING_TABLE, None, checkpoint, workers=2)
+
+    assert state['replayed'] == 20
+    assert state['duplicates'] == 20
+    assert state['failed'] == 1
+    assert state['complete'] is True
+    assert object_count(CLEAN) == 20
+    assert object_count(INGEST) == 0
+    # Only the unreadable message is left for a later look
+    assert queue_depth(queue_url) == 1
+
+def test_interrupted_drain_resumes_from_checkpoint(replay, queue_url, tmp_path):
+    checkpoint_path = str(tmp_path / 'replay.json')
+    dead_letter(queue_url, [f'uploads/{n:02d}.csv' for n in range(25)])
+    args = ['--workers', '1', '--checkpoint', checkpoint_path, 'dlq', '--queue-url', queue_url]
+
+    replay.main(args + ['--max-messages', '10'])
+    with open(checkpoint_path) as checkpoint_file:
+        interrupted = json.load(checkpoint_file)
+    assert interrupted['replayed'] == 10
+    assert interrupted['complete'] is False
+
+    replay.main(args)
+    with open(checkpoint_path) as checkpoint_file:
+        resumed = json.load(checkpoint_file)
+    assert resumed['replayed'] == 25
+    assert resumed['complete'] is True
+    assert object_count(CLEAN) == 25
+
+def test_prefix_replay_resumes_after_the_checkpointed_key(replay, tmp_path):
+    s3 = boto3.client('s3')
+    for n in range(10):
+        object_key = f'uploads/{n:02d}.csv'
+        s3.put_object(Bucket=INGEST, Key=object_key, Body=b'data')
+        status = 'THREATS_FOUND' if n == 7 else 'NO_THREATS_FOUND'
+        s3.put_object_tagging(Bucket=INGEST, Key=object_key, Tagging={'TagSet': [{'Key': SCAN_STATUS_TAG, 'Value': status}]})
+    checkpoint_path = tmp_path / 'replay.json'
+    checkpoint_path.write_text(json.dumps({'replayed': 5, 'start_after': 'uploads/04.csv'}))
+
+    state = replay.replay_prefix(
+        INGEST, 'uploads/', replay.pipeline.ROUTING_TABLE, None, replay.ReplayCheckpoint(str(checkpoint_path))
+    )
+
+    assert state['replayed'] == 10
+    assert state['start_after'] == 'uploads/09.csv'
+    assert object_count(CLEAN) == 4
+    assert object_count(QUARANTINE) == 1
+    assert [item['Key'] for item in s3.list_objects_v2(Bucket=INGEST)['Contents']] == [f'uploads/{n:02d}.csv' for n in range(5)]
+
+def test_threat_alerts_are_published_before_each_checkpoint(replay, queue_url):
+    events = []
+
+    class RecordingNotifier:
+        def __init__(self):
+            self.queued = 0
+
+        def add(self, source_bucket, object_key, scan_details):
+            self.queued += 1
+
+        def flush(self):
+            events.append(('flush', self.queued))
+            self.queued = 0
+
+    class RecordingCheckpoint(replay.ReplayCheckpoint):
+        def record(self, **counts):
+            events.append(('record', counts.get('replayed', 0)))
+            super().record(**counts)
+
+    s3, sqs = boto3.client('s3'), boto3.client('sqs')
+    for n in range(3):
+        s3.put_object(Bucket=INGEST, Key=f'uploads/{n}.exe', Body=b'data')
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(scan_event(f'uploads/{n}.exe', 'THREATS_FOUND')))
+
+    replay.drain_queue(queue_url, replay.pipeline.ROUTING_TABLE, RecordingNotifier(), RecordingCheckpoint(), workers=1)
+
+    assert events == [('flush', 3), ('record', 3)]
@@ -0,0 +1,61 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the routing rule trie of the malware protection handler (lambda_function.py)"""
+
+import pytest
+
+HANDLER = 'modules/transfer-malware-protection/lambda_function.py'
+MIB = 1024 * 1024
+
+ROUTING_CONFIG = {'NO_THREATS_FOUND': 'clean-bucket', 'THREATS_FOUND': 'quarantine-bucket', 'FAILED': ''}
+
+RULES = [
+    {'scan_status': 'NO_THREATS_FOUND', 'source_prefix': 'uploads/finance/', 'file_extensions': ['.csv'], 'destination': 'finance-bucket/csv'},
+    {'scan_status': 'NO_THREATS_FOUND', 'source_prefix': 'uploads/', 'min_size_mb': 100, 'destination': 'large-bucket'},
+    {'scan_status': 'NO_THREATS_FOUND', 'source_prefix': 'uploads/finance/', 'destination': 'finance-bucket'},
+    {'scan_status': 'NO_THREATS_FOUND', 'file_extensions': ['.ZIP'], 'destination': 'archive-bucket'}
+]
+
+@pytest.fixture
+def pipeline(load_module):
+    return load_module(HANDLER, METRICS_ENABLED='false', ROUTING_CONFIG='{}')
+
+def test_first_declared_matching_rule_wins(pipeline):
+    table = pipeline.RoutingTable(ROUTING_CONFIG, RULES)
+
+    assert table.resolve('NO_THREATS_FOUND', 'uploads/finance/q1.csv') == 'finance-bucket/csv'
+    # A broader prefix declared earlier beats a longer one declared later
+    assert table.resolve('NO_THREATS_FOUND', 'uploads/finance/big.pdf', 200 * MIB) == 'large-bucket'
+    assert table.resolve('NO_THREATS_FOUND', 'uploads/finance/q1.pdf', 1 * MIB) == 'finance-bucket'
+    # Extensions match case-insensitively, and a rule without a prefix matches every key
+    assert table.resolve('NO_THREATS_FOUND', 'other/Backup.Zip') == 'archive-bucket'
+
+def test_unmatched_keys_fall_back_to_routing_config(pipeline):
+    table = pipeline.RoutingTable(ROUTING_CONFIG, RULES)
+
+    assert table.resolve('NO_THREATS_FOUND', 'other/report.pdf') == 'clean-bucket'
+    assert table.resolve('THREATS_FOUND', 'uploads/finance/q1.csv') == 'quarantine-bucket'
+    # Empty destinations leave the object in place
+    assert table.resolve('FAILED', 'uploads/a.csv') is None
+    assert table.resolve('UNSUPPORTED', 'uploads/a.csv') is None
+
+def test_size_bounds(pipeline):
+    table = pipeline.RoutingTable({}, [
+        {'scan_status': 'NO_THREATS_FOUND', 'min_size_mb': 1, 'max_size_mb': 10, 'destination': 'medium-bucket'}
+    ])
+
+    assert table.needs_object_size('NO_THREATS_FOUND')
+    assert not table.needs_object_size('THREATS_FOUND')
+    assert table.resolve('NO_THREATS_FOUND', 'a.bin', 1 * MIB) == 'medium-bucket'
+    # max_size_mb is exclusive, and an unknown size never matches a size rule
+    assert table.resolve('NO_THREATS_FOUND', 'a.bin', 10 * MIB) is None
+    assert table.resolve('NO_THREATS_FOUND', 'a.bin', MIB - 1) is None
+    assert table.resolve('NO_THREATS_FOUND', 'a.bin') is None
+
+@pytest.mark.parametrize('rule', [
+    {'scan_status': 'CLEAN', 'destination': 'clean-bucket'},
+    {'scan_status': 'NO_THREATS_FOUND'},
+    {'scan_status': 'NO_THREATS_FOUND', 'destination': ''}
+])
+def test_invalid_rules_are_rejected(pipeline, rule):
+    with pytest.raises(ValueError, match='Invalid routing rule 1'):
+        pipeline.RoutingTable({}, [RULES[0], rule])
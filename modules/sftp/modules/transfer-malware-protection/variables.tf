@@ -75,6 +75,54 @@ variable "routing_config" {
   }
 }
 
+variable "routing_rules" {
+  description = "Ordered routing rules matched on scan status, source key prefix, file extension and object size (MiB, min inclusive, max exclusive). The first matching rule wins; objects with no matching rule fall back to routing_config"
+  type = list(object({
+    scan_status     = string
+    destination     = string
+    source_prefix   = optional(string, "")
+    file_extensions = optional(list(string), [])
+    min_size_mb     = optional(number)
+    max_size_mb     = optional(number)
+  }))
+  default = []
+
+  validation {
+    condition = alltrue([
+      for rule in var.routing_rules :
+      contains(["NO_THREATS_FOUND", "THREATS_FOUND", "UNSUPPORTED", "ACCESS_DENIED", "FAILED"], rule.scan_status)
+    ])
+    error_message = "routing_rules scan_status must be one of NO_THREATS_FOUND, THREATS_FOUND, UNSUPPORTED, ACCESS_DENIED or FAILED."
+  }
+
+  validation {
+    condition = alltrue([
+      for rule in var.routing_rules :
+      can(regex("^[a-z0-9][a-z0-9.-]{1,61}[a-z0-9](/.+)?$", rule.destination))
+    ])
+    error_message = "routing_rules destination must be a bucket name optionally followed by /prefix."
+  }
+
+  validation {
+    condition = alltrue(flatten([
+      for rule in var.routing_rules : [
+        for extension in rule.file_extensions : can(regex("^\\.[^/]+$", extension))
+      ]
+    ]))
+    error_message = "routing_rules file_extensions must start with a dot, for example \".zip\"."
+  }
+
+  validation {
+    condition = alltrue([
+      for rule in var.routing_rules :
+      (rule.min_size_mb == null || try(rule.min_size_mb >= 0, false)) &&
+      (rule.max_size_mb == null || try(rule.max_size_mb > 0, false)) &&
+      (rule.min_size_mb == null || rule.max_size_mb == null || try(rule.min_size_mb < rule.max_size_mb, false))
+    ])
+    error_message = "routing_rules min_size_mb must be 0 or more, max_size_mb must be greater than 0 and min_size_mb must be lower than max_size_mb."
+  }
+}
+
 variable "enable_sqs_buffer" {
   description = "Enable SQS buffer between EventBridge and Lambda for improved reliability"
   type        = bool
@@ -87,8 +135,147 @@ variable "sns_topic_arn_for_threats" {
   default     = null
 }
 
+variable "threat_notification_mode" {
+  description = "How THREATS_FOUND notifications are published with SNS PublishBatch: \"individual\" sends one message per infected object, \"summary\" sends one digest per source bucket for each Lambda batch"
+  type        = string
+  default     = "individual"
+
+  validation {
+    condition     = contains(["individual", "summary"], var.threat_notification_mode)
+    error_message = "threat_notification_mode must be either \"individual\" or \"summary\"."
+  }
+}
+
 variable "enable_object_tagging" {
   description = "Whether to tag scanned objects with scan results"
   type        = bool
   default     = true
 }
+
+variable "lambda_max_workers" {
+  description = "Maximum number of SQS records processed concurrently by each Lambda invocation. Set to 1 to process records serially"
+  type        = number
+  default     = 4
+
+  validation {
+    condition     = var.lambda_max_workers >= 1 && var.lambda_max_workers <= 32
+    error_message = "lambda_max_workers must be between 1 and 32."
+  }
+}
+
+variable "sqs_batch_size" {
+  description = "Maximum number of SQS messages delivered to the Lambda function in each batch"
+  type        = number
+  default     = 10
+
+  validation {
+    condition     = var.sqs_batch_size >= 1 && var.sqs_batch_size <= 10000
+    error_message = "sqs_batch_size must be between 1 and 10000."
+  }
+}
+
+variable "sqs_maximum_batching_window_in_seconds" {
+  description = "Maximum time in seconds to gather SQS messages before invoking the Lambda function. Must be at least 1 when sqs_batch_size is greater than 10"
+  type        = number
+  default     = 0
+
+  validation {
+    condition     = var.sqs_maximum_batching_window_in_seconds >= 0 && var.sqs_maximum_batching_window_in_seconds <= 300
+    error_message = "sqs_maximum_batching_window_in_seconds must be between 0 and 300."
+  }
+
+  validation {
+    condition     = var.sqs_batch_size <= 10 || var.sqs_maximum_batching_window_in_seconds >= 1
+    error_message = "sqs_maximum_batching_window_in_seconds must be at least 1 when sqs_batch_size is greater than 10."
+  }
+}
+
+variable "sqs_report_batch_item_failures" {
+  description = "Whether the Lambda function reports partial batch failures so that only failed SQS messages are retried"
+  type        = bool
+  default     = true
+}
+
+variable "lambda_timeout" {
+  description = "Timeout in seconds for the file transfer Lambda function. The SQS visibility timeout is set one second higher"
+  type        = number
+  default     = 60
+
+  validation {
+    condition     = var.lambda_timeout >= 1 && var.lambda_timeout <= 900
+    error_message = "lambda_timeout must be between 1 and 900 seconds."
+  }
+}
+
+variable "multipart_copy_threshold_mb" {
+  description = "Object size in MiB at or above which files are copied with a parallel multipart copy instead of a single CopyObject call"
+  type        = number
+  default     = 512
+
+  validation {
+    condition     = var.multipart_copy_threshold_mb >= 5 && var.multipart_copy_threshold_mb <= 5120
+    error_message = "multipart_copy_threshold_mb must be between 5 and 5120 (the CopyObject limit is 5 GiB)."
+  }
+}
+
+variable "multipart_copy_part_size_mb" {
+  description = "Part size in MiB for multipart copies. Grown automatically when an object would need more than 10000 parts"
+  type        = number
+  default     = 128
+
+  validation {
+    condition     = var.multipart_copy_part_size_mb >= 5 && var.multipart_copy_part_size_mb <= 5120
+    error_message = "multipart_copy_part_size_mb must be between 5 and 5120."
+  }
+}
+
+variable "multipart_copy_max_concurrency" {
+  description = "Maximum number of UploadPartCopy requests run in parallel for a single multipart copy"
+  type        = number
+  default     = 10
+
+  validation {
+    condition     = var.multipart_copy_max_concurrency >= 1 && var.multipart_copy_max_concurrency <= 64
+    error_message = "multipart_copy_max_concurrency must be between 1 and 64."
+  }
+}
+
+variable "idempotency_cache_size" {
+  description = "Number of processed scan events remembered in each Lambda container to skip duplicate deliveries. Set to 0 to disable the in-memory cache"
+  type        = number
+  default     = 10000
+
+  validation {
+    condition     = var.idempotency_cache_size >= 0
+    error_message = "idempotency_cache_size must be 0 or greater."
+  }
+}
+
+variable "enable_idempotency_table" {
+  description = "Whether to create a DynamoDB table that records processed scan events so duplicates delivered to other Lambda containers are skipped"
+  type        = bool
+  default     = false
+}
+
+variable "idempotency_ttl_seconds" {
+  description = "How long in seconds a processed scan event is remembered in the idempotency table before it expires"
+  type        = number
+  default     = 86400
+
+  validation {
+    condition     = var.idempotency_ttl_seconds >= 60
+    error_message = "idempotency_ttl_seconds must be at least 60."
+  }
+}
+
+variable "enable_metrics" {
+  description = "Whether the Lambda function emits CloudWatch Embedded Metric Format metrics for stage latency, bytes copied, records per invocation, retries and throttles"
+  type        = bool
+  default     = true
+}
+
+variable "metrics_namespace" {
+  description = "CloudWatch namespace for the Lambda function metrics"
+  type        = string
+  default     = "SFTP/Lambda"
+}
@@ -0,0 +1,541 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Local benchmark of the SFTP Lambda handlers against AWS stand-ins.
+
+Runs the malware protection handler, the dynamic retrieve handler and the
+event listener status checks on synthetic GuardDuty scan events, directory
+listings and tracking tables, and reports events per second, p50/p99
+invocation latency, peak Python heap and AWS API requests per scenario.
+S3, SQS and DynamoDB are moto in-process mocks, or LocalStack when AWS_ENDPOINT_URL is set.
+Neither emulates SFTP connectors, so the Transfer Family API is always a
+stand-in that answers instantly.
+
+    python benchmark_handlers.py
+    python benchmark_handlers.py --events 5000 --listing-files 50000 --tracking-items 2000
+    python benchmark_handlers.py --output baseline.json
+    python benchmark_handlers.py --baseline baseline.json [--tolerance 0.25]
+
+With --baseline the run exits non-zero when a scenario run with the same
+parameters lost more than --tolerance of its events per second, or grew its
+p99 latency, peak heap or AWS requests by more than --tolerance.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from transfer_analytics import percentile
+
+SFTP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNTIME_DIR = os.path.join(SFTP_DIR, 'lambda')
+MALWARE_HANDLER = os.path.join(SFTP_DIR, 'modules', 'transfer-malware-protection', 'lambda_function.py')
+DYNAMIC_DIR = os.path.join(SFTP_DIR, 'examples', 'sftp-connector-automated-file-retrieve-dynamic')
+STATIC_DIR = os.path.join(SFTP_DIR, 'examples', 'sftp-connector-automated-file-retrieve-static')
+
+REGION = 'us-east-1'
+CONNECTOR_ID = 'c-benchmark0000001'
+INGEST_BUCKET = 'benchmark-ingest'
+CLEAN_BUCKET = 'benchmark-clean'
+QUARANTINE_BUCKET = 'benchmark-quarantine'
+RETRIEVE_BUCKET = 'benchmark-retrieve'
+# Share of synthetic scan events reporting a threat
+THREAT_RATIO = 0.05
+
+COMPARED_METRICS = (('events_per_s', -1), ('p99_ms', 1), ('peak_heap_mb', 1), ('aws_requests', 1))
+
+class LambdaContext:
+    """Context with a fixed time budget so handler deadlines never cut a run short"""
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+class TransferStandIn:
+    """Transfer Family connector API stand-in.
+
+    Listings are written to S3 by the scenario ahead of each invocation under
+    the listing ID returned next, and transfers complete immediately with
+    the file results registered for them.
+    """
+
+    def __init__(self):
+        self.next_listing_id = None
+        self.transfer_results = {}
+        self.transfers_started = 0
+
+    def start_directory_listing(self, **kwargs):
+        return {'ListingId': self.next_listing_id}
+
+    def start_file_transfer(self, **kwargs):
+        self.transfers_started += 1
+        return {'TransferId': str(uuid.uuid4())}
+
+    def list_file_transfer_results(self, ConnectorId, TransferId, **kwargs):
+        paths = self.transfer_results.get(TransferId, [])
+        return {'FileTransferResults': [{'FilePath': path, 'StatusCode': 'COMPLETED'} for path in paths]}
+
+class RequestCounter:
+    """Counts the AWS API requests the handlers send.
+
+    Unlike latency, the count does not depend on how fast the backend
+    emulates an operation, so it compares the same way on moto and LocalStack.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.requests += 1
+
+def load_handler(name, path, env):
+    """Import a handler file under a unique module name with its environment in place.
+
+    The examples share module names (index, event_listener) and read some
+    settings at import, so each scenario loads its own copy.
+    """
+    os.environ.update(env)
+    spec = importlib.util.spec_from_file_location(f'benchmark_{name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def utc(offset=timedelta()):
+    return (datetime.now(timezone.utc) + offset).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def scan_event(key, status):
+    """GuardDuty Malware Protection for S3 scan result event"""
+    return {
+        'source': 'aws.guardduty',
+        'detail-type': 'GuardDuty Malware Protection Object Scan Result',
+        'detail': {
+            's3ObjectDetails': {'bucketName': INGEST_BUCKET, 'objectKey': key, 'eTag': uuid.uuid4().hex},
+            'scanResultDetails': {'scanResultStatus': status, 'threats': None}
+        }
+    }
+
+def directory_listing(files):
+    """Listing JSON in the StartDirectoryListing output format"""
+    return json.dumps({
+        'files': [
+            {'filePath': f'/uploads/file-{i:07d}.csv', 'size': 1024 + i, 'modifiedTimestamp': '2026-01-01T00:00:00Z'}
+            for i in range(files)
+        ],
+        'paths': [],
+        'truncated': False
+    }).encode()
+
+def create_tracking_table(dynamodb, name, range_key=None):
+    key_schema = [{'AttributeName': 'batch_id', 'KeyType': 'HASH'}]
+    attributes = [{'AttributeName': 'batch_id', 'AttributeType': 'S'}, {'AttributeName': 'pending_status', 'AttributeType': 'S'}]
+    index_schema = [{'AttributeName': 'pending_status', 'KeyType': 'HASH'}]
+    if range_key:
+        key_schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+        attributes.append({'AttributeName': range_key, 'AttributeType': 'S'})
+        index_schema.append({'AttributeName': 'batch_id', 'KeyType': 'RANGE'})
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=key_schema,
+        AttributeDefinitions=attributes,
+        GlobalSecondaryIndexes=[{'IndexName': 'pending-status-index', 'KeySchema': index_schema, 'Projection': {'ProjectionType': 'ALL'}}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return boto3_resource('dynamodb').Table(name)
+
+def boto3_client(name):
+    import boto3
+    return boto3.client(name, region_name=REGION)
+
+def boto3_resource(name):
+    import boto3
+    return boto3.resource(name, region_name=REGION)
+
+class Scenario:
+    """One handler workload.
+
+    setup() runs once, prepare(i) builds the payload of invocation i outside
+    the timed region and returns it with the number of events it carries.
+    One invocation past the timed ones is prepared for the heap measurement.
+    """
+
+    name = None
+    description = None
+
+    def __init__(self, args, transfer):
+        self.args = args
+        self.transfer = transfer
+
+    def parameters(self):
+        return {}
+
+    def invocations(self):
+        return self.args.iterations
+
+    def setup(self):
+        pass
+
+    def prepare(self, i):
+        raise NotImplementedError
+
+    def invoke(self, payload):
+        raise NotImplementedError
+
+class MalwareScanEvents(Scenario):
+    name = 'malware-sqs'
+    description = 'lambda_function.handler on SQS batches of GuardDuty scan results, copying each object to its routed bucket'
+
+    def parameters(self):
+        return {'events': self.args.events, 'sqs_batch_size': self.args.sqs_batch_size}
+
+    def invocations(self):
+        return -(-self.args.events // self.args.sqs_batch_size)
+
+    def setup(self):
+        s3 = boto3_client('s3')
+        for bucket in (INGEST_BUCKET, CLEAN_BUCKET, QUARANTINE_BUCKET):
+            s3.create_bucket(Bucket=bucket)
+        self.keys = [f'uploads/{i % 50:02d}/file-{i:07d}.csv' for i in range(self.args.events)]
+        for key in self.keys:
+            s3.put_object(Bucket=INGEST_BUCKET, Key=key, Body=b'x' * 1024)
+
+        self.handler = load_handler('malware', MALWARE_HANDLER, {
+            'ROUTING_CONFIG': json.dumps({'NO_THREATS_FOUND': f'{CLEAN_BUCKET}/scanned', 'THREATS_FOUND': QUARANTINE_BUCKET}),
+            'REPORT_BATCH_ITEM_FAILURES': 'true',
+            # Objects stay in the ingest bucket so every iteration copies the same set
+            'DELETE_FROM_SOURCE': 'false',
+            'MAX_WORKERS': str(self.args.workers),
+            'IDEMPOTENCY_CACHE_SIZE': '0'
+        })
+
+    def prepare(self, i):
+        size = self.args.sqs_batch_size
+        i %= self.invocations()
+        threat_every = int(1 / THREAT_RATIO)
+        records = [
+            {
+                'messageId': str(uuid.uuid4()),
+                'body': json.dumps(scan_event(key, 'THREATS_FOUND' if n % threat_every == 0 else 'NO_THREATS_FOUND'))
+            }
+            for n, key in enumerate(self.keys[i * size:(i + 1) * size], start=i * size)
+        ]
+        return {'Records': records}, len(records)
+
+    def invoke(self, payload):
+        response = self.handler.handler(payload, LambdaContext())
+        if response.get('batchItemFailures'):
+            raise RuntimeError(f"{len(response['batchItemFailures'])} records failed")
+
+class RetrieveListing(Scenario):
+    name = 'retrieve-listing'
+    description = 'dynamic index.lambda_handler reading a directory listing, diffing it against the manifest and starting chunked transfers'
+
+    def parameters(self):
+        return {'listing_files': self.args.listing_files}
+
+    def setup(self):
+        boto3_client('s3').create_bucket(Bucket=RETRIEVE_BUCKET)
+        create_tracking_table(boto3_client('dynamodb'), 'benchmark-retrieve-tracking', range_key='record_id')
+        self.listing = directory_listing(self.args.listing_files)
+
+        self.handler = load_handler('retrieve', os.path.join(DYNAMIC_DIR, 'index.py'), {
+            'CONNECTOR_ID': CONNECTOR_ID,
+            'S3_BUCKET': RETRIEVE_BUCKET,
+            'S3_PREFIX': 'retrieved',
+            'SOURCE_DIRECTORY': '/uploads',
+            'DYNAMODB_TABLE': 'benchmark-retrieve-tracking',
+            'MANIFEST_KEY': 'manifests/benchmark.json',
+            # The stand-in never throttles, the limiter would only measure its own rate
+            'TRANSFER_RATE_PER_SECOND': '100000'
+        })
+
+    def prepare(self, i):
+        s3 = boto3_client('s3')
+        # A fresh manifest every run, otherwise later iterations would skip every file
+        s3.delete_object(Bucket=RETRIEVE_BUCKET, Key='manifests/benchmark.json')
+        self.transfer.next_listing_id = str(uuid.uuid4())
+        s3.put_object(Bucket=RETRIEVE_BUCKET, Key=f'retrieved/{CONNECTOR_ID}-{self.transfer.next_listing_id}.json', Body=self.listing)
+        return {}, self.args.listing_files
+
+    def invoke(self, payload):
+        self.handler.lambda_handler(payload, LambdaContext())
+
+class DynamicStatusCheck(Scenario):
+    name = 'dynamic-status-check'
+    description = 'dynamic event_listener.lambda_handler settling N pending transfer items from the pending-status-index'
+
+    def parameters(self):
+        return {'tracking_items': self.args.tracking_items}
+
+    def setup(self):
+        self.table = create_tracking_table(boto3_client('dynamodb'), 'benchmark-dynamic-tracking', range_key='record_id')
+        self.handler = load_handler('dynamic_listener', os.path.join(DYNAMIC_DIR, 'event_listener.py'), {
+            'DYNAMODB_TABLE': 'benchmark-dynamic-tracking'
+        })
+        self.closed_keys = []
+
+    def prepare(self, i):
+        started_at = utc(-timedelta(minutes=5))
+        batch_id = str(uuid.uuid4())
+        with self.table.batch_writer() as writer:
+            # Closed records expire from a real table, so each invocation starts from N pending records only
+            for key in self.closed_keys:
+                writer.delete_item(Key=key)
+            self.closed_keys = [{'batch_id': batch_id, 'record_id': f'CHUNK#{n:06d}'} for n in range(self.args.tracking_items)]
+            for n in range(self.args.tracking_items):
+                transfer_id = str(uuid.uuid4())
+                paths = [f'/uploads/{n:06d}/file-{f}.csv' for f in range(10)]
+                self.transfer.transfer_results[transfer_id] = paths
+                writer.put_item(Item={
+                    'batch_id': batch_id,
+                    'record_id': f'CHUNK#{n:06d}',
+                    'transfer_id': transfer_id,
+                    'connector_id': CONNECTOR_ID,
+                    'status': 'TRANSFER_STARTED',
+                    'pending_status': 'TRANSFER_STARTED',
+                    'file_paths': paths,
+                    'file_sizes': [1024] * len(paths),
+                    'files_count': len(paths),
+                    'started_at': started_at,
+                    'updated_at': started_at
+                })
+        return {}, self.args.tracking_items
+
+    def invoke(self, payload):
+        self.handler.lambda_handler(payload, LambdaContext())
+
+class StaticFileEvents(Scenario):
+    name = 'static-file-events'
+    description = 'static event_listener.lambda_handler counting one file result event per invocation on its batch'
+
+    def parameters(self):
+        return {'events': self.args.events}
+
+    def invocations(self):
+        return self.args.events
+
+    def setup(self):
+        self.table = create_tracking_table(boto3_client('dynamodb'), 'benchmark-static-tracking')
+        self.handler = load_handler('static_listener', os.path.join(STATIC_DIR, 'event_listener.py'), {
+            'DYNAMODB_TABLE': 'benchmark-static-tracking'
+        })
+        started_at = utc()
+        # The event of the heap measurement closes the batch
+        self.table.put_item(Item={
+            'batch_id': 'benchmark-transfer',
+            'status': 'TRANSFER_STARTED',
+            'pending_status': 'TRANSFER_STARTED',
+            'files_expected': self.args.events + 1,
+            'started_at': started_at,
+            'updated_at': started_at
+        })
+
+    def prepare(self, i):
+        now = utc()
+        return {
+            'source': 'aws.transfer',
+            'detail-type': 'SFTP Connector File Retrieve Completed',
+            'detail': {
+                'connector-id': CONNECTOR_ID,
+                'transfer-id': 'benchmark-transfer',
+                'file-transfer-id': f'file-transfer-{i:07d}',
+                'file-path': f'/uploads/file-{i:07d}.csv',
+                'bytes': 1024,
+                'status-code': 'COMPLETED',
+                'start-timestamp': now,
+                'end-timestamp': now
+            }
+        }, 1
+
+    def invoke(self, payload):
+        response = self.handler.lambda_handler(payload, LambdaContext())
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+
+class StaticSweep(Scenario):
+    name = 'static-sweep'
+    description = 'static event_listener.lambda_handler closing N stale batches with TransactWriteItems'
+
+    def parameters(self):
+        return {'tracking_items': self.args.tracking_items}
+
+    def setup(self):
+        # Shares the table and module of static-file-events when both run
+        self.table = boto3_resource('dynamodb').Table('benchmark-static-tracking')
+        if 'benchmark-static-tracking' not in boto3_client('dynamodb').list_tables()['TableNames']:
+            self.table = create_tracking_table(boto3_client('dynamodb'), 'benchmark-static-tracking')
+        self.handler = load_handler('static_sweep', os.path.join(STATIC_DIR, 'event_listener.py'), {
+            'DYNAMODB_TABLE': 'benchmark-static-tracking'
+        })
+        self.closed_keys = []
+
+    def prepare(self, i):
+        started_at = utc(-timedelta(hours=1))
+        with self.table.batch_writer() as writer:
+            # Closed records expire from a real table, so each invocation starts from N stale batches only
+            for key in self.closed_keys:
+                writer.delete_item(Key=key)
+            self.closed_keys = [{'batch_id': f'stale-{i:03d}-{n:06d}'} for n in range(self.args.tracking_items)]
+            for n in range(self.args.tracking_items):
+                writer.put_item(Item={
+                    'batch_id': f'stale-{i:03d}-{n:06d}',
+                    'status': 'TRANSFER_STARTED',
+                    'pending_status': 'TRANSFER_STARTED',
+                    'files_expected': 10,
+                    'files_completed': 7,
+                    'started_at': started_at,
+                    'updated_at': started_at
+                })
+        return {}, self.args.tracking_items
+
+    def invoke(self, payload):
+        response = self.handler.lambda_handler(payload, LambdaContext())
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+
+SCENARIOS = {scenario.name: scenario for scenario in (MalwareScanEvents, RetrieveListing, DynamicStatusCheck, StaticFileEvents, StaticSweep)}
+
+def run_scenario(scenario, counter):
+    """Time every invocation and count its AWS requests, then measure peak heap on one more untimed one"""
+    scenario.setup()
+    latencies_ms, events, requests = [], 0, 0
+    invocations = scenario.invocations()
+    with open(os.devnull, 'w') as devnull:
+        for i in range(invocations):
+            payload, payload_events = scenario.prepare(i)
+            with contextlib.redirect_stdout(devnull):
+                before = counter.requests
+                started = time.perf_counter()
+                scenario.invoke(payload)
+                latencies_ms.append((time.perf_counter() - started) * 1000)
+                requests += counter.requests - before
+            events += payload_events
+
+        # tracemalloc slows allocation down, so heap is measured apart from the timings
+        payload, _ = scenario.prepare(invocations)
+        with contextlib.redirect_stdout(devnull):
+            tracemalloc.start()
+            try:
+                scenario.invoke(payload)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+    latencies_ms.sort()
+    seconds = sum(latencies_ms) / 1000
+    return {
+        'description': scenario.description,
+        'parameters': scenario.parameters(),
+        'invocations': len(latencies_ms),
+        'events': events,
+        'events_per_s': round(events / seconds, 1) if seconds else None,
+        'p50_ms': round(percentile(latencies_ms, 50), 3),
+        'p99_ms': round(percentile(latencies_ms, 99), 3),
+        'peak_heap_mb': round(peak / 1e6, 3),
+        'aws_requests': requests
+    }
+
+def compare(results, baseline, tolerance):
+    """Return one line per metric that regressed by more than tolerance against the baseline"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        if previous.get('parameters') != current['parameters']:
+            print(f"Skipping {name}: baseline was run with {previous.get('parameters')}", file=sys.stderr)
+            continue
+        for metric, direction in COMPARED_METRICS:
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change * direction > tolerance:
+                regressions.append(f"{name}: {metric} {before} -> {after} ({change:+.1%})")
+    return regressions
+
+@contextlib.contextmanager
+def aws_stand_ins(transfer, counter):
+    """moto for S3, SQS and DynamoDB unless AWS_ENDPOINT_URL points at LocalStack, with the Transfer stand-in"""
+    import boto3
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    os.environ['METRICS_ENABLED'] = 'false'
+    sys.path.insert(0, RUNTIME_DIR)
+    import sftp_runtime
+
+    if os.environ.get('AWS_ENDPOINT_URL'):
+        mock = contextlib.nullcontext()
+    else:
+        from moto import mock_aws
+
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+        mock = mock_aws()
+
+    with mock:
+        # moto resets the default session when it starts, and clients copy its handlers when created
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register('before-call', counter)
+        sftp_runtime._clients.clear()
+        sftp_runtime._clients[('client', 'transfer')] = transfer
+        try:
+            yield
+        finally:
+            sftp_runtime._clients.clear()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='Scenario to run, repeatable (default: all)')
+    parser.add_argument('--events', type=int, default=1000, help='GuardDuty scan events and static file events per run')
+    parser.add_argument('--sqs-batch-size', type=int, default=10, help='Scan events per SQS invocation')
+    parser.add_argument('--workers', type=int, default=4, help='MAX_WORKERS of the malware protection handler')
+    parser.add_argument('--listing-files', type=int, default=10000, help='Files in each directory listing')
+    parser.add_argument('--tracking-items', type=int, default=500, help='Pending tracking items per status check')
+    parser.add_argument('--iterations', type=int, default=5, help='Invocations of the listing and status check scenarios')
+    parser.add_argument('--output', help='Write the results as JSON to this file, for use as a later baseline')
+    parser.add_argument('--baseline', help='Earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression against the baseline')
+    args = parser.parse_args(argv)
+
+    transfer = TransferStandIn()
+    counter = RequestCounter()
+    results = {
+        'generated_at': utc(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': 'localstack' if os.environ.get('AWS_ENDPOINT_URL') else 'moto',
+        'scenarios': {}
+    }
+    with aws_stand_ins(transfer, counter):
+        for name in args.scenario or SCENARIOS:
+            results['scenarios'][name] = run_scenario(SCENARIOS[name](args, transfer), counter)
+            report = results['scenarios'][name]
+            print(f"{name:22} {report['events']:>8} events  {report['events_per_s']:>10} events/s  "
+                  f"p50 {report['p50_ms']:>9} ms  p99 {report['p99_ms']:>9} ms  heap {report['peak_heap_mb']:>8} MB  "
+                  f"{report['aws_requests']:>7} requests")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+            output.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Tests for the transfer latency and throughput report (transfer_analytics.py)"""
+
+import gzip
+import json
+
+import pytest
+
+ANALYTICS = 'tools/transfer_analytics.py'
+
+@pytest.fixture
+def analytics(load_module):
+    return load_module(ANALYTICS)
+
+def file_item(connector_id, duration_ms, completed_at='2026-01-01T09:15:00.000Z', bytes_transferred=1000000, status='COMPLETED'):
+    """Static per-file record, timed by its result event"""
+    return {
+        'batch_id': 'batch-1',
+        'record_type': 'FILE',
+        'connector_id': connector_id,
+        'status': status,
+        'bytes_transferred': bytes_transferred,
+        'completed_at': completed_at,
+        'duration_ms': duration_ms
+    }
+
+def transfer_item(connector_id, duration_ms, completed_at='2026-01-01T09:15:00.000Z', bytes_transferred=10000000):
+    """Dynamic transfer record, timed by the status check that saw it finish"""
+    return {
+        'batch_id': 'batch-2',
+        'record_id': 'CHUNK#000000',
+        'connector_id': connector_id,
+        'status': 'COMPLETED',
+        'bytes_transferred': bytes_transferred,
+        'completed_at': completed_at,
+        'duration_ms': duration_ms
+    }
+
+def test_percentile_is_nearest_rank(analytics):
+    values = list(range(1, 101))
+
+    assert [analytics.percentile(values, pct) for pct in (50, 95, 99)] == [50, 95, 99]
+    assert analytics.percentile([7], 99) == 7
+    assert analytics.percentile([], 50) is None
+
+def test_polled_durations_are_reported_apart_as_upper_bounds(analytics):
+    items = [file_item('c-1', duration) for duration in (100, 200, 300, 400)]
+    items += [transfer_item('c-1', duration) for duration in (60000, 120000)]
+
+    report = analytics.analyze(items)
+
+    exact, upper_bound = report['connectors']
+    assert (exact['timing'], exact['transfers'], exact['p50_ms'], exact['p99_ms']) == ('exact', 4, 200, 400)
+    assert exact['mb_per_s'] == 4.0
+    # Two-minute polled durations do not drag the event-timed percentiles up
+    assert (upper_bound['timing'], upper_bound['transfers'], upper_bound['p50_ms']) == ('upper_bound', 2, 60000)
+
+def test_items_are_grouped_per_connector_and_hour(analytics):
+    items = [
+        file_item('c-1', 100, completed_at='2026-01-01T09:59:59.999Z'),
+        file_item('c-1', 300, completed_at='2026-01-01T10:00:00.000Z', status='FAILED'),
+        file_item('c-2', 200),
+        # Not finished, or finished before durations were recorded
+        {'connector_id': 'c-1', 'status': 'TRANSFER_STARTED'},
+        {'connector_id': 'c-1', 'status': 'COMPLETED', 'completed_at': '2026-01-01T09:00:00.000Z'}
+    ]
+
+    report = analytics.analyze(items)
+
+    assert [(row['connector_id'], row['transfers'], row['failed']) for row in report['connectors']] == [('c-1', 2, 1), ('c-2', 1, 0)]
+    assert [(row['connector_id'], row['hour']) for row in report['hourly']] == [
+        ('c-1', '2026-01-01T09:00Z'),
+        ('c-1', '2026-01-01T10:00Z'),
+        ('c-2', '2026-01-01T09:00Z')
+    ]
+
+def test_exports_and_archives_are_read_alike(analytics, tmp_path):
+    export_item = {'Item': {
+        'connector_id': {'S': 'c-1'},
+        'record_type': {'S': 'FILE'},
+        'status': {'S': 'COMPLETED'},
+        'bytes_transferred': {'N': '1000'},
+        'completed_at': {'S': '2026-01-01T09:15:00.000Z'},
+        'duration_ms': {'N': '250'}
+    }}
+    with gzip.open(tmp_path / 'export.json.gz', 'wt', encoding='utf-8') as export:
+        export.write(json.dumps(export_item) + '\n\n')
+    (tmp_path / 'archive.jsonl').write_text(json.dumps(transfer_item('c-1', 90000)) + '\n')
+
+    # Files are read in name order
+    archived, exported = analytics.read_export(str(tmp_path))
+
+    assert exported['duration_ms'] == 250 and exported['record_type'] == 'FILE'
+    assert archived['duration_ms'] == 90000
+    items = [archived, exported]
+    assert [row['timing'] for row in analytics.analyze(items)['connectors']] == ['exact', 'upper_bound']
+
+def test_table_output_explains_upper_bounds(analytics, tmp_path, capsys):
+    (tmp_path / 'archive.jsonl').write_text(json.dumps(transfer_item('c-1', 90000)) + '\n')
+
+    analytics.main(['--export', str(tmp_path)])
+
+    output = capsys.readouterr().out
+    assert 'timing' in output.splitlines()[1]
+    assert 'upper_bound: completion seen by the status check' in output
@@ -0,0 +1,164 @@
+# Copyright 2026 nnthanh101@gmail.com (oceansoft.io). Licensed under Apache-2.0. See LICENSE.
+"""Transfer latency and throughput report over the SFTP retrieve tracking table.
+
+Reads every item that carries duration_ms, which the retrieve examples write
+on finished transfers (dynamic) and on per-file records (static), either by
+scanning the table, from a DynamoDB export to S3 in DYNAMODB_JSON format, or
+from the tracking archive the TTL archiver writes, copied locally. Reports p50/p95/p99 latency and MB/s per connector and per
+connector and hour.
+
+Static per-file records are timed by the file's own result event. Dynamic
+transfer records only learn of completion when the status checker polls, so
+their durations are upper bounds, late by up to one check interval. They
+are reported in rows of their own with timing "upper_bound", and their
+MB/s is a lower bound.
+
+    python transfer_analytics.py --table <name> [--region us-east-1]
+    python transfer_analytics.py --export ./AWSDynamoDB/<export-id>/data
+    python transfer_analytics.py --export ./tracking-archive
+    python transfer_analytics.py --table <name> --format json
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+from decimal import Decimal
+
+PERCENTILES = (50, 95, 99)
+
+# How an item's duration_ms was measured
+EXACT = 'exact'
+UPPER_BOUND = 'upper_bound'
+
+def scan_table(table_name, region=None):
+    """Yield every item of the table, one Scan page at a time"""
+    import boto3
+
+    deserialize = deserializer()
+    paginator = boto3.client('dynamodb', region_name=region).get_paginator('scan')
+    for page in paginator.paginate(TableName=table_name):
+        for item in page['Items']:
+            yield {k: deserialize(v) for k, v in item.items()}
+
+def read_export(path):
+    """Yield every item of a DynamoDB export or tracking archive, one line at a time"""
+    deserialize = deserializer()
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(path)
+        for name in names
+        if name.endswith(('.json', '.json.gz', '.jsonl', '.jsonl.gz'))
+    )
+    for file_path in files:
+        opener = gzip.open if file_path.endswith('.gz') else open
+        with opener(file_path, 'rt', encoding='utf-8') as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                # Export lines wrap a typed item, archive lines are the plain item
+                if 'Item' in record:
+                    yield {k: deserialize(v) for k, v in record['Item'].items()}
+                else:
+                    yield record
+
+def deserializer():
+    from boto3.dynamodb.types import TypeDeserializer
+    return TypeDeserializer().deserialize
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+class Group:
+    """Running totals and latency samples for one connector or connector-hour"""
+
+    def __init__(self):
+        self.transfers = 0
+        self.failed = 0
+        self.bytes = 0
+        self.durations_ms = []
+
+    def add(self, item):
+        self.transfers += 1
+        if item.get('status') not in ('COMPLETED', None):
+            self.failed += 1
+        self.bytes += int(item.get('bytes_transferred', 0))
+        self.durations_ms.append(int(item['duration_ms']))
+
+    def report(self):
+        durations = sorted(self.durations_ms)
+        seconds = sum(durations) / 1000
+        report = {
+            'transfers': self.transfers,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            # Bytes over the summed transfer time, the rate a single transfer sustains
+            'mb_per_s': round(self.bytes / 1e6 / seconds, 3) if seconds else None
+        }
+        for pct in PERCENTILES:
+            report[f'p{pct}_ms'] = percentile(durations, pct)
+        return report
+
+def timing(item):
+    """EXACT for records timed by their own completion event, UPPER_BOUND for polled transfer records"""
+    return EXACT if item.get('record_type') == 'FILE' else UPPER_BOUND
+
+def analyze(items):
+    """Group timed items per connector and per connector and UTC hour of completion, apart by timing"""
+    by_connector, by_hour = {}, {}
+    for item in items:
+        if 'duration_ms' not in item or not item.get('completed_at'):
+            continue
+        connector_id = item.get('connector_id', 'unknown')
+        hour = item['completed_at'][:13] + ':00Z'
+        by_connector.setdefault((connector_id, timing(item)), Group()).add(item)
+        by_hour.setdefault((connector_id, hour, timing(item)), Group()).add(item)
+
+    return {
+        'connectors': [dict(connector_id=c, timing=t, **g.report()) for (c, t), g in sorted(by_connector.items())],
+        'hourly': [dict(connector_id=c, hour=h, timing=t, **g.report()) for (c, h, t), g in sorted(by_hour.items())]
+    }
+
+def print_table(title, rows, keys):
+    print(title)
+    if not rows:
+        print('  (no timed transfers)\n')
+        return
+    cells = [[str(row[k]) if row[k] is not None else '-' for k in keys] for row in rows]
+    widths = [max(len(k), *(len(c[i]) for c in cells)) for i, k in enumerate(keys)]
+    print('  ' + '  '.join(k.ljust(w) for k, w in zip(keys, widths)))
+    for c in cells:
+        print('  ' + '  '.join(v.ljust(w) for v, w in zip(c, widths)))
+    print()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--table', help='DynamoDB tracking table to scan')
+    source.add_argument('--export', help='DynamoDB export (DYNAMODB_JSON) or tracking archive file or directory, optionally gzipped')
+    parser.add_argument('--region', help='AWS region of the table')
+    parser.add_argument('--format', choices=('table', 'json'), default='table')
+    args = parser.parse_args(argv)
+
+    items = scan_table(args.table, args.region) if args.table else read_export(args.export)
+    report = analyze(items)
+
+    if args.format == 'json':
+        json.dump(report, sys.stdout, indent=2, default=lambda v: int(v) if isinstance(v, Decimal) else str(v))
+        print()
+        return
+
+    stats = ['timing', 'transfers', 'failed', 'bytes', 'mb_per_s'] + [f'p{pct}_ms' for pct in PERCENTILES]
+    print_table('Per connector', report['connectors'], ['connector_id'] + stats)
+    print_table('Per connector and hour (UTC)', report['hourly'], ['connector_id', 'hour'] + stats)
+    if any(row['timing'] == UPPER_BOUND for row in report['connectors']):
+        print(f"{UPPER_BOUND}: completion seen by the status check, latencies are up to one check interval high and MB/s low")
+
+if __name__ == '__main__':
+    main()